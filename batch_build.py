@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+
+from build_scheduler import FETCH_WORKERS, WRITE_WORKERS, BuildScheduler, Target, parse_targets
+from clients import POOL_SIZE, Clients
+from collection_builder import CollectionBuilder
+from id_index import TMDbIdIndex
+from journal import BuildJournal
+from library_cache import LibrarySnapshotCache
+from tmdb_cache import ResponseCache
+
+
+def load_spec(path):
+    # Read a collections spec from YAML (.yaml/.yml) or JSON.
+    # Either a list of collection definitions, or a mapping with a "collections" list
+    # plus optional defaults ("library", "prune", "targets").
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError(
+                    "PyYAML is required for YAML specs (pip install pyyaml), or use JSON."
+                ) from None
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    if isinstance(spec, list):
+        spec = {"collections": spec}
+    if not isinstance(spec, dict) or not isinstance(spec.get("collections"), list):
+        raise ValueError("Spec must be a list of collections or have a 'collections' list.")
+    library_name = spec.get("library", "Movies")
+    if "targets" in spec:
+        parse_targets(spec["targets"], library_name)
+    for i, definition in enumerate(spec["collections"], 1):
+        if not isinstance(definition, dict) or not definition.get("name"):
+            raise ValueError(f"Collection #{i} in the spec has no 'name'.")
+        if "targets" in definition:
+            parse_targets(definition["targets"], library_name)
+    return spec
+
+
+def spec_servers(spec, targets):
+    # Every Plex server the spec builds on (None = the default server)
+    servers = {target.server for target in targets}
+    for definition in spec["collections"]:
+        if "targets" in definition:
+            servers.update(
+                target.server
+                for target in parse_targets(definition["targets"], spec.get("library", "Movies"))
+            )
+        elif "library" in definition:
+            servers.add(None)
+    return servers
+
+
+def run_batch(
+    spec,
+    config,
+    library_cache_file,
+    tmdb_cache_file,
+    id_index_file=None,
+    fetch_workers=FETCH_WORKERS,
+    write_workers=WRITE_WORKERS,
+    pool_size=POOL_SIZE,
+    plex_backend=None,
+    journal_file=None,
+    fresh=False,
+):
+    # Build every collection in the spec with one Plex connection per server, one TMDb
+    # session and one library index per section, pipelined by BuildScheduler.
+    # With a journal_file, an unfinished earlier run of the same spec is resumed
+    # (fresh=True starts over). Returns a machine-readable summary dict.
+    started = time.monotonic()
+    summary = {"ok": 0, "errors": 0, "collections": []}
+
+    # Size the pools for every fetch and write worker so none of them waits for a connection
+    clients = Clients(
+        config,
+        ResponseCache(tmdb_cache_file),
+        pool_size=max(pool_size, fetch_workers, write_workers),
+        plex_backend=plex_backend,
+    )
+    journal = None
+    try:
+        library_name = spec.get("library", "Movies")
+        prune = spec.get("prune", True)
+        targets = parse_targets(spec["targets"], library_name) if "targets" in spec else None
+        servers = spec_servers(spec, targets or [Target(None, library_name)])
+
+        # The default server is connected up front so a bad config fails the whole run;
+        # other servers connect on first use, in their own write pool.
+        plex = None
+        if None in servers:
+            try:
+                plex = clients.plex
+            except ValueError as e:
+                summary["error"] = str(e)
+                return summary
+            except Exception as e:
+                summary["error"] = f"Could not connect to Plex: {e}"
+                return summary
+
+        id_index = TMDbIdIndex(id_index_file) if id_index_file else None
+        journal = BuildJournal(journal_file) if journal_file else None
+        if journal is not None:
+            journal.start(spec, fresh=fresh)
+            summary["run"] = {"id": journal.run_id, "resumed": journal.resumed}
+        library_cache = LibrarySnapshotCache(library_cache_file)
+        if plex is not None:
+            # Server names are recorded so `build --plan` finds their snapshots offline
+            library_cache.remember_server(None, plex.plex.machineIdentifier)
+        builder = CollectionBuilder(plex, library_cache, clients.tmdb, id_index, journal)
+        builders = {None: builder}
+        builders_lock = threading.Lock()
+
+        def builder_for(server):
+            plex = clients.plex_server(server)
+            with builders_lock:
+                if server not in builders or builders[server].plex is not plex:
+                    library_cache.remember_server(server, plex.plex.machineIdentifier)
+                    builders[server] = CollectionBuilder(
+                        plex, library_cache, clients.tmdb, id_index, journal
+                    )
+                return builders[server]
+
+        scheduler = BuildScheduler(builder, fetch_workers, write_workers, builder_for)
+        for result in scheduler.run(
+            spec["collections"], library_name=library_name, prune=prune, targets=targets
+        ):
+            summary["ok" if result["status"] == "ok" else "errors"] += 1
+            summary["collections"].append(result)
+        # Anything that failed is retried (and the rest skipped) by a rerun within
+        # journal.RESUME_WINDOW; after that the spec builds from scratch again
+        if journal is not None and not summary["errors"]:
+            journal.finish()
+    finally:
+        # Also on the early returns: the Plex and TMDb sessions are open from here on
+        clients.close()
+        if journal is not None:
+            journal.close()
+
+    summary["elapsed"] = round(time.monotonic() - started, 3)
+    return summary
@@ -0,0 +1,372 @@
+"""
+Local stand-ins for a Plex Media Server and the TMDb v3 API.
+
+They implement just enough of each HTTP API for plexapi and TMDbSearch to run
+every code path the collection builder uses, against a synthetic library of
+any size, with configurable per-request latency. Each server counts the
+requests it serves by category so benchmarks can report requests per stage.
+"""
+
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.sax.saxutils import quoteattr
+
+WORDS = (
+    "night dark star river blood last city storm iron silent golden lost wild "
+    "broken secret red winter black shadow fire ocean empire ghost dragon sky "
+    "king queen road house heart moon dead glass hidden little edge deep sun"
+).split()
+
+# Every Nth library item has no tmdb:// GUID, so it can only be matched by title
+NO_GUID_EVERY = 10
+# Every Nth TMDb movie has a slightly different title than Plex (case/punctuation)
+TITLE_VARIANT_EVERY = 20
+# TMDb knows this many more movies than the library holds (unmatched results)
+TMDB_EXTRA_RATIO = 0.1
+# Discover: a company owns every movie whose id is congruent to it modulo this
+COMPANY_MODULUS = 25
+DISCOVER_PAGE_SIZE = 20
+COLLECTION_SIZE = 12
+# /3/movie/<id> reports the lowest of the first N collection ids whose parts include it
+COLLECTION_LOOKUP = 100
+BASE_TIMESTAMP = 1_600_000_000
+SECTION_KEY = "1"
+MACHINE_ID = "benchmark-fake-plex"
+
+
+def synthetic_title(movie_id):
+    words = [WORDS[(movie_id * 7 + i * 13) % len(WORDS)] for i in range(1 + movie_id % 3)]
+    return " ".join(words).title() + f" {movie_id}"
+
+
+def synthetic_year(movie_id):
+    return 1950 + movie_id % 75
+
+
+class _Server:
+    # Shared plumbing: a threaded HTTP server on localhost, latency, request counts.
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.counts = Counter()
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def snapshot(self):
+        with self._lock:
+            return Counter(self.counts)
+
+    def _count(self, category, size):
+        with self._lock:
+            self.counts[category] += 1
+            self.bytes_sent += size
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without this every
+            # keep-alive response stalls on Nagle + delayed ACK (~40ms)
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _dispatch(self, method):
+                if server.latency:
+                    time.sleep(server.latency)
+                parsed = urlparse(self.path)
+                params = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+                for header in ("X-Plex-Container-Start", "X-Plex-Container-Size"):
+                    if header in self.headers:
+                        params.setdefault(header, self.headers[header])
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                category, status, content_type, body = server.handle(
+                    method, unquote(parsed.path), params, self.headers
+                )
+                payload = body.encode("utf-8")
+                server._count(category, len(payload))
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_PUT(self):
+                self._dispatch("PUT")
+
+            def do_DELETE(self):
+                self._dispatch("DELETE")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+        return Handler
+
+
+class FakePlexServer(_Server):
+    # A Plex server with one "Movies" section of `size` synthetic movies.
+
+    def __init__(self, size, latency=0.0):
+        super().__init__(latency)
+        self.movies = {}
+        for movie_id in range(1, size + 1):
+            self.movies[movie_id] = {
+                "title": synthetic_title(movie_id),
+                "year": synthetic_year(movie_id),
+                "tmdb": None if movie_id % NO_GUID_EVERY == 0 else movie_id,
+                "updatedAt": BASE_TIMESTAMP + movie_id,
+                "addedAt": BASE_TIMESTAMP + movie_id,
+                "collections": set(),
+            }
+        self.collections = {}  # title -> ratingKey
+        self._next_key = 10_000_000
+
+    def add_movie(self, movie_id):
+        # Simulate a newly added movie (for incremental refresh benchmarks)
+        with self._lock:
+            self.movies[movie_id] = {
+                "title": synthetic_title(movie_id),
+                "year": synthetic_year(movie_id),
+                "tmdb": movie_id,
+                "updatedAt": int(time.time()),
+                "addedAt": int(time.time()),
+                "collections": set(),
+            }
+
+    def _video(self, key):
+        movie = self.movies[key]
+        guids = f'<Guid id="tmdb://{movie["tmdb"]}"/>' if movie["tmdb"] else ""
+        tags = "".join(f"<Collection tag={quoteattr(c)}/>" for c in sorted(movie["collections"]))
+        return (
+            f'<Video ratingKey="{key}" key="/library/metadata/{key}" type="movie" '
+            f'title={quoteattr(movie["title"])} year="{movie["year"]}" '
+            f'librarySectionID="{SECTION_KEY}" updatedAt="{movie["updatedAt"]}" '
+            f'addedAt="{movie["addedAt"]}">{guids}{tags}</Video>'
+        )
+
+    def _container(self, inner, **attrs):
+        rendered = " ".join(f"{k}={quoteattr(str(v))}" for k, v in attrs.items())
+        return "plex", 200, "text/xml", f"<MediaContainer {rendered}>{''.join(inner)}</MediaContainer>"
+
+    def _page(self, keys, params, category):
+        start = int(params.get("X-Plex-Container-Start", 0))
+        size = int(params.get("X-Plex-Container-Size", 100))
+        page = keys[start : start + size]
+        _, status, content_type, body = self._container(
+            [self._video(key) for key in page],
+            size=len(page),
+            totalSize=len(keys),
+            librarySectionID=SECTION_KEY,
+        )
+        return category, status, content_type, body
+
+    def handle(self, method, path, params, headers):
+        with self._lock:
+            return self._handle(method, path, params)
+
+    def _handle(self, method, path, params):
+        if path == "/":
+            result = self._container(
+                [], machineIdentifier=MACHINE_ID, friendlyName="Benchmark", version="1.40.0"
+            )
+            return ("plex.root",) + result[1:]
+        if path in ("/library", "/library/"):
+            return ("plex.library",) + self._container([], title1="Plex Library")[1:]
+        if path.rstrip("/") == "/library/sections":
+            directory = (
+                f'<Directory key="{SECTION_KEY}" type="movie" title="Movies" '
+                'agent="tv.plex.agents.movie" scanner="Plex Movie" language="en-US" '
+                'uuid="benchmark-section"/>'
+            )
+            return ("plex.sections",) + self._container([directory], size=1)[1:]
+
+        section_all = f"/library/sections/{SECTION_KEY}/all"
+        if path == section_all and method == "PUT":
+            return self._edit(params)
+        if path == section_all and params.get("includeMeta") == "1":
+            meta = (
+                '<Meta><Type key="/library/sections/1/all?type=1" type="movie" '
+                'title="Movies" active="1"/>'
+                '<FieldType type="date"><Operator key="&gt;&gt;=" title="is after"/>'
+                '<Operator key="&lt;&lt;=" title="is before"/></FieldType>'
+                '<FieldType type="string"><Operator key="=" title="contains"/></FieldType>'
+                '<FieldType type="integer"><Operator key="=" title="is"/></FieldType></Meta>'
+            )
+            return ("plex.meta",) + self._container([meta], size=0)[1:]
+        if path == f"/library/sections/{SECTION_KEY}/collections":
+            return ("plex.meta",) + self._container(["<Meta/>"], size=0)[1:]
+        if path == section_all and params.get("type") == "18":
+            wanted = (params.get("title") or "").lower()
+            inner = [
+                f'<Directory ratingKey="{key}" key="/library/collections/{key}/children" '
+                f'type="collection" subtype="movie" title={quoteattr(title)} smart="0" '
+                f'librarySectionID="{SECTION_KEY}"/>'
+                for title, key in self.collections.items()
+                if wanted in title.lower()
+            ]
+            return ("plex.collections",) + self._container(inner, size=len(inner))[1:]
+        if path == section_all:
+            keys = sorted(self.movies)
+            category = "plex.list"
+            if "title" in params:
+                wanted = params["title"].lower()
+                keys = [k for k in keys if wanted in self.movies[k]["title"].lower()]
+                category = "plex.search"
+            if "year" in params:
+                keys = [k for k in keys if str(self.movies[k]["year"]) == params["year"]]
+            changed = next((v for k, v in params.items() if k.endswith("updatedAt>>")), None)
+            if changed is not None:
+                keys = [k for k in keys if self.movies[k]["updatedAt"] > int(changed)]
+                category = "plex.changes"
+            return self._page(keys, params, category)
+        if path.startswith("/library/collections/") and path.endswith("/children"):
+            collection_key = int(path.split("/")[3])
+            title = next((t for t, k in self.collections.items() if k == collection_key), None)
+            keys = sorted(k for k, m in self.movies.items() if title in m["collections"])
+            return self._page(keys, params, "plex.collection_items")
+        if path.startswith("/library/metadata/"):
+            keys = [int(k) for k in path.rsplit("/", 1)[1].split(",") if k.isdigit()]
+            keys = [k for k in keys if k in self.movies]
+            return self._page(keys, {"X-Plex-Container-Size": len(keys) or 1}, "plex.metadata")
+        return "plex.other", 404, "text/plain", "Not Found"
+
+    def _edit(self, params):
+        # Multi-item tag edit: ?id=1,2,3&collection[0].tag.tag=Name or collection[].tag.tag-=Name
+        keys = [int(k) for k in params.get("id", "").split(",") if k]
+        added = [v for k, v in params.items() if k.startswith("collection[") and k.endswith(".tag.tag")]
+        removed = params.get("collection[].tag.tag-")
+        now = int(time.time())
+        for title in added:
+            if title not in self.collections:
+                self.collections[title] = self._next_key
+                self._next_key += 1
+        for key in keys:
+            movie = self.movies.get(key)
+            if movie is None:
+                continue
+            movie["collections"].update(added)
+            if removed:
+                movie["collections"].discard(removed)
+            movie["updatedAt"] = now
+        return "plex.edit", 200, "text/xml", "<MediaContainer/>"
+
+
+class FakeTMDbServer(_Server):
+    # TMDb v3 endpoints used by TMDbSearch, over the same synthetic catalog as
+    # FakePlexServer plus TMDB_EXTRA_RATIO movies the library doesn't have.
+
+    def __init__(self, library_size, latency=0.0):
+        super().__init__(latency)
+        self.total = int(library_size * (1 + TMDB_EXTRA_RATIO))
+
+    def _movie(self, movie_id):
+        title = synthetic_title(movie_id)
+        if movie_id % TITLE_VARIANT_EVERY == 0:
+            title = title.upper() + "!"
+        return {
+            "id": movie_id,
+            "title": title,
+            "original_title": title,
+            "release_date": f"{synthetic_year(movie_id)}-01-01",
+        }
+
+    def _json(self, category, data):
+        return category, 200, "application/json", json.dumps(data)
+
+    def handle(self, method, path, params, headers):
+        if path == "/3/discover/movie":
+            # "a|b" asks for movies of any of the groups
+            value = (
+                params.get("with_companies")
+                or params.get("with_keywords")
+                or params.get("with_genres")
+                or "0"
+            )
+            ids = sorted(
+                {
+                    movie_id
+                    for group in map(int, value.split("|"))
+                    for movie_id in range(
+                        group % COMPANY_MODULUS or COMPANY_MODULUS, self.total + 1, COMPANY_MODULUS
+                    )
+                }
+            )
+            page = int(params.get("page", 1))
+            total_pages = max(1, -(-len(ids) // DISCOVER_PAGE_SIZE))
+            chunk = ids[(page - 1) * DISCOVER_PAGE_SIZE : page * DISCOVER_PAGE_SIZE]
+            return self._json(
+                "tmdb.discover",
+                {
+                    "page": page,
+                    "total_pages": total_pages,
+                    "total_results": len(ids),
+                    "results": [self._movie(i) for i in chunk],
+                },
+            )
+        if path.startswith("/3/collection/"):
+            collection_id = int(path.rsplit("/", 1)[1])
+            parts = [
+                self._movie((collection_id * 97 + i * 31) % self.total + 1)
+                for i in range(COLLECTION_SIZE)
+            ]
+            return self._json("tmdb.collection", {"id": collection_id, "parts": parts})
+        if path.startswith("/3/movie/"):
+            movie_id = int(path.rsplit("/", 1)[1])
+            group = movie_id % COMPANY_MODULUS or COMPANY_MODULUS
+            collection = next(
+                (
+                    c
+                    for c in range(1, COLLECTION_LOOKUP + 1)
+                    if any((c * 97 + i * 31) % self.total + 1 == movie_id for i in range(COLLECTION_SIZE))
+                ),
+                None,
+            )
+            return self._json(
+                "tmdb.movie",
+                {
+                    **self._movie(movie_id),
+                    "belongs_to_collection": {"id": collection} if collection else None,
+                    # Discover treats company and keyword ids alike: the id's residue
+                    "production_companies": [{"id": group}],
+                    "keywords": {"keywords": [{"id": group}]},
+                },
+            )
+        if path == "/3/search/movie":
+            wanted = params.get("query", "").lower()
+            results = [self._movie(i) for i in range(1, self.total + 1) if wanted in synthetic_title(i).lower()]
+            return self._json("tmdb.search", {"page": 1, "results": results[:20]})
+        return "tmdb.other", 404, "application/json", json.dumps({"status_message": "Not found"})
@@ -0,0 +1,91 @@
+"""
+Time budget for fuzzy title matching.
+
+Builds a TitleMatcher over a synthetic library and times a batch of misspelt
+queries against it, on two corpora: the benchmark library's titles (each ends
+in its id, so trigrams are fairly selective) and titles drawn from a small
+vocabulary (every query shares its common trigrams with much of the library).
+The library corpus must stay under the budget; the small vocabulary is the
+worst case and is only reported:
+
+    python -m benchmarks.matcher
+    python -m benchmarks.matcher --titles 50000 --queries 5000 --budget-ms 2500
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from benchmarks.fake_servers import WORDS, synthetic_title, synthetic_year
+from title_matcher import TitleMatcher
+
+# Milliseconds allowed for the default 2000 lookups against 20000 library titles
+SEARCH_BUDGET_MS = 1000
+
+
+def small_vocabulary_title(rng):
+    return " ".join(rng.choice(WORDS[:12]) for _ in range(rng.randint(2, 5))).title()
+
+
+def misspell(title, rng):
+    # Drop, double or swap one letter, the way titles come out of hand-written lists
+    chars = list(title)
+    at = rng.randrange(len(chars) - 1)
+    edit = rng.randrange(3)
+    if edit == 0:
+        del chars[at]
+    elif edit == 1:
+        chars.insert(at, chars[at])
+    else:
+        chars[at], chars[at + 1] = chars[at + 1], chars[at]
+    return "".join(chars)
+
+
+def bench_corpus(titles, queries, rng):
+    matcher = TitleMatcher()
+    started = time.perf_counter()
+    for movie_id, title in enumerate(titles, 1):
+        matcher.add(movie_id, title, synthetic_year(movie_id))
+    build_ms = (time.perf_counter() - started) * 1000
+
+    picks = [rng.randrange(len(titles)) for _ in range(queries)]
+    batch = [(misspell(titles[i], rng), synthetic_year(i + 1)) for i in picks]
+    started = time.perf_counter()
+    found = sum(1 for title, year in batch if matcher.search(title, year))
+    search_ms = (time.perf_counter() - started) * 1000
+    return {
+        "build_ms": round(build_ms, 1),
+        "search_ms": round(search_ms, 1),
+        "matched": found,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the fuzzy title matching budget.")
+    parser.add_argument("--titles", type=int, default=20000, help="Library size (default %(default)s).")
+    parser.add_argument("--queries", type=int, default=2000, help="Lookups to time (default %(default)s).")
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=SEARCH_BUDGET_MS,
+        help="Maximum time for all lookups on the library corpus (default %(default)s ms).",
+    )
+    args = parser.parse_args(argv)
+
+    rng = random.Random(0)
+    corpora = {
+        "library": [synthetic_title(i) for i in range(1, args.titles + 1)],
+        "small_vocabulary": [small_vocabulary_title(rng) for _ in range(args.titles)],
+    }
+    result = {"titles": args.titles, "queries": args.queries, "budget_ms": args.budget_ms}
+    for name, titles in corpora.items():
+        result[name] = bench_corpus(titles, args.queries, rng)
+    result["ok"] = result["library"]["search_ms"] <= args.budget_ms
+    print(json.dumps(result, indent=2))
+    return 0 if result["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
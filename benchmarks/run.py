@@ -0,0 +1,264 @@
+"""
+Offline benchmark suite for the collection builder.
+
+Starts a FakePlexServer and a FakeTMDbServer on localhost, then times each
+stage of a build (library snapshot, title lookups, TMDb fetches, matching and
+end-to-end spec builds) against synthetic libraries, counting the HTTP
+requests every stage sends. Results are written as JSON so two commits can be
+compared:
+
+    python -m benchmarks.run --sizes 1000,10000 --output before.json
+    python -m benchmarks.run --sizes 1000,10000 --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_servers import (
+    COMPANY_MODULUS,
+    FakePlexServer,
+    FakeTMDbServer,
+    synthetic_title,
+    synthetic_year,
+)
+from build_scheduler import FETCH_WORKERS, WRITE_WORKERS, BuildScheduler
+from collection_builder import CollectionBuilder, match_sources
+from library_cache import LibrarySnapshotCache
+from plex_manager import PlexManager
+from tmdb_search import TMDbSearch
+
+DEFAULT_SIZES = (1000, 10000, 50000)
+# Titles looked up by name in the find_movies stage
+TITLE_SAMPLE = 200
+# Movies added to the server between the cold and warm snapshot loads
+NEW_MOVIES = 25
+# A regression is reported when a stage gets this much slower than the baseline
+REGRESSION_RATIO = 1.2
+FAKE_TOKEN = "benchmark-token"
+FAKE_API_KEY = "benchmark-key"
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _spec(collections):
+    # A batch build mixing every source type, with one duplicated discover source
+    specs = [
+        {"name": "Bench Company", "company": 7},
+        {"name": "Bench Keyword", "keyword": 11},
+        {"name": "Bench Company Again", "company": 7},
+        {"name": "Bench Titles", "titles": [f"{synthetic_title(i)} ({synthetic_year(i)})" for i in range(3, 300, 3)]},
+    ]
+    specs.extend({"name": f"Bench Collection {i}", "collection": i} for i in range(1, collections + 1))
+    return specs
+
+
+class StageTimer:
+    # Times named stages and records the requests each server served during them.
+
+    def __init__(self, *servers):
+        self.servers = servers
+        self.stages = {}
+
+    def run(self, name, fn, *args, **kwargs):
+        before = [server.snapshot() for server in self.servers]
+        sent_before = [server.bytes_sent for server in self.servers]
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+        requests = {}
+        for server, counts in zip(self.servers, before):
+            for category, count in (server.snapshot() - counts).items():
+                requests[category] = count
+        self.stages[name] = {
+            "seconds": round(elapsed, 4),
+            "requests": dict(sorted(requests.items())),
+            "total_requests": sum(requests.values()),
+            "bytes": sum(s.bytes_sent - b for s, b in zip(self.servers, sent_before)),
+        }
+        return result
+
+
+def bench_size(size, plex_latency, tmdb_latency, collections, workdir, plex_backend="plexapi"):
+    # Run every stage against a fresh pair of servers holding `size` movies.
+    if plex_backend == "async":
+        from plex_async import AsyncPlexManager as manager
+    else:
+        manager = PlexManager
+    with FakePlexServer(size, plex_latency) as plex_server, FakeTMDbServer(
+        size, tmdb_latency
+    ) as tmdb_server:
+        timer = StageTimer(plex_server, tmdb_server)
+        cache_file = os.path.join(workdir, f"library_{size}.sqlite")
+        library_cache = LibrarySnapshotCache(cache_file)
+
+        plex = timer.run("connect", manager, FAKE_TOKEN, plex_server.url)
+        library = plex.plex.library.section("Movies")
+        server_id = plex.plex.machineIdentifier
+
+        index = timer.run(
+            "snapshot_cold",
+            library_cache.load_index,
+            server_id,
+            library,
+            loader=plex.section_items,
+            counter=plex.section_size,
+        )
+        for movie_id in range(size + 1, size + NEW_MOVIES + 1):
+            plex_server.add_movie(movie_id)
+        index = timer.run(
+            "snapshot_warm",
+            library_cache.load_index,
+            server_id,
+            library,
+            loader=plex.section_items,
+            counter=plex.section_size,
+        )
+
+        step = max(1, size // TITLE_SAMPLE)
+        titles = [synthetic_title(i) for i in range(1, size + 1, step)][:TITLE_SAMPLE]
+        found = timer.run("find_movies", plex.find_movies, library, titles, index)
+
+        tmdb = TMDbSearch(FAKE_API_KEY, base_url=tmdb_server.url + "/3")
+        discovered = timer.run("discover", tmdb.discover_movies, company_id=COMPANY_MODULUS - 1)
+        parts = timer.run("tmdb_collection", tmdb.get_movies_from_collection, 1)
+        matched, unmatched = timer.run("match", match_sources, index, discovered + parts)
+
+        builder = CollectionBuilder(plex, library_cache, tmdb)
+        scheduler = BuildScheduler(builder, FETCH_WORKERS, WRITE_WORKERS)
+        builds = timer.run("build", scheduler.run, _spec(collections))
+        # Same spec again: every collection exists, so only the diff is applied
+        timer.run("rebuild", scheduler.run, _spec(collections))
+        library_cache.close()
+        if plex_backend == "async":
+            plex.close()
+
+    return {
+        "size": size,
+        "plex_backend": plex_backend,
+        "plex_latency_ms": round(plex_latency * 1000, 3),
+        "tmdb_latency_ms": round(tmdb_latency * 1000, 3),
+        "counts": {
+            "titles_looked_up": len(titles),
+            "titles_found": len(found),
+            "discovered": len(discovered),
+            "matched": len(matched),
+            "unmatched": len(unmatched),
+            "collections_built": sum(1 for r in builds if r["status"] == "ok"),
+        },
+        "stages": timer.stages,
+    }
+
+
+def compare(results, baseline):
+    # Print per-stage time and request deltas against a previous results file.
+    # Returns the number of stages that regressed.
+    old_runs = {run["size"]: run for run in baseline.get("runs", [])}
+    regressions = 0
+    print(f"Comparing against {baseline.get('commit') or 'baseline'}:", file=sys.stderr)
+    for run in results["runs"]:
+        old = old_runs.get(run["size"])
+        if old is None:
+            continue
+        for name, stage in run["stages"].items():
+            previous = old["stages"].get(name)
+            if previous is None:
+                continue
+            ratio = stage["seconds"] / previous["seconds"] if previous["seconds"] else 1.0
+            request_delta = stage["total_requests"] - previous["total_requests"]
+            flag = ""
+            if ratio > REGRESSION_RATIO or request_delta > 0:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(
+                f"  {run['size']:>6} {name:<16} {previous['seconds']:>8.3f}s -> "
+                f"{stage['seconds']:>8.3f}s ({ratio:5.2f}x)  requests "
+                f"{previous['total_requests']} -> {stage['total_requests']}{flag}",
+                file=sys.stderr,
+            )
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark collection builds against local fake servers.")
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in DEFAULT_SIZES),
+        help="Comma-separated library sizes (default %(default)s).",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Per-request Plex latency in milliseconds."
+    )
+    parser.add_argument(
+        "--tmdb-latency",
+        type=float,
+        default=None,
+        help="Per-request TMDb latency in milliseconds (defaults to --latency).",
+    )
+    parser.add_argument(
+        "--collections", type=int, default=10, help="TMDb collections in the batch build stage."
+    )
+    parser.add_argument(
+        "--plex-backend",
+        choices=("plexapi", "async"),
+        default="plexapi",
+        help="Plex client to benchmark (default %(default)s).",
+    )
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout.")
+    parser.add_argument("--compare", help="Previous results file to compare against.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    plex_latency = args.latency / 1000
+    tmdb_latency = (args.latency if args.tmdb_latency is None else args.tmdb_latency) / 1000
+
+    results = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "runs": [],
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            print(f"Benchmarking {size} movies...", file=sys.stderr)
+            results["runs"].append(
+                bench_size(
+                    size, plex_latency, tmdb_latency, args.collections, workdir, args.plex_backend
+                )
+            )
+
+    rendered = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(rendered + "\n")
+    else:
+        print(rendered)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        return 1 if compare(results, baseline) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
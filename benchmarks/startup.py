@@ -0,0 +1,92 @@
+"""
+Startup-time budget for the CLI.
+
+Runs `python -X importtime -c "import main"` in a fresh interpreter and checks
+that importing the entry point stays under budget and never pulls in the
+heavy client libraries, which only the modes that talk to a server load.
+Also times `main.py --help` end to end, interpreter start-up included:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --budget-ms 20 --runs 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Cumulative import time of main.py, in milliseconds
+IMPORT_BUDGET_MS = 30
+# Modules that must not be imported just to start the CLI
+HEAVY_MODULES = ("plexapi", "requests", "urllib3", "tmdbv3api", "sqlite3")
+
+
+def import_times():
+    # {module: cumulative microseconds} for one `import main` in a fresh interpreter
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        cumulative = cumulative.strip()
+        if cumulative.isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def wall_time(args, runs):
+    # Best of `runs` for a full interpreter run, in milliseconds
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT, capture_output=True, check=True)
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the CLI's startup-time budget.")
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=IMPORT_BUDGET_MS,
+        help="Maximum cumulative import time of main.py (default %(default)s ms).",
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Wall-clock runs to take the best of.")
+    args = parser.parse_args(argv)
+
+    times = import_times()
+    import_ms = times.get("main", 0) / 1000
+    heavy = sorted(name for name in times if name.split(".")[0] in HEAVY_MODULES)
+    result = {
+        "import_main_ms": round(import_ms, 1),
+        "budget_ms": args.budget_ms,
+        "python_startup_ms": round(wall_time(["-c", "pass"], args.runs), 1),
+        "help_ms": round(wall_time(["main.py", "--help"], args.runs), 1),
+        "heavy_imports": heavy,
+        "slowest_imports": dict(
+            sorted(
+                ((name, round(us / 1000, 2)) for name, us in times.items() if name != "main"),
+                key=lambda item: item[1],
+                reverse=True,
+            )[:10]
+        ),
+    }
+    result["ok"] = import_ms <= args.budget_ms and not heavy
+    print(json.dumps(result, indent=2))
+    return 0 if result["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+import threading
+from collections import Counter, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+from collection_builder import source_key
+from defaults import FETCH_WORKERS, WRITE_WORKERS
+
+# A Plex section to build a collection in; server None is the default server in config.json
+Target = namedtuple("Target", "server library")
+
+
+def parse_targets(value, library_name="Movies"):
+    # Spec "targets" as Targets. Each entry is a section name or
+    # {"server": <name under SERVERS in config.json>, "library": <section>}.
+    if not isinstance(value, list) or not value:
+        raise ValueError("'targets' must be a non-empty list of sections.")
+    targets = []
+    for entry in value:
+        if isinstance(entry, str):
+            targets.append(Target(None, entry))
+        elif isinstance(entry, dict):
+            targets.append(Target(entry.get("server"), entry.get("library", library_name)))
+        else:
+            raise ValueError(f"Invalid target {entry!r}: use a section name or server/library.")
+    return targets
+
+
+def definition_targets(definition, targets=None, library_name="Movies"):
+    # A definition's own "targets" or "library", else the run's targets
+    if "targets" in definition:
+        return parse_targets(definition["targets"], library_name)
+    if "library" in definition:
+        return [Target(None, definition["library"])]
+    return targets or [Target(None, library_name)]
+
+
+def target_label(target):
+    return target.server or "default"
+
+
+class SingleFlight:
+    # Deduplicates identical in-flight calls: while one thread is running the call
+    # for a key, other callers with the same key wait for and share its result.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._calls[key] = future
+        if owner:
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._calls[key]
+        return future.result()
+
+
+class BuildScheduler:
+    # Runs many collection builds as a pipeline:
+    #   fetch (TMDb, fetch_workers threads) -> resolve + apply (snapshot refresh,
+    #   matching against the shared library index and Plex writes, in a pool of
+    #   write_workers threads per server)
+    # so one collection's writes overlap the next one's TMDb fetches. The fetch
+    # pool only ever talks to TMDb: a slow Plex server ties up its own pool, never
+    # the fetches of collections bound for other servers. A source used by several
+    # definitions is fetched once.
+    #
+    # A collection can target several sections on several servers. Its sources
+    # are then fetched once, and each target is matched and written in the thread
+    # pool of its own server. builder_for(server) returns the CollectionBuilder
+    # for a named server.
+
+    def __init__(
+        self, builder, fetch_workers=FETCH_WORKERS, write_workers=WRITE_WORKERS, builder_for=None
+    ):
+        self.builder = builder
+        self.builder_for = builder_for or (lambda server: builder)
+        self.fetch_workers = max(1, fetch_workers)
+        self.write_workers = max(1, write_workers)
+        self.fetches = SingleFlight()
+
+    def _fetch(self, definition, shared):
+        # Sources shared by several definitions are fetched by whichever asks first
+        key = source_key(definition, self.builder.id_index)
+        if key in shared:
+            return self.fetches.do(key, lambda: self.builder.fetch_sources(definition))
+        return self.builder.fetch_sources(definition)
+
+    def _build_target(self, definition, target, sources, prune):
+        # Runs in the target server's pool: (re)connecting, the snapshot refresh,
+        # matching and writes. A journaled, finished build returns its stored summary.
+        builder = self.builder_for(target.server)
+        done = builder.completed(definition, target.library)
+        if done is not None:
+            return done
+        library, found, not_found = builder.resolve(definition, sources, target.library)
+        return builder.apply(definition, library, found, not_found, prune)
+
+    def run(self, definitions, library_name="Movies", prune=True, targets=None):
+        # Build every definition; returns per-collection summaries in input order.
+        # Collections with several targets get a "targets" list of per-section summaries.
+        results = [None] * len(definitions)
+
+        def failed(i, error):
+            results[i] = {"name": definitions[i]["name"], "status": "error", "error": str(error)}
+
+        keys = Counter()
+        plans = []
+        for i, definition in enumerate(definitions):
+            try:
+                keys[source_key(definition, self.builder.id_index)] += 1
+            except Exception:
+                pass  # reported by the fetch below
+            try:
+                plans.append(definition_targets(definition, targets, library_name))
+            except ValueError as e:
+                plans.append(None)
+                failed(i, e)
+        shared = {key for key, count in keys.items() if count > 1}
+
+        pools = {}  # server -> write pool
+
+        def pool(server):
+            if server not in pools:
+                pools[server] = ThreadPoolExecutor(self.write_workers)
+            return pools[server]
+
+        per_target = {}  # definition index -> [summary per target]
+        try:
+            with ThreadPoolExecutor(self.fetch_workers) as fetch_pool:
+                fetches = {}
+                for i, definition in enumerate(definitions):
+                    if plans[i] is not None:
+                        fetches[fetch_pool.submit(self._fetch, definition, shared)] = i
+
+                writes = {}
+                for future in as_completed(fetches):
+                    i = fetches[future]
+                    plan = plans[i]
+                    try:
+                        sources = future.result()
+                    except Exception as e:
+                        failed(i, e)
+                        continue
+                    if len(plan) > 1:
+                        per_target[i] = [None] * len(plan)
+                    for t, target in enumerate(plan):
+                        write = pool(target.server).submit(
+                            self._build_target, definitions[i], target, sources, prune
+                        )
+                        writes[write] = (i, t if len(plan) > 1 else None)
+
+            for future in as_completed(writes):
+                i, t = writes[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if t is None:
+                        failed(i, e)
+                        continue
+                    result = {"status": "error", "error": str(e)}
+                else:
+                    result["status"] = "error" if result.get("failed") else "ok"
+                    if t is not None:
+                        del result["name"]
+                if t is None:
+                    results[i] = result
+                    continue
+                target = plans[i][t]
+                per_target[i][t] = {
+                    "server": target_label(target),
+                    "library": target.library,
+                    **result,
+                }
+        finally:
+            for executor in pools.values():
+                executor.shutdown()
+
+        for i, summaries in per_target.items():
+            ok = all(summary["status"] == "ok" for summary in summaries)
+            results[i] = {
+                "name": definitions[i]["name"],
+                "status": "ok" if ok else "error",
+                "targets": summaries,
+            }
+        return results
@@ -0,0 +1,260 @@
+import json
+import os
+import threading
+from bisect import bisect_left
+
+FALLBACK_FILE = os.path.join(os.path.dirname(__file__), "fallback_collections.json")
+# Optional user catalog merged over the built-ins:
+#   {"Collections": {"Name": <TMDb collection id>, ...},
+#    "Studios": {"Name": {"company": <id>} or {"keyword": <id>}, ...}}
+# A studio may list several ids ({"company": [41077, 90733]}): any of them matches.
+USER_CATALOG_FILE = os.path.join(os.path.dirname(__file__), "catalog.json")
+
+# Hardcoded TMDB collection IDs and studios
+KNOWN_COLLECTIONS = {
+    "Alien": 8091,
+    "Back to the Future": 264,
+    "Despicable Me": 86066,
+    "Evil Dead": 1960,
+    "Fast & Furious": 9485,
+    "Harry Potter": 1241,
+    "The Hunger Games": 131635,
+    "Indiana Jones": 84,
+    "James Bond": 645,
+    "John Wick": 404609,
+    "Jurassic Park": 328,
+    "The Lord of the Rings": 119,
+    "The Matrix": 2344,
+    "Mission: Impossible": 87359,
+    "Ocean's": 304,
+    "Pirates of the Caribbean": 295,
+    "Planet of the Apes": 173710,
+    "Scream": 2602,
+    "Shrek": 2150,
+    "Sonic the Hedgehog": 720879,
+    "Star Trek": 115575,
+    "Star Wars": 10,
+    "The Dark Knight": 263,
+    "The Twilight Saga": 33514,
+}
+STUDIO_MAP = {
+    "a24": {"company": 41077},
+    "pixar": {"company": 3},
+    "studio ghibli": {"company": 10342},
+    "mcu": {"keyword": 180547},
+    "dceu": {"keyword": 229266},
+}
+# Built-in studio keys shown in capitals rather than title case
+_ACRONYMS = ("mcu", "dceu")
+
+
+def normalize_name(name):
+    # Case- and whitespace-insensitive form used for every catalog lookup
+    return " ".join(str(name).casefold().split())
+
+
+class Catalog:
+    # Read-only name -> value mapping with the views the menus need, built once:
+    # names in display order, case-insensitive lookup, and prefix search over a
+    # sorted key list (bisect), so catalogs with thousands of entries stay instant.
+    # Names starting with "The " can also be found without it.
+
+    def __init__(self, entries):
+        self._entries = dict(entries)
+        self.sorted_names = tuple(sorted(self._entries, key=normalize_name))
+        self._by_norm = {}
+        prefix_keys = []
+        for name in self.sorted_names:
+            norm = normalize_name(name)
+            self._by_norm.setdefault(norm, name)
+            prefix_keys.append((norm, name))
+            if norm.startswith("the "):
+                prefix_keys.append((norm[4:], name))
+        prefix_keys.sort()
+        self._prefix_keys = prefix_keys
+        self._prefix_norms = [norm for norm, _ in prefix_keys]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self.sorted_names)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __getitem__(self, name):
+        return self._entries[name]
+
+    def get(self, name, default=None):
+        return self._entries.get(name, default)
+
+    def keys(self):
+        return self.sorted_names
+
+    def lookup(self, name):
+        # Canonical name for a case-insensitive match, or None
+        return self._by_norm.get(normalize_name(name))
+
+    def value(self, name, default=None):
+        # Value for a case-insensitive name
+        canonical = self.lookup(name)
+        return self._entries[canonical] if canonical is not None else default
+
+    def prefix(self, text, limit=None):
+        # Canonical names starting with text (case-insensitive), in display order
+        norm = normalize_name(text)
+        if not norm:
+            return []
+        matches = []
+        seen = set()
+        for i in range(bisect_left(self._prefix_norms, norm), len(self._prefix_norms)):
+            if not self._prefix_norms[i].startswith(norm):
+                break
+            name = self._prefix_keys[i][1]
+            if name not in seen:
+                seen.add(name)
+                matches.append(name)
+        matches.sort(key=normalize_name)
+        return matches[:limit] if limit else matches
+
+
+class _FileCache:
+    # Parsed JSON files, reloaded only when their mtime or size changes
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = {}  # path -> (stamp, data)
+        self._views = {}  # view key -> (stamps, Catalog)
+
+    @staticmethod
+    def stamp(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self, path, validate):
+        stamp = self.stamp(path)
+        with self._lock:
+            cached = self._files.get(path)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+        if stamp is None:
+            data = {}
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            validate(path, data)
+        with self._lock:
+            self._files[path] = (stamp, data)
+        return data
+
+    def view(self, key, paths, build):
+        # Memoize a Catalog built from `paths` until any of them changes on disk
+        stamps = tuple(self.stamp(path) for path in paths)
+        with self._lock:
+            cached = self._views.get(key)
+            if cached is not None and cached[0] == stamps:
+                return cached[1]
+        catalog = build()
+        with self._lock:
+            self._views[key] = (stamps, catalog)
+        return catalog
+
+
+_cache = _FileCache()
+
+
+def _is_id(value):
+    return isinstance(value, int) or (isinstance(value, str) and value.isdigit())
+
+
+def _is_ids(value):
+    # One id, or a non-empty list of them
+    if isinstance(value, list):
+        return bool(value) and all(_is_id(item) for item in value)
+    return _is_id(value)
+
+
+def _ids(value):
+    # int for one id, a tuple of ints for several
+    if isinstance(value, list):
+        return tuple(int(item) for item in value)
+    return int(value)
+
+
+def _merge(entries, overrides):
+    # User entries replace built-ins with the same name in any case
+    by_norm = {normalize_name(name): name for name in entries}
+    for name, value in overrides:
+        entries.pop(by_norm.get(normalize_name(name)), None)
+        entries[name] = value
+    return entries
+
+
+def _validate_fallback(path, data):
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: expected an object of sections.")
+    for section, entries in data.items():
+        if not isinstance(entries, dict):
+            raise ValueError(f"{path}: section '{section}' must map names to title lists.")
+        for name, titles in entries.items():
+            if not isinstance(titles, list) or not all(isinstance(t, str) for t in titles):
+                raise ValueError(f"{path}: '{section}/{name}' must be a list of titles.")
+
+
+def _validate_user_catalog(path, data):
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: expected an object with 'Collections' and/or 'Studios'.")
+    for name, collection_id in (data.get("Collections") or {}).items():
+        if not _is_id(collection_id):
+            raise ValueError(f"{path}: collection '{name}' needs a numeric TMDb id.")
+    for name, info in (data.get("Studios") or {}).items():
+        if not isinstance(info, dict) or not any(
+            _is_ids(info.get(field)) for field in ("company", "keyword")
+        ):
+            raise ValueError(
+                f"{path}: studio '{name}' needs a numeric 'company' or 'keyword' id (or a list)."
+            )
+
+
+def load_fallback_data(section):
+    # Load fallback data for a given section from fallback_collections.json.
+    # Parsed once and reused until the file changes; callers must not modify the result.
+    return _cache.load(FALLBACK_FILE, _validate_fallback).get(section, {})
+
+
+def fallback_catalog(section):
+    # Fallback title lists for a section ("Franchises", "Studios") as a Catalog
+    return _cache.view(
+        ("fallback", section), (FALLBACK_FILE,), lambda: Catalog(load_fallback_data(section))
+    )
+
+
+def collection_catalog(user_file=USER_CATALOG_FILE):
+    # Collection name -> TMDb collection id: the built-ins plus the user catalog
+    def build():
+        user = _cache.load(user_file, _validate_user_catalog).get("Collections") or {}
+        overrides = ((name, int(collection_id)) for name, collection_id in user.items())
+        return Catalog(_merge(dict(KNOWN_COLLECTIONS), overrides))
+
+    return _cache.view(("collections", user_file), (user_file,), build)
+
+
+def studio_catalog(user_file=USER_CATALOG_FILE):
+    # Studio display name -> {"company": id(s)} / {"keyword": id(s)}, built-ins plus the user catalog
+    def build():
+        user = _cache.load(user_file, _validate_user_catalog).get("Studios") or {}
+        entries = {
+            (key.upper() if key in _ACRONYMS else key.title()): info
+            for key, info in STUDIO_MAP.items()
+        }
+        overrides = (
+            (name, {field: _ids(info[field]) for field in ("company", "keyword") if info.get(field)})
+            for name, info in user.items()
+        )
+        return Catalog(_merge(entries, overrides))
+
+    return _cache.view(("studios", user_file), (user_file,), build)
@@ -0,0 +1,196 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import profiling
+from defaults import POOL_SIZE
+from rate_limit import controller
+
+# Retries for dropped connections (transport level, reusing the pool so a flaky
+# cross-network link doesn't cost a new TLS handshake) and for 429/5xx answers
+# (ControlledAdapter, through the shared rate controller).
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# 5xx answers are only retried for methods that are safe to repeat; 429 always is
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "PUT", "DELETE", "OPTIONS"))
+
+
+def should_retry(method, status):
+    return status == 429 or (status in RETRY_STATUSES and method.upper() in IDEMPOTENT_METHODS)
+
+
+class ControlledAdapter(HTTPAdapter):
+    # Sends every request through the host's rate_limit.HostLimiter: it waits for
+    # a concurrency slot and a rate token, reports the outcome so the host's limits
+    # adapt, and retries throttled or failed answers after a jittered backoff
+    # (or the server's Retry-After).
+
+    def __init__(self, rate_controller=None, retries=RETRIES, **kwargs):
+        self.rate_controller = rate_controller or controller()
+        self.retries = retries
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        limiter = self.rate_controller.limiter(request.url)
+        attempt = 0
+        while True:
+            limiter.acquire()
+            started = time.monotonic()
+            resp, no_answer = None, False
+            try:
+                resp = super().send(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                no_answer = True
+                raise
+            finally:
+                # The slot is given back whatever happened, or the host would end
+                # up stuck at its concurrency cap
+                elapsed = time.monotonic() - started
+                if resp is not None:
+                    limiter.release(elapsed, resp.status_code)
+                elif no_answer:
+                    limiter.release(elapsed)
+                else:
+                    limiter.abandon()
+            if attempt >= self.retries or not should_retry(request.method, resp.status_code):
+                return resp
+            delay = limiter.retry_delay(attempt, resp.headers.get("Retry-After"))
+            resp.close()
+            profiling.record_retry()
+            time.sleep(delay)
+            attempt += 1
+
+
+def make_session(service, pool_size=POOL_SIZE, retries=RETRIES, rate_controller=None):
+    # A pooled keep-alive session whose requests go through the shared rate
+    # controller (per-host concurrency/rate budgets, Retry-After, backoff).
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=0,
+        backoff_factor=BACKOFF_FACTOR,
+        raise_on_status=False,
+    )
+    adapter = ControlledAdapter(
+        rate_controller,
+        retries=retries,
+        pool_connections=4,
+        pool_maxsize=pool_size,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return profiling.instrument_session(session, service)
+
+
+class Clients:
+    # Process-wide Plex and TMDb clients, created on first use and then shared.
+    # Nothing connects until a caller asks for .plex or .tmdb, so menus and
+    # headless commands that never touch a server never wait on one. Changing
+    # credentials in the config replaces only the affected client.
+    # Besides the default server (PLEX_URL / PLEX_TOKEN), config.json may name more:
+    #   "SERVERS": {"office": {"PLEX_URL": "...", "PLEX_TOKEN": "..."}}
+    # Each server connects on its own, so a slow one never holds up the others.
+
+    def __init__(self, config, tmdb_cache=None, pool_size=POOL_SIZE, plex_backend=None):
+        self.config = config
+        self.tmdb_cache = tmdb_cache
+        self.pool_size = pool_size
+        # "plexapi" (default) or "async" (plex_async.AsyncPlexManager, needs aiohttp)
+        self.plex_backend = plex_backend
+        self._lock = threading.Lock()
+        self._plex = {}  # server name (None = default) -> (credentials, PlexManager)
+        self._connect_locks = {}
+        self._tmdb = None
+        self._tmdb_key = None
+        self._sessions = {}
+
+    def session(self, service, server=None):
+        # One session per service (and Plex server) for the life of the process
+        key = (service, server)
+        with self._lock:
+            if key not in self._sessions:
+                self._sessions[key] = make_session(service, self.pool_size)
+            return self._sessions[key]
+
+    def servers(self):
+        # Names of the configured Plex servers; None is the default one
+        return [None] + sorted(self.config.get("SERVERS") or {})
+
+    @property
+    def plex(self):
+        # PlexManager for the default server; raises ValueError without credentials.
+        return self.plex_server(None)
+
+    def plex_server(self, name=None):
+        # PlexManager for a configured server, connecting on first use.
+        # (Imported here: plex_manager and tmdb_search build their sessions with this module.)
+        backend = self.plex_backend or self.config.get("PLEX_BACKEND") or "plexapi"
+        if backend == "async":
+            from plex_async import AsyncPlexManager as manager
+        elif backend == "plexapi":
+            from plex_manager import PlexManager as manager
+        else:
+            raise ValueError(f"Unknown Plex backend '{backend}' (expected plexapi or async).")
+
+        if name is None:
+            server = self.config
+        else:
+            server = (self.config.get("SERVERS") or {}).get(name)
+            if server is None:
+                raise ValueError(f"Unknown Plex server '{name}' (add it under SERVERS in config.json).")
+        key = (server.get("PLEX_URL"), server.get("PLEX_TOKEN"), backend)
+        if not all(key):
+            raise ValueError("Missing or invalid Plex Token or URL.")
+
+        with self._lock:
+            connect_lock = self._connect_locks.setdefault(name, threading.Lock())
+        with connect_lock:
+            with self._lock:
+                current = self._plex.get(name)
+            if current is not None and current[0] == key:
+                return current[1]
+            plex = manager(key[1], key[0], session=self.session("plex", name))
+            with self._lock:
+                self._plex[name] = (key, plex)
+            if current is not None:
+                self._close_plex(current[1])
+            return plex
+
+    @staticmethod
+    def _close_plex(plex):
+        # The async backend owns an event loop thread and its own connections
+        close = getattr(plex, "close", None)
+        if close is not None:
+            close()
+
+    @property
+    def tmdb(self):
+        # TMDbSearch for the configured API key, or None if there isn't one.
+        from tmdb_search import TMDbSearch
+
+        key = self.config.get("TMDB_API_KEY")
+        if not key:
+            return None
+        session = self.session("tmdb")
+        with self._lock:
+            if self._tmdb is None or self._tmdb_key != key:
+                self._tmdb = TMDbSearch(key, cache=self.tmdb_cache, session=session)
+                self._tmdb_key = key
+            return self._tmdb
+
+    def close(self):
+        with self._lock:
+            for _, plex in self._plex.values():
+                self._close_plex(plex)
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._plex.clear()
+            self._tmdb = None
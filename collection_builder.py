@@ -0,0 +1,479 @@
+import json
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import profiling
+from catalog import collection_catalog, fallback_catalog, studio_catalog
+from collection_sync import apply_sync, existing_collection_keys, plan_sync
+from defaults import FETCH_WORKERS
+from title_matcher import normalize_title
+from tmdb_search import TMDbMovie
+
+# Results kept from a "search" source unless it sets its own "limit"
+SEARCH_LIMIT = 20
+# Set operations in a composite source, and the year filters it may apply
+SET_KEYS = ("any", "all", "exclude")
+YEAR_KEYS = ("after", "before")
+# Definition keys that say where and how to build, not what the source is
+BUILD_KEYS = ("name", "library", "targets", "prune")
+
+
+def extract_title_and_year(raw_title):
+    # Search movie title and optional year from user input.
+    # Example: "Inception (2010)" -> ("Inception", 2010)
+    match = re.match(r"^(.*?)(?:\s+\((\d{4})\))?$", raw_title.strip())
+    return (
+        match.group(1).strip(),
+        int(match.group(2)) if match.group(2) else None,
+    )
+
+
+def iter_matches(index, sources, fuzzy=False):
+    # Resolve source movies against a LibraryIndex one at a time, yielding
+    # (source, LibraryRecord or None). Sources may be a lazy TMDb stream: each is
+    # matched as soon as it arrives, and the next page is only pulled when needed.
+    # TMDb records match through their tmdb:// GUID; typed or fallback titles by name.
+    # fuzzy=True also accepts near-miss titles (see LibraryIndex.match()).
+    for source in sources:
+        if isinstance(source, TMDbMovie):
+            match = index.match(
+                source.title,
+                source.year,
+                tmdb_id=source.id,
+                original_title=source.original_title,
+                fuzzy=fuzzy,
+            )
+        else:
+            title, year = extract_title_and_year(source)
+            match = index.match(title, year, fuzzy=fuzzy)
+        yield source, match
+
+
+def match_sources(index, sources, fuzzy=False):
+    # Resolve source movies against a LibraryIndex.
+    # Returns (found LibraryRecords, unmatched sources).
+    found, not_found = [], []
+    with profiling.stage("match"):
+        for source, match in iter_matches(index, sources, fuzzy):
+            if match is not None:
+                found.append(match)
+            else:
+                not_found.append(source)
+    return found, not_found
+
+
+def collection_id(collection, id_index=None):
+    # TMDb collection id for a catalog name, an id, or (with an index) any collection name
+    known = collection_catalog().value(str(collection))
+    if known is not None:
+        return int(known)
+    if str(collection).isdigit():
+        return int(collection)
+    found = id_index.resolve("collection", str(collection)) if id_index else None
+    if found is None:
+        raise ValueError(f"Unknown collection '{collection}'.")
+    return found
+
+
+def studio_info(studio, id_index=None):
+    # {"company": id} / {"keyword": id} for a catalog studio or (with an index) any company
+    # name, or None. Raises ValueError for names the index can't pin to one company.
+    info = studio_catalog().value(str(studio))
+    if info is None and id_index is not None:
+        company = id_index.resolve("company", str(studio))
+        if company is not None:
+            info = {"company": company}
+    return info
+
+
+def discover_id(value, kind, id_index=None):
+    # company/keyword values may be ids or, with an index, names; a list resolves each
+    if isinstance(value, (list, tuple)):
+        return tuple(discover_id(item, kind, id_index) for item in value)
+    if value is None or isinstance(value, int) or str(value).isdigit():
+        return value
+    found = id_index.resolve(kind, str(value)) if id_index else None
+    if found is None:
+        raise ValueError(f"Unknown {kind} '{value}'.")
+    return found
+
+
+def _frozen(value):
+    return tuple(_frozen(item) for item in value) if isinstance(value, list) else value
+
+
+def source_key(definition, id_index=None):
+    # Identity of a definition's source, so identical fetches can be shared.
+    if is_composite(definition):
+        query = {key: value for key, value in definition.items() if key not in BUILD_KEYS}
+        return ("composite", json.dumps(query, sort_keys=True, default=str))
+    if "search" in definition:
+        return ("search", str(definition["search"]), definition.get("limit", SEARCH_LIMIT))
+    if "titles" in definition:
+        return ("titles", tuple(definition["titles"]))
+    if "collection" in definition:
+        collection = definition["collection"]
+        try:
+            return ("collection", collection_id(collection, id_index))
+        except ValueError:
+            return ("collection", collection)
+    if "studio" in definition:
+        studio = str(definition["studio"]).lower()
+        try:
+            info = studio_info(studio, id_index)
+        except ValueError:
+            info = None
+        if info is None:
+            return ("studio", studio)
+        return ("discover", info.get("company"), info.get("keyword"), None)
+    return (
+        "discover",
+        _frozen(definition.get("company")),
+        _frozen(definition.get("keyword")),
+        _frozen(definition.get("genre")),
+    )
+
+
+def is_composite(definition):
+    # Whether a definition (or a node inside one) combines sources with set algebra
+    return any(key in definition for key in SET_KEYS + YEAR_KEYS)
+
+
+def _nodes(node, key):
+    value = node[key]
+    nodes = value if isinstance(value, list) else [value]
+    if not nodes or not all(isinstance(child, dict) for child in nodes):
+        raise ValueError(f"'{key}' must be a source or a non-empty list of sources.")
+    return nodes
+
+
+def _plain(node):
+    # A composite node's own source, without its set operations and filters
+    return {key: value for key, value in node.items() if key not in SET_KEYS + YEAR_KEYS}
+
+
+def genre_filter(node):
+    # Genre ids of a bare {"genre": ...} node, else None. Inside "exclude", or "all"
+    # next to other sources, such a node is applied to the fetched movies' own
+    # genre_ids instead of paging through the whole genre on TMDb.
+    if is_composite(node) or set(node) != {"genre"}:
+        return None
+    value = node["genre"]
+    return frozenset(int(item) for item in (value if isinstance(value, (list, tuple)) else [value]))
+
+
+def _split_genres(nodes):
+    # (genre id sets, other nodes) of a list of child nodes
+    genres, others = [], []
+    for child in nodes:
+        ids = genre_filter(child)
+        if ids is None:
+            others.append(child)
+        else:
+            genres.append(ids)
+    return genres, others
+
+
+def _genres(source):
+    return frozenset(source.genre_ids) if isinstance(source, TMDbMovie) else frozenset()
+
+
+def composite_leaves(node):
+    # Every plain source inside a composite definition that has to be fetched,
+    # depth first (genre filters aren't; see genre_filter())
+    if "any" in node and "all" in node:
+        raise ValueError("Use either 'any' or 'all' in one source, not both.")
+    if "any" in node:
+        children = _nodes(node, "any")
+    elif "all" in node:
+        children = _nodes(node, "all")
+        genres, others = _split_genres(children)
+        if others:
+            children = others
+    else:
+        children = [_plain(node)]
+    if "exclude" in node:
+        children = children + _split_genres(_nodes(node, "exclude"))[1]
+    leaves = []
+    for child in children:
+        leaves.extend(composite_leaves(child) if is_composite(child) else [child])
+    return leaves
+
+
+def source_identity(source):
+    # What set operations compare: the TMDb id, else the normalized title and year
+    if isinstance(source, TMDbMovie):
+        return ("tmdb", source.id)
+    title, year = extract_title_and_year(str(source))
+    return ("title", normalize_title(title), year)
+
+
+def _source_year(source):
+    if isinstance(source, TMDbMovie):
+        return source.year
+    return extract_title_and_year(str(source))[1]
+
+
+def evaluate_composite(node, fetched):
+    # Apply a composite node's set algebra to already fetched sources.
+    # fetched(leaf) returns a leaf's source list. Returns {identity: source} in
+    # first-seen order: "any" is the union of its sources, "all" their intersection,
+    # "exclude" drops everything its sources contain, and "after"/"before" keep
+    # movies released strictly after/before a year (movies without a year are dropped).
+    # Genre filters (genre_filter()) check each TMDb movie's genre_ids: "all" keeps
+    # movies with one of the genres, "exclude" drops them. Typed titles have no
+    # genres, so "all" drops them and "exclude" keeps them.
+    def evaluate(child):
+        if is_composite(child):
+            return evaluate_composite(child, fetched)
+        return {source_identity(source): source for source in fetched(child)}
+
+    if "any" in node:
+        result = {}
+        for child in _nodes(node, "any"):
+            for key, source in evaluate(child).items():
+                result.setdefault(key, source)
+    elif "all" in node:
+        genres, others = _split_genres(_nodes(node, "all"))
+        if not others:
+            genres, others = [], _nodes(node, "all")
+        sets = [evaluate(child) for child in others]
+        result = {
+            key: source
+            for key, source in sets[0].items()
+            if all(key in s for s in sets[1:]) and all(_genres(source) & ids for ids in genres)
+        }
+    else:
+        result = evaluate(_plain(node))
+    if "exclude" in node:
+        genres, others = _split_genres(_nodes(node, "exclude"))
+        excluded = set()
+        for child in others:
+            excluded.update(evaluate(child))
+        unwanted = frozenset().union(*genres)
+        result = {
+            key: source
+            for key, source in result.items()
+            if key not in excluded and not _genres(source) & unwanted
+        }
+    after, before = node.get("after"), node.get("before")
+    if after is not None or before is not None:
+        kept = {}
+        for key, source in result.items():
+            year = _source_year(source)
+            if year is None:
+                continue
+            if (after is None or year > int(after)) and (before is None or year < int(before)):
+                kept[key] = source
+        result = kept
+    return result
+
+
+class CollectionBuilder:
+    # Builds many collections against one Plex connection, one TMDb session and
+    # one library index per section. Used by the headless `build` command, with
+    # one builder per server when collections target several servers.
+    # A build runs in three stages (fetch_sources -> resolve -> apply) so a
+    # scheduler can overlap them across collections.
+
+    def __init__(self, plex, library_cache, tmdb=None, id_index=None, journal=None):
+        self.plex = plex
+        self.library_cache = library_cache
+        self.tmdb = tmdb
+        # Optional id_index.TMDbIdIndex: lets specs name any TMDb collection/company/keyword
+        self.id_index = id_index
+        # Optional journal.BuildJournal: makes writes resumable across crashed runs
+        self.journal = journal
+        self._lock = threading.Lock()
+        self._sections = {}
+        self._indexes = {}
+        self._index_locks = {}  # section key -> Lock, so sections load independently
+        self._leaves = {}  # source key -> Future of a composite leaf's sources, per run
+
+    def section(self, name):
+        with self._lock:
+            if name not in self._sections:
+                self._sections[name] = self.plex.plex.library.section(name)
+            return self._sections[name]
+
+    def index(self, library):
+        # Refresh the snapshot once per section per run, then reuse the index
+        key = str(library.key)
+        with self._lock:
+            lock = self._index_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._indexes:
+                self._indexes[key] = self.library_cache.load_index(
+                    self.plex.plex.machineIdentifier,
+                    library,
+                    loader=self.plex.section_items,
+                    counter=self.plex.section_size,
+                )
+            return self._indexes[key]
+
+    def journal_key(self, library):
+        return f"{self.plex.plex.machineIdentifier}/{library.key}"
+
+    def completed(self, definition, library_name):
+        # Summary of a collection the journaled run already finished in this section, or None
+        if self.journal is None:
+            return None
+        library = self.section(library_name)
+        summary = self.journal.completed(self.journal_key(library), definition["name"])
+        if summary is not None:
+            summary["resumed"] = True
+        return summary
+
+    def fetch_sources(self, definition):
+        # Turn one collection definition into its list of source movies.
+        return list(self.stream_sources(definition))
+
+    def stream_sources(self, definition):
+        # Source movies for one definition as an iterator; TMDb sources are streamed
+        # page by page (TMDbSearch.iter_*), so matching can start on the first page.
+        # Supported keys: titles, collection (name or TMDb id), studio, company, keyword,
+        # genre, search, and any/all/exclude/after/before to combine them.
+        if is_composite(definition):
+            return iter(self.composite_sources(definition))
+
+        if "titles" in definition:
+            return iter(definition["titles"])
+
+        if "search" in definition:
+            if self.tmdb is None:
+                raise ValueError("A TMDb API key is required for search sources.")
+            return self.tmdb.iter_search_movies(
+                str(definition["search"]), limit=definition.get("limit", SEARCH_LIMIT)
+            )
+
+        if "collection" in definition:
+            collection = definition["collection"]
+            if self.tmdb is None:
+                return iter(fallback_catalog("Franchises").value(str(collection), []))
+            return self.tmdb.iter_collection_movies(collection_id(collection, self.id_index))
+
+        if "studio" in definition:
+            studio = str(definition["studio"])
+            if self.tmdb is None:
+                return iter(fallback_catalog("Studios").value(studio, []))
+            info = studio_info(studio, self.id_index)
+            if info is None:
+                raise ValueError(f"Unknown studio '{definition['studio']}'.")
+            return self.tmdb.iter_discover_movies(
+                company_id=info.get("company"), keyword_id=info.get("keyword")
+            )
+
+        if "company" in definition or "keyword" in definition or "genre" in definition:
+            if self.tmdb is None:
+                raise ValueError("A TMDb API key is required for company/keyword/genre sources.")
+            return self.tmdb.iter_discover_movies(
+                company_id=discover_id(definition.get("company"), "company", self.id_index),
+                keyword_id=discover_id(definition.get("keyword"), "keyword", self.id_index),
+                genre_id=_frozen(definition.get("genre")),
+            )
+
+        raise ValueError(
+            "Collection needs one of: titles, collection, studio, company, keyword, genre, "
+            "search, any, all."
+        )
+
+    def composite_sources(self, definition):
+        # Sources of a composite definition. Every distinct leaf source is fetched
+        # once, all of them concurrently, and shared with other composites of the
+        # same run; the set algebra then runs on TMDb ids before any Plex lookup.
+        leaves = {}
+        for leaf in composite_leaves(definition):
+            leaves.setdefault(source_key(leaf, self.id_index), leaf)
+        futures, owned = {}, []
+        with self._lock:
+            for key, leaf in leaves.items():
+                if key not in self._leaves:
+                    self._leaves[key] = Future()
+                    owned.append((key, leaf))
+                futures[key] = self._leaves[key]
+        if owned:
+            with ThreadPoolExecutor(min(FETCH_WORKERS, len(owned))) as pool:
+                for key, leaf in owned:
+                    pool.submit(self._fetch_leaf, futures[key], leaf)
+
+        def fetched(leaf):
+            return futures[source_key(leaf, self.id_index)].result()
+
+        return list(evaluate_composite(definition, fetched).values())
+
+    def _fetch_leaf(self, future, leaf):
+        try:
+            future.set_result(self.fetch_sources(leaf))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def resolve(self, definition, sources, library_name="Movies"):
+        # Match fetched sources against a section's index; no Plex requests after the first.
+        library = self.section(library_name)
+        found, not_found = match_sources(self.index(library), sources)
+        return library, found, not_found
+
+    def apply(self, definition, library, found, not_found, prune=True):
+        # Sync the collection with the matched items. Returns a JSON-serializable summary.
+        name = definition["name"]
+        summary = {
+            "name": name,
+            "sources": len(found) + len(not_found),
+            "matched": len(found),
+            "not_found": [str(source) for source in not_found],
+            "added": 0,
+            "removed": 0,
+            "failed": [],
+        }
+        if not found:
+            if self.journal is not None:
+                self.journal.complete(self.journal_key(library), name, summary)
+            return summary
+
+        existing = existing_collection_keys(library, name)
+        server_id = self.plex.plex.machineIdentifier
+        # Kept with the snapshot so `build --plan` can diff offline
+        self.library_cache.save_collection(server_id, library.key, name, existing)
+        plan = plan_sync(
+            existing, [item.ratingKey for item in found], prune=definition.get("prune", prune)
+        )
+        if self.journal is None:
+            result = apply_sync(self.plex, library, name, plan)
+        else:
+            # Journal the plan first, then every batch Plex accepts. A rerun after a
+            # crash gets back only the items that weren't applied yet.
+            key = self.journal_key(library)
+            plan = self.journal.begin(key, name, plan)
+            result = apply_sync(
+                self.plex,
+                library,
+                name,
+                plan,
+                record=lambda op, results: self.journal.applied(key, name, op, results),
+            )
+        self.library_cache.update_collection(
+            server_id,
+            library.key,
+            name,
+            [int(r.item.ratingKey) for r in result.added if r.ok],
+            [int(r.item.ratingKey) for r in result.removed if r.ok],
+        )
+        summary["added"] = sum(1 for r in result.added if r.ok)
+        summary["removed"] = sum(1 for r in result.removed if r.ok)
+        summary["failed"] = [
+            {"title": r.item.title, "error": r.error}
+            for r in result.added + result.removed
+            if not r.ok
+        ]
+        if self.journal is not None and not summary["failed"]:
+            self.journal.complete(key, name, summary)
+        return summary
+
+    def build(self, definition, library_name="Movies", prune=True):
+        # Fetch and resolve one collection as a stream, then sync it.
+        sources = self.stream_sources(definition)
+        library, found, not_found = self.resolve(
+            definition, sources, definition.get("library", library_name)
+        )
+        return self.apply(definition, library, found, not_found, prune)
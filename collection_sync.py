@@ -0,0 +1,73 @@
+from collections import namedtuple
+
+from plexapi.exceptions import NotFound
+
+import profiling
+from plex_manager import BATCH_SIZE
+
+# What it takes to turn the current collection into the desired one (ratingKeys)
+SyncPlan = namedtuple("SyncPlan", "adds removes unchanged exists")
+
+# Outcome of applying a SyncPlan; added/removed hold PlexManager.MutationResult lists
+SyncResult = namedtuple("SyncResult", "plan added removed")
+
+
+def existing_collection_keys(library, collection_name):
+    # ratingKeys currently in the collection, or None if it doesn't exist yet.
+    with profiling.stage("plex.collection_lookup"):
+        try:
+            collection = library.collection(collection_name)
+        except NotFound:
+            return None
+        if collection.smart:
+            raise ValueError(f"'{collection_name}' is a smart collection and can't be edited.")
+        return [int(item.ratingKey) for item in collection.items()]
+
+
+def plan_sync(existing_keys, desired_keys, prune=True):
+    # Diff the collection's current members against the resolved items.
+    # With prune=False, members that are no longer in the source are left alone.
+    exists = existing_keys is not None
+    existing = set(existing_keys or [])
+    desired = list(dict.fromkeys(int(key) for key in desired_keys))
+    desired_set = set(desired)
+    adds = [key for key in desired if key not in existing]
+    removes = [key for key in existing_keys or [] if key not in desired_set] if prune else []
+    unchanged = len(desired_set & existing)
+    return SyncPlan(adds, removes, unchanged, exists)
+
+
+def apply_sync(plex, library, collection_name, plan, record=None):
+    # Apply only the adds and removes, each in batched multi-edit requests.
+    # record(op, results), if given, is called after every batch ("add"/"remove"),
+    # e.g. to journal what has been applied so far.
+    if record is None:
+        added = removed = []
+        if plan.adds:
+            added = plex.add_items_to_collection(
+                library, plex.fetch_items(plan.adds), collection_name
+            )
+        if plan.removes:
+            removed = plex.remove_items_from_collection(
+                library, plex.fetch_items(plan.removes), collection_name
+            )
+        return SyncResult(plan, added, removed)
+
+    added, removed = [], []
+    for op, keys, edit, results in (
+        ("add", plan.adds, plex.add_items_to_collection, added),
+        ("remove", plan.removes, plex.remove_items_from_collection, removed),
+    ):
+        for start in range(0, len(keys), BATCH_SIZE):
+            batch = edit(library, plex.fetch_items(keys[start : start + BATCH_SIZE]), collection_name)
+            record(op, batch)
+            results.extend(batch)
+    return SyncResult(plan, added, removed)
+
+
+def sync_collection(plex, library, collection_name, desired_keys, prune=True):
+    # Bring a collection in line with desired_keys; work scales with what changed.
+    plan = plan_sync(
+        existing_collection_keys(library, collection_name), desired_keys, prune=prune
+    )
+    return apply_sync(plex, library, collection_name, plan)
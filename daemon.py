@@ -0,0 +1,359 @@
+import itertools
+import json
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import emojis
+from batch_build import load_spec
+from build_scheduler import Target, definition_targets, parse_targets
+from collection_builder import (
+    CollectionBuilder,
+    collection_id,
+    discover_id,
+    extract_title_and_year,
+    is_composite,
+    studio_info,
+)
+from library_index import LibraryItem, tmdb_id
+from title_matcher import normalize_title
+
+DEFAULT_PORT = 8765
+# Events handled at once; Plex gets its 200 before any of the work starts
+EVENT_WORKERS = 2
+# Plex webhook events that bring a new movie into a library
+NEW_ITEM_EVENTS = ("library.new",)
+
+# One managed collection's membership test. requires maps "collection", "company",
+# "keyword" or "genre" to a TMDb id, or "title" to a (normalized title, year).
+Rule = namedtuple("Rule", "name targets requires")
+
+
+def _id_rules(name, where, requires):
+    # A kind given several ids matches any of them: one Rule per combination
+    options = [
+        [(kind, int(value)) for value in (ids if isinstance(ids, (list, tuple)) else [ids])]
+        for kind, ids in requires.items()
+    ]
+    return [Rule(name, where, dict(combination)) for combination in itertools.product(*options)]
+
+
+def definition_rules(definition, targets, library_name, tmdb=None, id_index=None):
+    # Rules under which a new movie belongs to a spec collection. Without TMDb,
+    # catalog collections and studios fall back to their title lists.
+    name = definition["name"]
+    where = frozenset(definition_targets(definition, targets, library_name))
+    if is_composite(definition) or "search" in definition:
+        raise ValueError("Composite and search sources aren't watched; update them with `build`.")
+    if "titles" in definition or tmdb is None:
+        titles = CollectionBuilder(None, None).stream_sources(definition)
+        rules = []
+        for raw in titles:
+            title, year = extract_title_and_year(str(raw))
+            rules.append(Rule(name, where, {"title": (normalize_title(title), year)}))
+        return rules
+    if "collection" in definition:
+        return [Rule(name, where, {"collection": collection_id(definition["collection"], id_index)})]
+    if "studio" in definition:
+        info = studio_info(str(definition["studio"]), id_index)
+        if info is None:
+            raise ValueError(f"Unknown studio '{definition['studio']}'.")
+        return _id_rules(name, where, {kind: value for kind, value in info.items() if value})
+    requires = {
+        kind: discover_id(definition[kind], kind, id_index)
+        for kind in ("company", "keyword")
+        if definition.get(kind) is not None
+    }
+    if definition.get("genre") is not None:
+        requires["genre"] = definition["genre"]
+    if not requires:
+        raise ValueError(
+            "Collection needs one of: titles, collection, studio, company, keyword, genre."
+        )
+    return _id_rules(name, where, requires)
+
+
+class CollectionRouter:
+    # Reverse index from TMDb collection / company / keyword / genre ids (and titles) to
+    # the spec's collections, so a new movie is checked only against the
+    # collections it can belong to instead of rebuilding every one of them.
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self._by_key = {}  # (kind, id or normalized title) -> [Rule]
+        for rule in self.rules:
+            # Index under one requirement; match() checks the rest
+            kind, value = next(iter(rule.requires.items()))
+            key = (kind, value[0]) if kind == "title" else (kind, value)
+            self._by_key.setdefault(key, []).append(rule)
+
+    @classmethod
+    def from_spec(cls, spec, tmdb=None, id_index=None):
+        # Returns (router, {collection name: error}) for definitions that can't be routed
+        library_name = spec.get("library", "Movies")
+        targets = parse_targets(spec["targets"], library_name) if "targets" in spec else None
+        rules, errors = [], {}
+        for definition in spec["collections"]:
+            try:
+                rules.extend(definition_rules(definition, targets, library_name, tmdb, id_index))
+            except ValueError as e:
+                errors[definition["name"]] = str(e)
+        return cls(rules), errors
+
+    def match(self, target, title, year=None, facts=None):
+        # Collection names a new movie in `target` belongs to.
+        # facts is a tmdb_search.MovieFacts, when the movie has a TMDb id.
+        have = {"title": {normalize_title(title or "")}}
+        keys = [("title", normalize_title(title or ""))]
+        if facts is not None:
+            have["collection"] = {facts.collection} if facts.collection else set()
+            have["company"] = facts.companies
+            have["keyword"] = facts.keywords
+            have["genre"] = facts.genres
+            keys.extend(("collection", value) for value in have["collection"])
+            keys.extend(("company", value) for value in facts.companies)
+            keys.extend(("keyword", value) for value in facts.keywords)
+            keys.extend(("genre", value) for value in facts.genres)
+
+        names = []
+        for key in keys:
+            for rule in self._by_key.get(key, ()):
+                if target not in rule.targets or rule.name in names:
+                    continue
+                if all(self._satisfied(kind, value, have, year) for kind, value in rule.requires.items()):
+                    names.append(rule.name)
+        return names
+
+    @staticmethod
+    def _satisfied(kind, value, have, year):
+        if kind == "title":
+            norm, wanted_year = value
+            return norm in have["title"] and (wanted_year is None or wanted_year == year)
+        return value in have.get(kind, ())
+
+
+def parse_webhook(content_type, body):
+    # The JSON payload of a Plex webhook (multipart/form-data with a "payload"
+    # field), or of a plain JSON POST
+    if content_type.startswith("multipart/"):
+        message = BytesParser(policy=policy.HTTP).parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+        )
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "payload":
+                return json.loads(part.get_content())
+        raise ValueError("Webhook has no 'payload' field.")
+    return json.loads(body or b"{}")
+
+
+def payload_record(metadata):
+    # LibraryItem from a webhook's Metadata, or None when it lacks the GUIDs or title
+    # (older servers, unmatched items) and the item has to be read from Plex
+    guids = tuple(guid.get("id", "") for guid in metadata.get("Guid") or [])
+    if not guids or not metadata.get("title"):
+        return None
+    year = metadata.get("year")
+    return LibraryItem(
+        int(metadata["ratingKey"]),
+        metadata["title"],
+        metadata.get("originalTitle"),
+        int(year) if year else None,
+        guids,
+        int(metadata.get("updatedAt") or 0),
+        int(metadata.get("addedAt") or 0),
+    )
+
+
+class WebhookDaemon:
+    # Long-running service for Plex webhooks: every library.new movie is routed
+    # through the CollectionRouter and added only to the collections it belongs
+    # to (one TMDb request, one multi-edit per collection). The spec is reloaded
+    # when its file changes.
+
+    def __init__(self, spec_path, clients, id_index=None, secret=None):
+        self.spec_path = spec_path
+        self.clients = clients
+        self.id_index = id_index
+        # Optional shared secret, passed by Plex as ?secret=... in the webhook URL
+        self.secret = secret
+        # missing: events for items Plex no longer has by the time they are handled
+        self.stats = {"events": 0, "ignored": 0, "missing": 0, "added": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._router = None
+        self._router_stamp = None
+        self._servers = {}  # machineIdentifier -> server name (None = default)
+        self._sections = {}  # (server, section title) -> plexapi section
+        self._pool = ThreadPoolExecutor(EVENT_WORKERS)
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def router(self):
+        # CollectionRouter for the current spec, rebuilt when the file changes
+        st = os.stat(self.spec_path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if self._router is None or self._router_stamp != stamp:
+                self._router_stamp = stamp
+                try:
+                    spec = load_spec(self.spec_path)
+                except (OSError, ValueError, RuntimeError) as e:
+                    if self._router is None:
+                        raise
+                    # Keep routing with the last good spec until the file is fixed
+                    print(f"{emojis.CROSS} Could not reload {self.spec_path}: {e}")
+                    return self._router
+                self._router, errors = CollectionRouter.from_spec(
+                    spec, self.clients.tmdb, self.id_index
+                )
+                for name, error in errors.items():
+                    print(f"{emojis.CROSS} Not watching '{name}': {error}")
+                print(f"{emojis.CHECK} Watching {len(spec['collections']) - len(errors)} collections.")
+            return self._router
+
+    def server_name(self, machine_id):
+        # Configured server a webhook came from, or raise ValueError
+        with self._lock:
+            if machine_id in self._servers:
+                return self._servers[machine_id]
+        for name in self.clients.servers():
+            try:
+                plex = self.clients.plex_server(name)
+            except Exception:
+                continue
+            with self._lock:
+                self._servers[plex.plex.machineIdentifier] = name
+        with self._lock:
+            if machine_id not in self._servers:
+                raise ValueError(f"Webhook from an unknown server ({machine_id}).")
+            return self._servers[machine_id]
+
+    def section(self, server, title):
+        key = (server, title)
+        with self._lock:
+            section = self._sections.get(key)
+        if section is None:
+            section = self.clients.plex_server(server).plex.library.section(title)
+            with self._lock:
+                self._sections[key] = section
+        return section
+
+    def handle_event(self, payload):
+        # Route one webhook payload. Returns the collections the item was added to.
+        metadata = payload.get("Metadata") or {}
+        if payload.get("event") not in NEW_ITEM_EVENTS or metadata.get("type") != "movie":
+            self._count("ignored")
+            return []
+        self._count("events")
+        server = self.server_name((payload.get("Server") or {}).get("uuid"))
+        plex = self.clients.plex_server(server)
+        target = Target(server, metadata.get("librarySectionTitle"))
+
+        # The payload usually carries the GUIDs, title and year; otherwise ask Plex for the item
+        item = None
+        record = payload_record(metadata)
+        if record is None:
+            item = self._fetch_item(plex, metadata["ratingKey"])
+            if item is None:
+                return []
+            record = item if isinstance(item, LibraryItem) else LibraryItem.from_plex(item)
+        movie_id = tmdb_id(record.guids)
+        tmdb = self.clients.tmdb
+        facts = tmdb.movie_facts(movie_id) if tmdb is not None and movie_id else None
+
+        names = self.router().match(target, record.title, record.year, facts)
+        if not names:
+            return []
+        # Editing needs the full object, so it is only loaded once a rule matches
+        if item is None:
+            item = self._fetch_item(plex, record.ratingKey)
+            if item is None:
+                return []
+        library = self.section(server, target.library)
+        added = []
+        for name in names:
+            for result in plex.add_items_to_collection(library, [item], name):
+                if result.ok:
+                    added.append(name)
+                    self._count("added")
+                    print(f"{emojis.CHECK} Added '{record.title}' to collection: {name}")
+                else:
+                    self._count("errors")
+                    print(f"{emojis.CROSS} Could not add '{record.title}' to {name}: {result.error}")
+        return added
+
+    def _fetch_item(self, plex, rating_key):
+        # Full item for a ratingKey, or None (counted) when it was deleted since the event
+        items = plex.fetch_items([rating_key])
+        if not items:
+            self._count("missing")
+            print(f"{emojis.CROSS} Item {rating_key} is no longer on the server, skipped.")
+            return None
+        return items[0]
+
+    def submit(self, payload):
+        def run():
+            try:
+                return self.handle_event(payload)
+            except Exception as e:
+                self._count("errors")
+                print(f"{emojis.CROSS} Webhook failed: {e}")
+                return []
+
+        return self._pool.submit(run)
+
+    def serve(self, host="127.0.0.1", port=DEFAULT_PORT):
+        # Blocks until interrupted. Point Plex (Settings > Webhooks) at http://host:port/webhook
+        self.router()
+        httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        httpd.daemon_threads = True
+        print(f"{emojis.MOVIE} Listening for Plex webhooks on http://{host}:{httpd.server_port}/webhook")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+            self._pool.shutdown()
+
+    def _handler_class(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, data):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if urlparse(self.path).path == "/status":
+                    return self._reply(200, {**daemon.stats, "rules": len(daemon.router().rules)})
+                self._reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path != "/webhook":
+                    return self._reply(404, {"error": "not found"})
+                if daemon.secret and parse_qs(url.query).get("secret", [""])[0] != daemon.secret:
+                    return self._reply(403, {"error": "bad secret"})
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                try:
+                    payload = parse_webhook(self.headers.get("Content-Type", ""), body)
+                except ValueError as e:
+                    return self._reply(400, {"error": str(e)})
+                daemon.submit(payload)
+                self._reply(202, {"accepted": True})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
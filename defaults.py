@@ -0,0 +1,11 @@
+# Tunables shared by the CLI and the modules that use them. Kept free of imports
+# so main.py can show them in --help without loading plexapi or requests.
+
+# Default workers per build stage: TMDb fetches are cheap for TMDb and rate limited
+# by TMDbSearch; Plex writes are kept low so a build doesn't swamp the server.
+FETCH_WORKERS = 4
+WRITE_WORKERS = 2
+
+# Keep-alive connections kept open per host; enough for the discover workers
+# plus the Plex writer threads without opening new ones mid-build.
+POOL_SIZE = 16
@@ -0,0 +1,315 @@
+import gzip
+import json
+import math
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from title_matcher import TitleMatcher, normalize_title, trigrams
+
+# TMDb publishes a full list of valid ids per object type every day (around 08:00 UTC)
+EXPORT_URL = "https://files.tmdb.org/p/exports/{name}_ids_{date:%m_%d_%Y}.json.gz"
+EXPORT_NAMES = {
+    "collection": "collection",
+    "company": "production_company",
+    "keyword": "keyword",
+}
+KINDS = tuple(EXPORT_NAMES)
+# How many days back to look when today's export isn't published yet
+EXPORT_LOOKBACK_DAYS = 3
+# Fuzzy results only count above this trigram similarity
+FUZZY_MIN_SCORE = 0.5
+# Upper bound on rows pulled from the trigram index for one fuzzy query
+FUZZY_CANDIDATES = 5000
+# An export with fewer ids than this share of the indexed ones is refused as truncated
+MIN_EXPORT_RATIO = 0.5
+# Downloads are spooled to a temporary file in chunks of this size
+DOWNLOAD_CHUNK = 1 << 16
+# Nearly every collection in the export is named "<Franchise> Collection"
+COLLECTION_SUFFIX = " collection"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    norm TEXT NOT NULL,
+    PRIMARY KEY (kind, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_norm ON entries (kind, norm);
+CREATE TABLE IF NOT EXISTS exports (
+    kind TEXT PRIMARY KEY,
+    export_date TEXT NOT NULL,
+    imported_at REAL NOT NULL,
+    item_count INTEGER NOT NULL
+);
+"""
+
+
+def _fts_schema(kind):
+    # Per-kind trigram full-text index over normalized names (SQLite 3.34+)
+    return (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS fts_{kind} USING fts5("
+        "norm, name UNINDEXED, tokenize='trigram', detail='none');"
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS vocab_{kind} USING fts5vocab(fts_{kind}, 'row');"
+    )
+
+
+def index_name(kind, name):
+    # Normalized form stored and searched: title_matcher's, minus the redundant
+    # " Collection" suffix so "Star Wars" finds "Star Wars Collection" exactly.
+    norm = normalize_title(name)
+    if kind == "collection" and norm.endswith(COLLECTION_SUFFIX) and norm != COLLECTION_SUFFIX.strip():
+        norm = norm[: -len(COLLECTION_SUFFIX)]
+    return norm
+
+
+def read_export(fileobj):
+    # Yield (id, name) from a TMDb export: gzip'd JSON, one object per line
+    with gzip.GzipFile(fileobj=fileobj) as lines:
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get("id") and data.get("name"):
+                yield int(data["id"]), data["name"]
+
+
+class TMDbIdIndex:
+    # Offline name -> id index of TMDb collections, companies and keywords, built
+    # from the daily export files and stored in SQLite (tmdb_ids.sqlite).
+    # Exact and prefix lookups use the (kind, normalized name) index. Fuzzy lookups
+    # pull candidates sharing the query's rarest trigrams from an FTS5 trigram
+    # index and rank them by trigram similarity; SQLite builds without the
+    # trigram tokenizer fall back to an in-memory TitleMatcher per kind.
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._matchers = {}  # kind -> TitleMatcher, only without FTS5 trigram support
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        try:
+            self._db.executescript("".join(_fts_schema(kind) for kind in KINDS))
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def export_date(self, kind):
+        row = self._db.execute(
+            "SELECT export_date FROM exports WHERE kind = ?", (kind,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute("SELECT kind, COUNT(*) FROM entries GROUP BY kind")
+            return dict(rows.fetchall())
+
+    def import_export(self, kind, rows, export_date):
+        # Bring one kind in line with a full export: insert new ids, rename changed
+        # ones and delete ids that are gone. Returns {"added", "changed", "removed"}.
+        if kind not in EXPORT_NAMES:
+            raise ValueError(f"Unknown kind '{kind}' (expected one of: {', '.join(KINDS)}).")
+        with self._lock:
+            existing = dict(
+                self._db.execute("SELECT id, name FROM entries WHERE kind = ?", (kind,))
+            )
+            upserts, seen = [], set()
+            added = 0
+            for entry_id, name in rows:
+                seen.add(entry_id)
+                old = existing.get(entry_id)
+                if old == name:
+                    continue
+                if old is None:
+                    added += 1
+                upserts.append((kind, entry_id, name, index_name(kind, name)))
+            # A truncated or empty download would otherwise delete every id it lacks
+            if not seen or len(seen) < len(existing) * MIN_EXPORT_RATIO:
+                raise ValueError(
+                    f"Refusing the {kind} export: it has {len(seen)} ids and the index "
+                    f"{len(existing)}; the download looks truncated."
+                )
+            removed = [(kind, entry_id) for entry_id in existing.keys() - seen]
+            self._db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", upserts)
+            self._db.executemany("DELETE FROM entries WHERE kind = ? AND id = ?", removed)
+            if self.fts:
+                stale = [(entry_id,) for _, entry_id, _, _ in upserts if entry_id in existing]
+                stale.extend((entry_id,) for _, entry_id in removed)
+                self._db.executemany(f"DELETE FROM fts_{kind} WHERE rowid = ?", stale)
+                self._db.executemany(
+                    f"INSERT INTO fts_{kind} (rowid, norm, name) VALUES (?, ?, ?)",
+                    [(entry_id, norm, name) for _, entry_id, name, norm in upserts],
+                )
+            self._db.execute(
+                "INSERT OR REPLACE INTO exports VALUES (?, ?, ?, ?)",
+                (kind, str(export_date), time.time(), len(seen)),
+            )
+            self._db.commit()
+            if upserts or removed:
+                self._matchers.pop(kind, None)
+        return {"added": added, "changed": len(upserts) - added, "removed": len(removed)}
+
+    def update(self, session, kinds=KINDS, today=None):
+        # Download the newest export for each kind unless it's already imported.
+        # Returns {kind: {"export_date", "added", "changed", "removed"} or {"skipped": True}}.
+        today = today or datetime.now(timezone.utc).date()
+        results = {}
+        for kind in kinds:
+            for days_back in range(EXPORT_LOOKBACK_DAYS + 1):
+                date = today - timedelta(days=days_back)
+                if self.export_date(kind) == str(date):
+                    results[kind] = {"export_date": str(date), "skipped": True}
+                    break
+                url = EXPORT_URL.format(name=EXPORT_NAMES[kind], date=date)
+                resp = session.get(url, stream=True, timeout=60)
+                if resp.status_code in (403, 404):
+                    resp.close()
+                    continue  # not published yet
+                resp.raise_for_status()
+                # Spooled through iter_content rather than read from resp.raw,
+                # which is empty if anything (e.g. a response hook) read the body
+                with resp, tempfile.TemporaryFile() as f:
+                    for chunk in resp.iter_content(DOWNLOAD_CHUNK):
+                        f.write(chunk)
+                    f.seek(0)
+                    stats = self.import_export(kind, read_export(f), date)
+                results[kind] = {"export_date": str(date), **stats}
+                break
+            else:
+                results[kind] = {"error": "No export found in the last few days."}
+        return results
+
+    def lookup(self, kind, name):
+        # Entries whose normalized name matches exactly, as (id, name) pairs
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, name FROM entries WHERE kind = ? AND norm = ? ORDER BY id",
+                (kind, index_name(kind, name)),
+            ).fetchall()
+
+    def find_id(self, kind, name):
+        # Best guess for a name, for the interactive menus: an exact match, else the shortest name it is a prefix
+        # of ("Toy Story" -> "Toy Story Collection"), else a close fuzzy match.
+        exact = self.lookup(kind, name)
+        if exact:
+            return exact[0][0]
+        norm = index_name(kind, name)
+        if not norm:
+            return None
+        prefixed = self._prefix(kind, norm, 1)
+        if prefixed:
+            return prefixed[0][0]
+        fuzzy = self._fuzzy(kind, norm, 1)
+        return fuzzy[0][0] if fuzzy else None
+
+    def resolve(self, kind, name):
+        # Strict find_id() for specs and the daemon, where nobody sees the guess: an
+        # exact name or the only name it is a prefix of. Returns None if nothing is
+        # close, and raises ValueError for ambiguous names or near misses (typos).
+        exact = self.lookup(kind, name)
+        if len(exact) == 1:
+            return exact[0][0]
+        if exact:
+            raise ValueError(
+                f"{kind.capitalize()} name '{name}' is ambiguous (ids "
+                f"{', '.join(str(entry_id) for entry_id, _ in exact)}); use the id."
+            )
+        norm = index_name(kind, name)
+        if not norm:
+            return None
+        prefixed = self._prefix(kind, norm, 2)
+        if len(prefixed) == 1:
+            return prefixed[0][0]
+        close = prefixed or self._fuzzy(kind, norm, 3)
+        if not close:
+            return None
+        raise ValueError(
+            f"Unknown {kind} '{name}' (did you mean: "
+            f"{', '.join(f'{other} ({entry_id})' for entry_id, other in close)}?)."
+        )
+
+    def _prefix(self, kind, norm, limit):
+        # Range scan on the (kind, norm) index: norm <= x < norm + U+FFFF
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, name FROM entries WHERE kind = ? AND norm >= ? AND norm < ? "
+                "ORDER BY length(norm), norm LIMIT ?",
+                (kind, norm, norm + "\uffff", limit),
+            ).fetchall()
+
+    def _matcher(self, kind):
+        with self._lock:
+            matcher = self._matchers.get(kind)
+            if matcher is None:
+                matcher = TitleMatcher()
+                # Matched on the stored form, as the FTS5 table is
+                for entry_id, norm, name in self._db.execute(
+                    "SELECT id, norm, name FROM entries WHERE kind = ?", (kind,)
+                ):
+                    matcher.add((entry_id, name), norm)
+                self._matchers[kind] = matcher
+            return matcher
+
+    def _fuzzy(self, kind, norm, limit):
+        # (id, name) pairs ranked by trigram Dice similarity to the normalized query
+        if not self.fts:
+            matches = self._matcher(kind).search(norm, limit=limit, min_score=FUZZY_MIN_SCORE)
+            return [key for _, key in matches]
+        grams = sorted({norm[i : i + 3] for i in range(len(norm) - 2)})
+        if not grams:
+            return []
+        with self._lock:
+            placeholders = ",".join("?" * len(grams))
+            freq = dict(
+                self._db.execute(
+                    f"SELECT term, doc FROM vocab_{kind} WHERE term IN ({placeholders})", grams
+                )
+            )
+            # As in TitleMatcher: a name reaching the minimum score must share at
+            # least one of the query's (q - needed + 1) rarest trigrams.
+            floor = FUZZY_MIN_SCORE
+            needed = max(1, math.ceil(floor * len(grams) / (2 - floor)))
+            rarest = sorted(grams, key=lambda gram: freq.get(gram, 0))[: len(grams) - needed + 1]
+            rarest = [gram for gram in rarest if freq.get(gram)]
+            if not rarest:
+                return []
+            expr = " OR ".join('"' + gram.replace('"', '""') + '"' for gram in rarest)
+            candidates = self._db.execute(
+                f"SELECT rowid, norm, name FROM fts_{kind} WHERE fts_{kind} MATCH ? LIMIT ?",
+                (expr, FUZZY_CANDIDATES),
+            ).fetchall()
+        query = trigrams(norm)
+        scored = []
+        for entry_id, other_norm, name in candidates:
+            other = trigrams(other_norm)
+            score = 2.0 * len(query & other) / (len(query) + len(other))
+            if score >= FUZZY_MIN_SCORE:
+                scored.append((score, entry_id, name))
+        scored.sort(key=lambda row: (-row[0], row[1]))
+        return [(entry_id, name) for _, entry_id, name in scored[:limit]]
+
+    def search(self, kind, text, limit=10, fuzzy=True):
+        # Names starting with text (shortest first), topped up with fuzzy matches.
+        # Returns (id, name) pairs.
+        norm = index_name(kind, text)
+        if not norm:
+            return []
+        results = self._prefix(kind, norm, limit)
+        if fuzzy and len(results) < limit:
+            seen = {entry_id for entry_id, _ in results}
+            for entry_id, name in self._fuzzy(kind, norm, limit):
+                if entry_id not in seen:
+                    seen.add(entry_id)
+                    results.append((entry_id, name))
+                    if len(results) >= limit:
+                        break
+        return results
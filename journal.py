@@ -0,0 +1,173 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+# An unfinished run is only resumed this long after it started; a later build of the
+# spec starts over, so a collection that keeps failing can't pin every scheduled
+# build to one old run (skipping everything that run already finished).
+RESUME_WINDOW = 6 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    spec_hash TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS collections (
+    run_id INTEGER NOT NULL,
+    target TEXT NOT NULL,
+    name TEXT NOT NULL,
+    existed INTEGER NOT NULL,
+    unchanged INTEGER NOT NULL,
+    summary TEXT,
+    PRIMARY KEY (run_id, target, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS mutations (
+    run_id INTEGER NOT NULL,
+    target TEXT NOT NULL,
+    name TEXT NOT NULL,
+    op TEXT NOT NULL,
+    rating_key INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    applied INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (run_id, target, name, op, rating_key)
+) WITHOUT ROWID;
+"""
+
+
+def spec_hash(spec):
+    # Identity of a spec: a rerun of the same spec resumes its unfinished run
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class BuildJournal:
+    # Write-ahead journal of collection mutations for headless builds, in SQLite
+    # (build_journal.sqlite). Before a collection is changed its plan (every add and
+    # remove) is written down; each batch is marked applied as soon as Plex accepts
+    # it, and the collection's summary is stored once it's done.
+    # A run that didn't finish (crash, rate-limit abort, failed collections) is
+    # resumed by the next build of the same spec within RESUME_WINDOW: finished
+    # collections are skipped and a half-applied one continues from its first
+    # unapplied item.
+
+    def __init__(self, path):
+        self.path = path
+        self.run_id = None
+        self.resumed = False
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # WAL keeps the per-batch commits cheap
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def start(self, spec, fresh=False, resume_window=RESUME_WINDOW):
+        # Resume the spec's unfinished run if it started within resume_window seconds,
+        # or start a new one (always with fresh=True). Older unfinished runs are closed.
+        digest = spec_hash(spec)
+        now = time.time()
+        with self._lock:
+            runs = self._db.execute(
+                "SELECT run_id, started_at FROM runs WHERE spec_hash = ? AND finished_at IS NULL "
+                "ORDER BY run_id DESC",
+                (digest,),
+            ).fetchall()
+            resume = None
+            for run_id, started_at in runs:
+                if resume is None and not fresh and started_at >= now - resume_window:
+                    resume = run_id
+                else:
+                    self._close(run_id, now)
+            if resume is not None:
+                self.run_id, self.resumed = resume, True
+            else:
+                cursor = self._db.execute(
+                    "INSERT INTO runs (spec_hash, started_at) VALUES (?, ?)", (digest, now)
+                )
+                self.run_id, self.resumed = cursor.lastrowid, False
+            self._db.commit()
+        return self.run_id
+
+    def finish(self):
+        # Mark the run complete and drop its rows; the next build starts fresh
+        with self._lock:
+            self._close(self.run_id, time.time())
+            self._db.commit()
+
+    def _close(self, run_id, now):
+        self._db.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (now, run_id))
+        self._db.execute("DELETE FROM mutations WHERE run_id = ?", (run_id,))
+        self._db.execute("DELETE FROM collections WHERE run_id = ?", (run_id,))
+
+    def completed(self, target, name):
+        # Stored summary of a collection this run already finished, or None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT summary FROM collections WHERE run_id = ? AND target = ? AND name = ?",
+                (self.run_id, target, name),
+            ).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def begin(self, target, name, plan):
+        # Record a collection's plan before touching Plex. If this run already
+        # journaled one, return what's left of it instead (same SyncPlan shape).
+        with self._lock:
+            row = self._db.execute(
+                "SELECT existed, unchanged FROM collections "
+                "WHERE run_id = ? AND target = ? AND name = ?",
+                (self.run_id, target, name),
+            ).fetchone()
+            if row is not None:
+                remaining = {"add": [], "remove": []}
+                for op, key in self._db.execute(
+                    "SELECT op, rating_key FROM mutations WHERE run_id = ? AND target = ? "
+                    "AND name = ? AND applied = 0 ORDER BY position",
+                    (self.run_id, target, name),
+                ):
+                    remaining[op].append(key)
+                return plan._replace(
+                    adds=remaining["add"],
+                    removes=remaining["remove"],
+                    unchanged=row[1],
+                    exists=bool(row[0]),
+                )
+            self._db.execute(
+                "INSERT INTO collections VALUES (?, ?, ?, ?, ?, NULL)",
+                (self.run_id, target, name, int(plan.exists), plan.unchanged),
+            )
+            self._db.executemany(
+                "INSERT INTO mutations (run_id, target, name, op, rating_key, position) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (self.run_id, target, name, op, key, position)
+                    for op, keys in (("add", plan.adds), ("remove", plan.removes))
+                    for position, key in enumerate(keys)
+                ],
+            )
+            self._db.commit()
+        return plan
+
+    def applied(self, target, name, op, results):
+        # Mark the items Plex accepted (MutationResults) as applied
+        keys = [(int(result.item.ratingKey),) for result in results if result.ok]
+        with self._lock:
+            self._db.executemany(
+                "UPDATE mutations SET applied = 1 WHERE run_id = ? AND target = ? "
+                "AND name = ? AND op = ? AND rating_key = ?",
+                [(self.run_id, target, name, op) + key for key in keys],
+            )
+            self._db.commit()
+
+    def complete(self, target, name, summary):
+        with self._lock:
+            self._db.execute(
+                "UPDATE collections SET summary = ? WHERE run_id = ? AND target = ? AND name = ?",
+                (json.dumps(summary), self.run_id, target, name),
+            )
+            self._db.commit()
@@ -0,0 +1,315 @@
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from itertools import islice
+
+import profiling
+from library_index import LibraryIndex, LibraryItem, PAGE_SIZE
+
+SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sections (
+    server_id TEXT NOT NULL,
+    section_key TEXT NOT NULL,
+    last_updated_at INTEGER NOT NULL,
+    item_count INTEGER NOT NULL,
+    synced_at REAL NOT NULL,
+    title TEXT NOT NULL,
+    PRIMARY KEY (server_id, section_key)
+);
+CREATE TABLE IF NOT EXISTS servers (
+    name TEXT PRIMARY KEY,
+    server_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS collections (
+    server_id TEXT NOT NULL,
+    section_key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    rating_keys TEXT,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (server_id, section_key, name)
+);
+CREATE TABLE IF NOT EXISTS items (
+    server_id TEXT NOT NULL,
+    section_key TEXT NOT NULL,
+    rating_key INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    original_title TEXT,
+    year INTEGER,
+    guids TEXT NOT NULL,
+    updated_at INTEGER NOT NULL,
+    added_at INTEGER NOT NULL,
+    PRIMARY KEY (server_id, section_key, rating_key)
+);
+"""
+
+
+def section_items(section, updated_since=None, page_size=PAGE_SIZE):
+    # List a movie section (optionally only items updated after a datetime) through plexapi
+    filters = {"updatedAt>>": updated_since} if updated_since is not None else None
+    for item in section.search(libtype="movie", filters=filters, container_size=page_size):
+        yield LibraryItem.from_plex(item)
+
+
+def section_size(section):
+    # Movies in a section right now. section.totalSize is cached on the plexapi
+    # object for its lifetime, so ask the server (a Container-Size=0 request).
+    return section.totalViewSize(libtype="movie", includeCollections=False)
+
+
+# A snapshotted section, found by server name and section title (see section())
+SnapshotSection = namedtuple("SnapshotSection", "server_id key title")
+
+# Last known members of a collection; rating_keys is None if it didn't exist
+CollectionState = namedtuple("CollectionState", "rating_keys synced_at")
+
+
+class LibrarySnapshotCache:
+    # Persistent snapshot of Plex movie sections, stored in SQLite next to config.json.
+    # Keyed by server machine identifier and section key. After the first full pull,
+    # load_index() only asks Plex for items whose updatedAt moved past the last sync.
+    # Builds also record server names, section titles and the members of the
+    # collections they touch, so a spec can be planned offline (see planner.py).
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()  # guards the SQLite connection
+        self._section_locks = {}  # (server_id, section_key) -> Lock held while refreshing it
+        self._indexes = {}  # (server_id, section_key) -> LibraryIndex kept between builds
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._migrate()
+
+    def _migrate(self):
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            # The snapshot is only a cache, so an old layout is simply rebuilt
+            self._db.executescript(
+                "DROP TABLE IF EXISTS sections; DROP TABLE IF EXISTS items; "
+                "DROP TABLE IF EXISTS servers; DROP TABLE IF EXISTS collections;"
+            )
+        self._db.executescript(_SCHEMA)
+        self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def load_index(self, server_id, section, page_size=PAGE_SIZE, loader=None, counter=None):
+        # Return an up-to-date LibraryIndex for the section, refreshing the snapshot first.
+        # loader(section, updated_since=None, page_size=...) lists the section as
+        # LibraryItems and counter(section) counts its movies; PlexManager.section_items
+        # and .section_size (or their async backends) in practice.
+        # Sections refresh independently: Plex requests are made without holding the
+        # database lock, so a slow server doesn't hold up other servers' sections.
+        loader = loader or section_items
+        counter = counter or section_size
+        cache_key = (server_id, str(section.key))
+        with self._section_lock(cache_key), profiling.stage("plex.snapshot"):
+            changed = self._refresh(server_id, section, page_size, loader, counter)
+            index = self._indexes.get(cache_key)
+            if index is None or changed:
+                # Index straight from the cursor so the section is never held
+                # as a list of rows on top of the index itself
+                with self._lock:
+                    index = LibraryIndex.from_items(self._load_items(*cache_key))
+                self._indexes[cache_key] = index
+            return index
+
+    def stored_index(self, server_id, section_key):
+        # LibraryIndex from the snapshot alone, without asking Plex whether it changed
+        cache_key = (server_id, str(section_key))
+        with self._section_lock(cache_key):
+            index = self._indexes.get(cache_key)
+            if index is None:
+                with self._lock:
+                    index = LibraryIndex.from_items(self._load_items(*cache_key))
+                self._indexes[cache_key] = index
+            return index
+
+    def remember_server(self, name, server_id):
+        # Map a configured server name (None = the default server) to its machine identifier
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO servers VALUES (?, ?)", (name or "", server_id)
+            )
+            self._db.commit()
+
+    def section(self, server_name, title):
+        # SnapshotSection for a section a build has synced, or raise LookupError
+        label = server_name or "default"
+        with self._lock:
+            server = self._db.execute(
+                "SELECT server_id FROM servers WHERE name = ?", (server_name or "",)
+            ).fetchone()
+            row = server and self._db.execute(
+                "SELECT section_key, title FROM sections WHERE server_id = ? AND title = ?",
+                (server[0], title),
+            ).fetchone()
+        if server is None:
+            raise LookupError(f"Server '{label}' has no library snapshot yet; run a build first.")
+        if row is None:
+            raise LookupError(
+                f"Library '{title}' on server '{label}' has no snapshot yet; run a build first."
+            )
+        return SnapshotSection(server[0], row[0], row[1])
+
+    def collection(self, server_id, section_key, name):
+        # CollectionState from the last build that touched the collection, or None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT rating_keys, synced_at FROM collections "
+                "WHERE server_id = ? AND section_key = ? AND name = ?",
+                (server_id, str(section_key), name),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = None if row[0] is None else [int(key) for key in row[0].split()]
+        return CollectionState(keys, row[1])
+
+    def save_collection(self, server_id, section_key, name, rating_keys):
+        # Record a collection's members as read from Plex (None: it doesn't exist)
+        keys = None if rating_keys is None else " ".join(str(key) for key in rating_keys)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO collections VALUES (?, ?, ?, ?, ?)",
+                (server_id, str(section_key), name, keys, time.time()),
+            )
+            self._db.commit()
+
+    def update_collection(self, server_id, section_key, name, added, removed):
+        # Apply accepted adds/removes (ratingKeys) to the recorded members
+        # (only when the members are known; otherwise the next build records them)
+        state = self.collection(server_id, section_key, name)
+        if state is None:
+            return
+        removed = set(removed)
+        keys = [key for key in state.rating_keys or [] if key not in removed]
+        keys = list(dict.fromkeys(keys + [int(key) for key in added]))
+        self.save_collection(server_id, section_key, name, keys)
+
+    def _section_lock(self, cache_key):
+        with self._lock:
+            return self._section_locks.setdefault(cache_key, threading.Lock())
+
+    def _section_state(self, server_id, section_key):
+        with self._lock:
+            return self._db.execute(
+                "SELECT last_updated_at, item_count FROM sections "
+                "WHERE server_id = ? AND section_key = ?",
+                (server_id, section_key),
+            ).fetchone()
+
+    def _refresh(self, server_id, section, page_size, loader, counter):
+        # Bring the stored snapshot in line with the server. Returns True if anything changed.
+        section_key = str(section.key)
+        state = self._section_state(server_id, section_key)
+        if state is None or state[1] < 0:
+            self._full_sync(server_id, section, page_size, loader)
+            return True
+
+        last_updated_at, item_count = state
+        # Plex's "after" operator is strict, so step back a second and rely on upserts
+        since = datetime.fromtimestamp(max(last_updated_at - 1, 0))
+        changed_rows = list(loader(section, updated_since=since, page_size=page_size))
+        self._store(server_id, section_key, changed_rows)
+
+        # Deleted items never show up as "updated"; if the stored count doesn't match
+        # a fresh one, relist the section and drop the ratingKeys that are gone
+        stored = self._count(server_id, section_key)
+        if stored != counter(section):
+            self._full_sync(server_id, section, page_size, loader)
+            return True
+
+        newest = max([last_updated_at] + [row.updatedAt for row in changed_rows])
+        fresh = any(row.updatedAt > last_updated_at for row in changed_rows)
+        self._save_state(server_id, section_key, newest, stored, section.title)
+        return fresh or stored != item_count
+
+    def _full_sync(self, server_id, section, page_size, loader):
+        # Upserted a page at a time so a huge section never sits in memory as a list;
+        # stored ratingKeys the listing didn't return are deleted once it completes.
+        # A count of -1 marks the sync as running, so if it's interrupted the next
+        # refresh starts over instead of trusting a half-reconciled snapshot.
+        section_key = str(section.key)
+        self._save_state(server_id, section_key, 0, -1, section.title)
+        rows = iter(loader(section, page_size=page_size))
+        seen = set()
+        newest = 0
+        while True:
+            page = list(islice(rows, page_size))
+            if not page:
+                break
+            self._store(server_id, section_key, page)
+            newest = max([newest] + [row.updatedAt for row in page])
+            seen.update(row.ratingKey for row in page)
+        self._delete_missing(server_id, section_key, seen)
+        self._save_state(server_id, section_key, newest, len(seen), section.title)
+
+    def _store(self, server_id, section_key, rows):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        server_id,
+                        section_key,
+                        row.ratingKey,
+                        row.title,
+                        row.originalTitle,
+                        row.year,
+                        " ".join(row.guids),
+                        row.updatedAt,
+                        row.addedAt,
+                    )
+                    for row in rows
+                ],
+            )
+            self._db.commit()
+
+    def _delete_missing(self, server_id, section_key, rating_keys):
+        # Drop stored items of the section whose ratingKey isn't in rating_keys
+        with self._lock:
+            stored = self._db.execute(
+                "SELECT rating_key FROM items WHERE server_id = ? AND section_key = ?",
+                (server_id, section_key),
+            ).fetchall()
+            self._db.executemany(
+                "DELETE FROM items WHERE server_id = ? AND section_key = ? AND rating_key = ?",
+                [(server_id, section_key, key) for (key,) in stored if key not in rating_keys],
+            )
+            self._db.commit()
+
+    def _save_state(self, server_id, section_key, last_updated_at, item_count, title):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sections VALUES (?, ?, ?, ?, ?, ?)",
+                (server_id, section_key, last_updated_at, item_count, time.time(), title),
+            )
+            self._db.commit()
+
+    def _count(self, server_id, section_key):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM items WHERE server_id = ? AND section_key = ?",
+                (server_id, section_key),
+            ).fetchone()[0]
+
+    def _load_items(self, server_id, section_key):
+        cursor = self._db.execute(
+            "SELECT rating_key, title, original_title, year, guids, updated_at, added_at "
+            "FROM items WHERE server_id = ? AND section_key = ?",
+            (server_id, section_key),
+        )
+        for rating_key, title, original, year, guids, updated_at, added_at in cursor:
+            yield LibraryItem(
+                rating_key,
+                title,
+                original,
+                year,
+                tuple(guids.split()),
+                updated_at,
+                added_at,
+            )
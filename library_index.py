@@ -0,0 +1,231 @@
+from array import array
+from collections import namedtuple
+from datetime import datetime
+
+from title_matcher import TitleMatcher, normalize_title
+
+# Number of items requested per page when pulling a whole section from Plex
+PAGE_SIZE = 1000
+TMDB_PREFIX = "tmdb://"
+# Plex and TMDb often disagree on a release year by one (festival vs wide release)
+YEAR_TOLERANCE = 1
+
+
+def _epoch(value):
+    if value is None:
+        return 0
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+def _int(value):
+    return int(value) if value not in (None, "") else None
+
+
+class LibraryItem(
+    namedtuple(
+        "LibraryItem",
+        "ratingKey title originalTitle year guids updatedAt addedAt",
+    )
+):
+    # Plain-data view of a Plex movie: everything matching needs, nothing that
+    # keeps a connection to the server alive. Full plexapi objects are fetched
+    # only for the final matched set (see PlexManager.fetch_items()).
+    __slots__ = ()
+
+    @classmethod
+    def from_plex(cls, item):
+        # Read the listing's XML directly: plexapi reloads a partial object (one
+        # request per item) whenever an attribute such as originalTitle, year or
+        # guids is missing, and most movies have no originalTitle.
+        data = getattr(item, "_data", None)
+        if data is None:
+            return cls(
+                int(item.ratingKey),
+                item.title,
+                getattr(item, "originalTitle", None),
+                getattr(item, "year", None),
+                tuple(guid.id for guid in getattr(item, "guids", None) or []),
+                _epoch(getattr(item, "updatedAt", None)),
+                _epoch(getattr(item, "addedAt", None)),
+            )
+        attrib = data.attrib
+        return cls(
+            int(attrib["ratingKey"]),
+            attrib.get("title"),
+            attrib.get("originalTitle"),
+            _int(attrib.get("year")),
+            tuple(guid.attrib["id"] for guid in data.findall("Guid")),
+            _int(attrib.get("updatedAt")) or 0,
+            _int(attrib.get("addedAt")) or 0,
+        )
+
+
+def tmdb_id(guids):
+    # TMDb id from a movie's GUIDs ("tmdb://603"), or None
+    for guid in guids:
+        if guid.startswith(TMDB_PREFIX) and guid[len(TMDB_PREFIX) :].isdigit():
+            return int(guid[len(TMDB_PREFIX) :])
+    return None
+
+
+class LibraryRecord(namedtuple("LibraryRecord", "ratingKey title year tmdb_id")):
+    # What a LibraryIndex lookup returns: created per match from the index's
+    # columns, so only matched movies ever exist as objects.
+    __slots__ = ()
+
+
+class LibraryIndex:
+    # In-memory lookup tables for one Plex library section.
+    # Built once from a full section listing so every title resolves with dict hits
+    # instead of a library.search() request per title.
+    # Movies are stored as columns (arrays of ratingKeys, years and TMDb ids plus a
+    # list of titles) and addressed by row number, so a 50k-item section costs a
+    # few MB rather than one object per movie with its GUID strings.
+
+    def __init__(self):
+        self._keys = array("q")  # row -> ratingKey
+        self._years = array("H")  # row -> year, 0 if unknown
+        self._tmdb = array("q")  # row -> TMDb id, 0 if none
+        self._titles = []  # row -> display title
+        self._original = {}  # row -> original title, only where it differs
+        self._rows = {}  # ratingKey -> row
+        self.by_title = {}  # normalized title -> row, or [rows] when several share it
+        self.by_tmdb = {}  # TMDb id -> row
+        self._matcher = None  # trigram index, built on the first fuzzy lookup
+
+    @classmethod
+    def from_section(cls, section, page_size=PAGE_SIZE):
+        # Pull every movie in the section, page_size items per request.
+        return cls.from_items(
+            LibraryItem.from_plex(item)
+            for item in section.search(libtype="movie", container_size=page_size)
+        )
+
+    @classmethod
+    def from_items(cls, items):
+        # items may be any iterable (e.g. a cursor); only the columns are kept
+        index = cls()
+        for item in items:
+            index.add(item)
+        return index
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, rating_key):
+        return rating_key in self._rows
+
+    def add(self, item):
+        # Index a LibraryItem. ratingKeys are expected to be unique.
+        row = len(self._keys)
+        self._matcher = None
+        self._keys.append(item.ratingKey)
+        self._years.append(item.year or 0)
+        tmdb = tmdb_id(item.guids)
+        self._tmdb.append(tmdb or 0)
+        self._titles.append(item.title)
+        self._rows[item.ratingKey] = row
+        if tmdb:
+            self.by_tmdb.setdefault(tmdb, row)
+        titles = [normalize_title(item.title)]
+        if item.originalTitle and item.originalTitle != item.title:
+            self._original[row] = item.originalTitle
+            titles.append(normalize_title(item.originalTitle))
+        for norm in dict.fromkeys(titles):
+            if not norm:
+                continue
+            rows = self.by_title.get(norm)
+            if rows is None:
+                self.by_title[norm] = row
+            elif isinstance(rows, list):
+                rows.append(row)
+            else:
+                self.by_title[norm] = [rows, row]
+
+    def record(self, row):
+        year = self._years[row]
+        tmdb = self._tmdb[row]
+        return LibraryRecord(self._keys[row], self._titles[row], year or None, tmdb or None)
+
+    def get(self, rating_key):
+        # LibraryRecord for a ratingKey, or None
+        row = self._rows.get(rating_key)
+        return self.record(row) if row is not None else None
+
+    @property
+    def matcher(self):
+        if self._matcher is None:
+            matcher = TitleMatcher()
+            for row, rating_key in enumerate(self._keys):
+                year = self._years[row] or None
+                matcher.add(rating_key, self._titles[row], year)
+                original = self._original.get(row)
+                if original:
+                    matcher.add(rating_key, original, year)
+            self._matcher = matcher
+        return self._matcher
+
+    def find_by_guid(self, guid):
+        # Only tmdb:// GUIDs are indexed; they're all that matching uses
+        movie_id = tmdb_id([guid])
+        row = self.by_tmdb.get(movie_id) if movie_id else None
+        return self.record(row) if row is not None else None
+
+    def _title_rows(self, title):
+        rows = self.by_title.get(normalize_title(title))
+        if rows is None:
+            return []
+        return rows if isinstance(rows, list) else [rows]
+
+    def _compatible(self, row, year=None, tmdb_id=None):
+        # A title match can't be a movie with another TMDb id (Dune 2021 is not
+        # Dune 1984) or a release year more than YEAR_TOLERANCE away.
+        other = self._tmdb[row]
+        if tmdb_id and other and other != int(tmdb_id):
+            return False
+        other_year = self._years[row]
+        return not (year and other_year and abs(other_year - year) > YEAR_TOLERANCE)
+
+    def candidates(self, title, year=None, tmdb_id=None):
+        # Every item find() chooses between: those sharing the normalized title and
+        # compatible with the year and TMDb id (narrowed to the exact year when any
+        # has it). More than one means ambiguous.
+        rows = [row for row in self._title_rows(title) if self._compatible(row, year, tmdb_id)]
+        if year and any(self._years[row] == year for row in rows):
+            rows = [row for row in rows if self._years[row] == year]
+        return [self.record(row) for row in rows]
+
+    def find(self, title, year=None, tmdb_id=None):
+        # Resolve a title (and optional year / TMDb id) to a single library item, or
+        # None. Items whose year is unknown match any year.
+        found = self.candidates(title, year, tmdb_id)
+        return found[0] if found else None
+
+    def fuzzy(self, title, year=None, tmdb_id=None):
+        # Best trigram match that isn't known to be a different movie, or None.
+        # TitleMatcher already refuses other sequels and parts.
+        for _, key in self.matcher.search(title, year):
+            record = self.get(key)
+            if not (tmdb_id and record.tmdb_id and record.tmdb_id != int(tmdb_id)):
+                return record
+        return None
+
+    def match(self, title, year=None, tmdb_id=None, original_title=None, fuzzy=False):
+        # Resolve a source movie: the tmdb:// GUID is exact, titles are the fallback.
+        # fuzzy=True adds a ranked trigram search as the last resort; only the
+        # interactive menu uses it, where the matches are shown before anything is
+        # written. Headless builds leave near misses unmatched.
+        if tmdb_id:
+            row = self.by_tmdb.get(int(tmdb_id))
+            if row is not None:
+                return self.record(row)
+        item = self.find(title, year, tmdb_id)
+        if item is None and original_title and original_title != title:
+            item = self.find(original_title, year, tmdb_id)
+        if item is None and fuzzy:
+            item = self.fuzzy(title, year, tmdb_id)
+            if item is None and original_title and original_title != title:
+                item = self.fuzzy(original_title, year, tmdb_id)
+        return item
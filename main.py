@@ -4,17 +4,31 @@ This script uses:
 - The PlexAPI to search for movies and create collections in the user's Plex library.
 """
 
+import argparse
+import itertools
 import os
 import json
-import re
+import sys
 
 from colorama import init, Fore
 import emojis
-from plex_manager import PlexManager
-from tmdb_search import TMDbSearch
+import profiling
+from catalog import Catalog, collection_catalog, fallback_catalog, normalize_name, studio_catalog
+from defaults import FETCH_WORKERS, POOL_SIZE, WRITE_WORKERS
 from styling import print_plex_logo_ascii
 
+# plexapi, requests and the modules built on them are imported by the mode that
+# needs them (run_collection_builder / run_build_command), so parsing arguments
+# never pays for them. Budget: benchmarks/startup.py.
+
 CONFIG_FILE = os.path.join(os.path.dirname(__file__), "config.json")
+LIBRARY_CACHE_FILE = os.path.join(os.path.dirname(__file__), "library_cache.sqlite")
+TMDB_CACHE_FILE = os.path.join(os.path.dirname(__file__), "tmdb_cache.sqlite")
+TMDB_INDEX_FILE = os.path.join(os.path.dirname(__file__), "tmdb_ids.sqlite")
+BUILD_JOURNAL_FILE = os.path.join(os.path.dirname(__file__), "build_journal.sqlite")
+# Must match id_index.KINDS and daemon.DEFAULT_PORT (kept here so --help doesn't import them)
+INDEX_KINDS = ("collection", "company", "keyword")
+WEBHOOK_PORT = 8765
 
 
 def load_config():
@@ -32,13 +46,14 @@ def save_config(cfg):
         json.dump(cfg, f, indent=4)
 
 
-init(autoreset=True)
-
 config = load_config()
 PLEX_TOKEN = config.get("PLEX_TOKEN")
 PLEX_URL = config.get("PLEX_URL")
 TMDB_API_KEY = config.get("TMDB_API_KEY")
-MOCK_MODE = False  # Set to True to simulate Plex actions without making changes
+# Larger catalogs only show this many names; the rest are found by typing a prefix
+GRID_LIMIT = 150
+# Suggestions listed when a typed prefix matches several names
+SUGGESTION_LIMIT = 10
 
 
 def welcome():
@@ -69,9 +84,34 @@ def run_collection_builder():
     # Main interactive loop. Stays in a single while-loop and avoids repeating run_collection_builder().
     # Returns to main menu with `continue`.
 
+    from clients import Clients
+    from collection_builder import match_sources
+    from collection_sync import apply_sync, existing_collection_keys, plan_sync
+    from id_index import TMDbIdIndex
+    from library_cache import LibrarySnapshotCache
+    from tmdb_cache import ResponseCache
+
+    init(autoreset=True)
+
     def pause(msg: str = "Press Enter to return to the menu..."):
         input(msg)
 
+    # One snapshot cache for the whole session; the first build pays for the full
+    # library download, later builds only fetch what changed on the server.
+    library_cache = LibrarySnapshotCache(LIBRARY_CACHE_FILE)
+    tmdb_cache = ResponseCache(TMDB_CACHE_FILE)
+    # Plex and TMDb clients (and their keep-alive connections) live for the whole
+    # session; they connect on first use and follow credential changes in `config`.
+    clients = Clients(config, tmdb_cache)
+    # Offline name -> id index from TMDb's daily exports (`main.py index update`)
+    id_index = TMDbIdIndex(TMDB_INDEX_FILE)
+    indexed = id_index.counts()
+
+    def index_search(kind):
+        if not indexed.get(kind):
+            return None
+        return lambda text: [name for _, name in id_index.search(kind, text)]
+
     while True:
         welcome()
         check_credentials()
@@ -197,47 +237,8 @@ def run_collection_builder():
         titles = []
         collection_name = None
 
-        # Prepare TMDb helper if key present
-        tmdb = (
-            TMDbSearch(config.get("TMDB_API_KEY"))
-            if config.get("TMDB_API_KEY")
-            else None
-        )
-
-        # Hardcoded TMDB collection IDs and studios
-        known_collections = {
-            "Alien": 8091,
-            "Back to the Future": 264,
-            "Despicable Me": 86066,
-            "Evil Dead": 1960,
-            "Fast & Furious": 9485,
-            "Harry Potter": 1241,
-            "The Hunger Games": 131635,
-            "Indiana Jones": 84,
-            "James Bond": 645,
-            "John Wick": 404609,
-            "Jurassic Park": 328,
-            "The Lord of the Rings": 119,
-            "The Matrix": 2344,
-            "Mission: Impossible": 87359,
-            "Ocean's": 304,
-            "Pirates of the Caribbean": 295,
-            "Planet of the Apes": 173710,
-            "Scream": 2602,
-            "Shrek": 2150,
-            "Sonic the Hedgehog": 720879,
-            "Star Trek": 115575,
-            "Star Wars": 10,
-            "The Dark Knight": 263,
-            "The Twilight Saga": 33514,
-        }
-        studio_map = {
-            "a24": {"company": 41077},
-            "pixar": {"company": 3},
-            "studio ghibli": {"company": 10342},
-            "mcu": {"keyword": 180547},
-            "dceu": {"keyword": 229266},
-        }
+        # Shared TMDb helper if key present
+        tmdb = clients.tmdb
 
         if mode == "1":
             print("Type 'back' to return to the main menu.")
@@ -261,14 +262,14 @@ def run_collection_builder():
 
         elif mode == "2":
             # Franchises/ Series Selection
-            franchises_data = load_fallback_data("Franchises")
             if not tmdb:
+                franchises_data = fallback_catalog("Franchises")
                 print(
                     Fore.RED
                     + f"{emojis.CROSS} TMDb API key not provided. Using fallback hardcoded titles.\n"
                 )
                 print_grid(
-                    franchises_data.keys(),
+                    franchises_data,
                     columns=3,
                     padding=28,
                     title=f"{emojis.FRANCHISE}  Available Franchises:",
@@ -277,27 +278,43 @@ def run_collection_builder():
                     "\n"
                     + Fore.LIGHTBLACK_EX
                     + f"{emojis.REPEAT} Type the franchise name (or 'back' to return): ",
-                    franchises_data.keys(),
+                    franchises_data,
                 )
                 if choice is None:
                     continue
                 titles = franchises_data[choice]
             else:
+                try:
+                    collections_data = collection_catalog()
+                except ValueError as e:
+                    # A malformed user catalog.json
+                    print(Fore.RED + f"{emojis.CROSS} {e}")
+                    pause()
+                    continue
                 print_grid(
-                    known_collections.keys(),
+                    collections_data,
                     columns=3,
                     padding=28,
                     title=f"{emojis.FRANCHISE}  Available Collections (TMDb):",
                 )
+                if indexed.get("collection"):
+                    print(
+                        Fore.LIGHTBLACK_EX
+                        + f"\n{emojis.INFO} Any of the {indexed['collection']} TMDb collections can be typed."
+                    )
                 choice = pick_from_list_case_insensitive(
                     "\n"
                     + Fore.LIGHTBLACK_EX
                     + f"{emojis.REPEAT} Type the collection name (or 'back' to return): ",
-                    known_collections.keys(),
+                    collections_data,
+                    search=index_search("collection"),
                 )
                 if choice is None:
                     continue
-                collection_id = known_collections[choice]
+                if choice in collections_data:
+                    collection_id = collections_data[choice]
+                else:
+                    collection_id = id_index.find_id("collection", choice)
                 try:
                     titles = tmdb.get_movies_from_collection(collection_id)
                 except Exception as e:
@@ -312,14 +329,14 @@ def run_collection_builder():
 
         elif mode == "3":
             # Studios selection
-            studios_data = load_fallback_data("Studios")
             if not tmdb:
+                studios_data = fallback_catalog("Studios")
                 print(
                     Fore.RED
                     + f"{emojis.CROSS} TMDb API key not provided. Using fallback hardcoded titles.\n"
                 )
                 print_grid(
-                    studios_data.keys(),
+                    studios_data,
                     columns=3,
                     padding=24,
                     title=f"{emojis.STUDIO}  Available Studios:",
@@ -328,90 +345,51 @@ def run_collection_builder():
                     "\n"
                     + Fore.LIGHTBLACK_EX
                     + f"{emojis.REPEAT} Type the studio name (or 'back' to return): ",
-                    studios_data.keys(),
+                    studios_data,
                 )
                 if choice is None:
                     continue
                 titles = studios_data.get(choice, [])
             else:
-                pretty_names = []
-                pretty_to_key = {}
-                for key in studio_map.keys():
-                    pretty = key.upper() if key in ("mcu", "dceu") else key.title()
-                    pretty_names.append(pretty)
-                    pretty_to_key[pretty.lower()] = key
+                try:
+                    studios_data = studio_catalog()
+                except ValueError as e:
+                    # A malformed user catalog.json
+                    print(Fore.RED + f"{emojis.CROSS} {e}")
+                    pause()
+                    continue
                 print_grid(
-                    pretty_names,
+                    studios_data,
                     columns=3,
                     padding=24,
                     title=f"{emojis.STUDIO}  Available Studios:",
                 )
-                choice_pretty = pick_from_list_case_insensitive(
+                if indexed.get("company"):
+                    print(
+                        Fore.LIGHTBLACK_EX
+                        + f"\n{emojis.INFO} Any of the {indexed['company']} TMDb companies can be typed."
+                    )
+                choice = pick_from_list_case_insensitive(
                     "\n"
                     + Fore.LIGHTBLACK_EX
                     + f"{emojis.REPEAT} Type the studio name (or 'back' to return): ",
-                    pretty_names,
+                    studios_data,
+                    search=index_search("company"),
                 )
-                if choice_pretty is None:
+                if choice is None:
                     continue
-                norm_key = pretty_to_key[choice_pretty.lower()]
-                studio_info = studio_map[norm_key]
-                import requests
-
-                def fetch_movies_by_company_or_keyword(
-                    api_key, company_id=None, keyword_id=None
-                ):
-                    """
-                    Fetches movie titles from TMDb Discover using a company or keyword.
-                    Raises a clear exception on HTTP errors (e.g., invalid/expired API key).
-                    """
-                    url = "https://api.themoviedb.org/3/discover/movie"
-                    params = {
-                        "api_key": api_key,
-                        "language": "en-US",
-                        "sort_by": "popularity.desc",
-                        "page": 1,
-                    }
-                    if company_id:
-                        params["with_companies"] = company_id
-                    if keyword_id:
-                        params["with_keywords"] = keyword_id
-                    titles_out = []
-                    while True:
-                        resp = requests.get(url, params=params, timeout=10)
-                        # Surface auth and other HTTP errors explicitly
-                        if resp.status_code == 401:
-                            raise ValueError(
-                                "TMDb authentication failed (invalid API key)."
-                            )
-                        if resp.status_code != 200:
-                            # Include a short snippet of the response for debugging
-                            snippet = ""
-                            try:
-                                snippet = resp.json().get("status_message", "")
-                            except Exception:
-                                snippet = resp.text[:200]
-                            raise RuntimeError(
-                                f"TMDb error {resp.status_code}: {snippet}"
-                            )
-                        data = resp.json()
-                        titles_out.extend(
-                            [
-                                m.get("title")
-                                for m in data.get("results", [])
-                                if m.get("title")
-                            ]
-                        )
-                        if data.get("page", 1) >= data.get("total_pages", 1):
-                            break
-                        params["page"] += 1
-                    return titles_out
-
+                if choice in studios_data:
+                    studio_info = studios_data[choice]
+                else:
+                    studio_info = {"company": id_index.find_id("company", choice)}
                 try:
-                    titles = fetch_movies_by_company_or_keyword(
-                        config.get("TMDB_API_KEY"),
-                        company_id=studio_info.get("company"),
-                        keyword_id=studio_info.get("keyword"),
+                    # Streamed: page 1 is fetched now (so a bad key fails here), later
+                    # pages load in the background and are matched as they arrive.
+                    titles = start_stream(
+                        tmdb.iter_discover_movies(
+                            company_id=studio_info.get("company"),
+                            keyword_id=studio_info.get("keyword"),
+                        )
                     )
                 except Exception as e:
                     print(
@@ -429,16 +407,6 @@ def run_collection_builder():
             pause()
             continue
 
-        # MOCK mode short-circuit
-        if MOCK_MODE:
-            print("[MOCK MODE ENABLED]")
-            print(f"Simulating search in Plex for {len(titles)} titles...")
-            for t in titles:
-                print(f"- Would add '{t}' to collection.")
-            print(f"Finished. Would create collection with {len(titles)} movies.")
-            pause()
-            continue
-
         # Ensure Plex credential entered
         plex_token = config.get("PLEX_TOKEN")
         plex_url = config.get("PLEX_URL")
@@ -449,42 +417,41 @@ def run_collection_builder():
 
         # Try connecting to Plex
         try:
-            plex = PlexManager(plex_token, plex_url)
-            library = plex.plex.library.section("Movies")
+            plex = clients.plex
         except Exception:
             print(Fore.RED + f"{emojis.CROSS} Could not connect to Plex.")
             print("Please make sure your Plex Token and URL are correct.\n")
             pause()
             continue
+        # PLEX_LIBRARY in config.json picks another movie section
+        library = plex.get_movie_library(config.get("PLEX_LIBRARY") or "Movies")
+        if library is None:
+            pause()
+            continue
 
-        # Search movie title and optional year from user input.
-        # Example: "Inception (2010)" -> ("Inception", 2010)
-        def extract_title_and_year(raw_title):
-            match = re.match(r"^(.*?)(?:\s+\((\d{4})\))?$", raw_title.strip())
-            return (
-                match.group(1).strip(),
-                int(match.group(2)) if match.group(2) else None,
+        # Resolve every title locally against the cached library snapshot
+        try:
+            index = library_cache.load_index(
+                plex.plex.machineIdentifier,
+                library,
+                loader=plex.section_items,
+                counter=plex.section_size,
             )
+        except Exception as e:
+            print(Fore.RED + f"{emojis.CROSS} Could not read the Plex library '{library.title}'.")
+            print(f"Exception: {e}")
+            pause()
+            continue
 
-        found_movies, not_found = [], []
-        for raw in titles:
-            title, year = extract_title_and_year(raw)
-            try:
-                results = (
-                    library.search(title, year=year) if year else library.search(title)
-                )
-                if results:
-                    found_movies.append(results[0])
-                else:
-                    if year:
-                        fallback = library.search(title)
-                        if fallback:
-                            found_movies.append(fallback[0])
-                            continue
-                    not_found.append(raw)
-            except (AttributeError, TypeError, ValueError) as e:
-                print(f"Error searching for '{raw}': {e}")
-                not_found.append(raw)
+        try:
+            # Near-miss titles are accepted here: every add is listed and confirmed below
+            found_movies, not_found = match_sources(index, titles, fuzzy=True)
+        except Exception as e:
+            # A later TMDb page failed while streaming
+            print(Fore.RED + f"{emojis.CROSS} Error retrieving movies from TMDb.")
+            print(f"Exception: {e}")
+            pause()
+            continue
 
         print(f"\nFound {len(found_movies)} movies in Plex.")
         if not_found:
@@ -497,11 +464,41 @@ def run_collection_builder():
             pause()
             continue
 
-        print("\nMovies to add to collection:")
-        for i, mv in enumerate(found_movies, 1):
-            print(f"{i}. {mv.title}")
+        # Diff against the existing collection so a rerun only applies what changed
+        try:
+            existing_keys = existing_collection_keys(library, collection_name)
+        except ValueError as e:
+            print(Fore.RED + f"{emojis.CROSS} {e}")
+            pause()
+            continue
+        plan = plan_sync(existing_keys, [mv.ratingKey for mv in found_movies])
+
+        def item_title(key):
+            record = index.get(key)
+            return record.title if record else str(key)
+
+        if plan.exists:
+            print(
+                f"\nCollection '{collection_name}' already exists: "
+                f"{plan.unchanged} already in it, {len(plan.adds)} to add, {len(plan.removes)} to remove."
+            )
+        if not plan.adds and not plan.removes:
+            print(f"{emojis.CHECK} Collection is already up to date.")
+            pause()
+            continue
+        if plan.adds:
+            print("\nMovies to add to collection:")
+            for i, key in enumerate(plan.adds, 1):
+                print(f"{i}. {item_title(key)}")
+        if plan.removes:
+            print("\nMovies in the collection that are no longer in the source:")
+            for i, key in enumerate(plan.removes, 1):
+                print(f"{i}. {item_title(key)}")
+            prune = input("Remove these from the collection? (y/n): ").strip().lower()
+            if prune != "y":
+                plan = plan._replace(removes=[])
         confirm = (
-            input("Proceed to create collection with these movies? (y/n): ")
+            input("Proceed to update the collection with these changes? (y/n): ")
             .strip()
             .lower()
         )
@@ -510,44 +507,75 @@ def run_collection_builder():
             pause()
             continue
 
-        library.createCollection(collection_name, items=found_movies)
+        result = apply_sync(plex, library, collection_name, plan)
+        failed = [r for r in result.added + result.removed if not r.ok]
+        added = sum(1 for r in result.added if r.ok)
+        removed = sum(1 for r in result.removed if r.ok)
+        verb = "Updated" if plan.exists else "Created"
         print(
-            f"\n{emojis.CHECK} Created collection '{collection_name}' with {len(found_movies)} movies."
+            f"\n{emojis.CHECK} {verb} collection '{collection_name}': {added} added, {removed} removed."
         )
+        if failed:
+            print(f"{emojis.CROSS} Couldn’t update {len(failed)}:")
+            for r in failed:
+                print(f"- {r.item.title}: {r.error}")
         pause()
         # loop continues to main menu
 
 
-def load_fallback_data(section):
-    # Load fallback data for a given section from fallback_collections.json.
-    fallback_path = os.path.join(os.path.dirname(__file__), "fallback_collections.json")
-    with open(fallback_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return data.get(section, {})
+def start_stream(stream):
+    # Pull the first item of a lazy source so request errors surface right away.
+    # Returns [] for an empty stream, otherwise an iterator over every item.
+    first = next(stream, None)
+    if first is None:
+        return []
+    return itertools.chain([first], stream)
 
 
-def print_grid(names, columns=3, padding=28, title=None, title_emoji=None):
+def print_grid(names, columns=3, padding=28, title=None, title_emoji=None, limit=GRID_LIMIT):
     # Prints the list of titles in columns for readability
+    # A Catalog is already sorted; very long lists are cut off after `limit` names.
     if title:
         print((title_emoji or "") + " " + title)
         print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n")
-    sorted_names = sorted(names)
+    sorted_names = names.sorted_names if isinstance(names, Catalog) else sorted(names)
+    hidden = max(len(sorted_names) - limit, 0) if limit else 0
+    if hidden:
+        sorted_names = sorted_names[:limit]
     rows = [sorted_names[i : i + columns] for i in range(0, len(sorted_names), columns)]
     for row in rows:
         print("".join(name.ljust(padding) for name in row))
+    if hidden:
+        print(f"\n... and {hidden} more. Type the first few letters of a name to search.")
 
 
-def pick_from_list_case_insensitive(prompt, choices, back_allowed=True):
+def pick_from_list_case_insensitive(prompt, choices, back_allowed=True, search=None):
     # Ask the user to pick an option from list of choices
     # Returns the matched canonical item or None if user typed 'back' and back_allowed is True.
+    # A prefix that matches exactly one item picks it; several matches are listed.
+    # `search(text) -> [name, ...]` extends the choices (e.g. the TMDb id index).
     # Keeps prompting until a valid choice is entered.
-    lowered = {c.lower(): c for c in choices}
+    catalog = choices if isinstance(choices, Catalog) else Catalog(dict.fromkeys(choices))
     while True:
         choice = input(prompt).strip()
         if back_allowed and choice.lower() == "back":
             return None
-        if choice.lower() in lowered:
-            return lowered[choice.lower()]
+        match = catalog.lookup(choice)
+        if match is not None:
+            return match
+        matches = catalog.prefix(choice, limit=SUGGESTION_LIMIT + 1)
+        if not matches and search is not None:
+            matches = search(choice)
+            exact = [name for name in matches if normalize_name(name) == normalize_name(choice)]
+            if exact:
+                return exact[0]
+        if len(matches) == 1:
+            return matches[0]
+        if matches:
+            print("Did you mean one of these?")
+            for name in matches[:SUGGESTION_LIMIT]:
+                print(f"- {name}")
+            continue
         print("Unknown option. Please type one of the listed items, or 'back'.")
 
 
@@ -559,5 +587,259 @@ def print_list(items, columns=3, padding=28):
         print("".join(name.ljust(padding) for name in row))
 
 
-if __name__ == "__main__":
+def run_build_command(args):
+    # Headless entry point: build every collection in a spec file and print a JSON summary.
+    # Exit status is 0 when every collection succeeded, 1 otherwise.
+    from batch_build import load_spec, run_batch
+
+    if args.apply_plan:
+        return run_apply_plan_command(args)
+    try:
+        spec = load_spec(args.spec)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(json.dumps({"ok": 0, "errors": 1, "error": str(e), "collections": []}))
+        return 1
+    if args.no_prune:
+        spec["prune"] = False
+    if args.plan:
+        return run_plan_command(args, spec)
+    summary = run_batch(
+        spec,
+        load_config(),
+        LIBRARY_CACHE_FILE,
+        TMDB_CACHE_FILE,
+        TMDB_INDEX_FILE,
+        fetch_workers=args.fetch_workers,
+        write_workers=args.write_workers,
+        pool_size=args.pool_size,
+        plex_backend=args.plex_backend,
+        journal_file=BUILD_JOURNAL_FILE,
+        fresh=args.fresh,
+    )
+    print(json.dumps(summary, indent=2 if args.pretty else None))
+    return 0 if not summary.get("error") and not summary["errors"] else 1
+
+
+def run_plan_command(args, spec):
+    # `build --plan`: print the spec's exact change plan without any Plex or TMDb
+    # request, from the library snapshot and TMDb cache left by earlier builds
+    from clients import Clients
+    from id_index import TMDbIdIndex
+    from library_cache import LibrarySnapshotCache
+    from planner import Planner
+    from tmdb_cache import ResponseCache
+
+    clients = Clients(load_config(), ResponseCache(TMDB_CACHE_FILE, offline=True))
+    library_cache = LibrarySnapshotCache(LIBRARY_CACHE_FILE)
+    try:
+        plan = Planner(library_cache, clients.tmdb, TMDbIdIndex(TMDB_INDEX_FILE)).run(spec)
+    finally:
+        clients.close()
+        library_cache.close()
+    print(json.dumps(plan, indent=2 if args.pretty else None))
+    return 0 if not plan["errors"] else 1
+
+
+def run_apply_plan_command(args):
+    # `build --apply-plan FILE`: apply a saved `build --plan` output verbatim
+    from clients import Clients
+    from library_cache import LibrarySnapshotCache
+    from planner import apply_plan
+
+    try:
+        with open(args.apply_plan, "r", encoding="utf-8") as f:
+            plan = json.load(f)
+    except (OSError, ValueError) as e:
+        print(json.dumps({"ok": 0, "errors": 1, "error": str(e), "collections": []}))
+        return 1
+    clients = Clients(load_config(), pool_size=args.pool_size, plex_backend=args.plex_backend)
+    library_cache = LibrarySnapshotCache(LIBRARY_CACHE_FILE)
+    try:
+        summary = apply_plan(plan, clients, library_cache)
+    except ValueError as e:
+        summary = {"ok": 0, "errors": 1, "error": str(e), "collections": []}
+    finally:
+        clients.close()
+        library_cache.close()
+    print(json.dumps(summary, indent=2 if args.pretty else None))
+    return 0 if not summary["errors"] else 1
+
+
+def run_serve_command(args):
+    # Daemon mode: keep the spec's collections up to date from Plex webhooks
+    from clients import Clients
+    from daemon import WebhookDaemon
+    from id_index import TMDbIdIndex
+    from tmdb_cache import ResponseCache
+
+    config = load_config()
+    clients = Clients(config, ResponseCache(TMDB_CACHE_FILE), plex_backend=args.plex_backend)
+    daemon = WebhookDaemon(args.spec, clients, TMDbIdIndex(TMDB_INDEX_FILE), args.secret)
+    try:
+        daemon.serve(args.host, args.port)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(json.dumps({"error": str(e)}))
+        return 1
+    finally:
+        clients.close()
+    return 0
+
+
+def run_index_command(args):
+    # Maintain or query the offline TMDb id index; prints JSON.
+    from clients import make_session
+    from id_index import TMDbIdIndex, read_export
+
+    index = TMDbIdIndex(TMDB_INDEX_FILE)
+    try:
+        if args.action == "update":
+            result = index.update(make_session("tmdb"), kinds=args.kinds or INDEX_KINDS)
+        elif args.action == "import":
+            with open(args.file, "rb") as f:
+                result = index.import_export(args.kind, read_export(f), args.date)
+        else:
+            result = [
+                {"id": entry_id, "name": name}
+                for entry_id, name in index.search(args.kind, args.text, limit=args.limit)
+            ]
+    except (OSError, ValueError) as e:
+        print(json.dumps({"error": str(e)}))
+        return 1
+    finally:
+        index.close()
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build Plex collections from TMDb or title lists.")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print per-stage time, HTTP requests, bytes and retries to stderr on exit.",
+    )
+    parser.add_argument(
+        "--profile-output",
+        metavar="FILE",
+        help="Also write the profile as a Chrome trace JSON file (implies --profile).",
+    )
+    commands = parser.add_subparsers(dest="command")
+    build = commands.add_parser("build", help="Build collections from a spec file without prompts.")
+    build.add_argument("--spec", help="YAML or JSON file listing collections.")
+    build.add_argument(
+        "--plan",
+        action="store_true",
+        help="Print the change plan as JSON instead of building, using only the library "
+        "snapshot and TMDb cache (no Plex or TMDb requests).",
+    )
+    build.add_argument(
+        "--apply-plan",
+        metavar="FILE",
+        help="Apply a plan saved from --plan exactly as written (no --spec needed).",
+    )
+    build.add_argument(
+        "--no-prune",
+        action="store_true",
+        help="Never remove movies that are no longer in a collection's source.",
+    )
+    build.add_argument(
+        "--fetch-workers",
+        type=int,
+        default=FETCH_WORKERS,
+        help=f"Collections fetched from TMDb at once (default {FETCH_WORKERS}).",
+    )
+    build.add_argument(
+        "--write-workers",
+        type=int,
+        default=WRITE_WORKERS,
+        help=f"Collections written to Plex at once (default {WRITE_WORKERS}).",
+    )
+    build.add_argument(
+        "--pool-size",
+        type=int,
+        default=POOL_SIZE,
+        help=f"Keep-alive connections kept open per server (default {POOL_SIZE}).",
+    )
+    build.add_argument(
+        "--plex-backend",
+        choices=("plexapi", "async"),
+        help="Plex client: plexapi, or async (aiohttp, concurrent requests). "
+        "Defaults to PLEX_BACKEND in config.json, else plexapi.",
+    )
+    build.add_argument(
+        "--fresh",
+        action="store_true",
+        help="Start over instead of resuming an unfinished run of the same spec.",
+    )
+    build.add_argument("--pretty", action="store_true", help="Indent the JSON summary.")
+
+    serve = commands.add_parser(
+        "serve", help="Add new movies to the spec's collections as Plex reports them (webhooks)."
+    )
+    serve.add_argument("--spec", required=True, help="YAML or JSON file listing collections.")
+    serve.add_argument(
+        "--host", default="127.0.0.1", help="Address to listen on (default %(default)s)."
+    )
+    serve.add_argument(
+        "--port", type=int, default=WEBHOOK_PORT, help="Port to listen on (default %(default)s)."
+    )
+    serve.add_argument(
+        "--secret", help="Require ?secret=<value> on the webhook URL configured in Plex."
+    )
+    serve.add_argument(
+        "--plex-backend",
+        choices=("plexapi", "async"),
+        help="Plex client (default: PLEX_BACKEND in config.json, else plexapi).",
+    )
+
+    index = commands.add_parser(
+        "index", help="Offline index of TMDb collection, company and keyword names."
+    )
+    actions = index.add_subparsers(dest="action", required=True)
+    update = actions.add_parser("update", help="Download TMDb's newest daily id exports.")
+    update.add_argument(
+        "--kind",
+        dest="kinds",
+        action="append",
+        choices=INDEX_KINDS,
+        help="Only update this kind (repeatable; default all).",
+    )
+    load = actions.add_parser("import", help="Import a downloaded export file (.json.gz).")
+    load.add_argument("kind", choices=INDEX_KINDS)
+    load.add_argument("file")
+    load.add_argument("--date", default="manual", help="Export date to record for it.")
+    search = actions.add_parser("search", help="Look up names by prefix or fuzzy match.")
+    search.add_argument("kind", choices=INDEX_KINDS)
+    search.add_argument("text")
+    search.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args(argv)
+    if args.command == "build" and not (args.spec or args.apply_plan):
+        build.error("--spec is required (or --apply-plan FILE)")
+    if args.command == "build" and args.plan and args.apply_plan:
+        build.error("--plan and --apply-plan can't be combined")
+    return args
+
+
+def run(args):
+    if args.command == "build":
+        return run_build_command(args)
+    if args.command == "index":
+        return run_index_command(args)
+    if args.command == "serve":
+        return run_serve_command(args)
     run_collection_builder()
+    return 0
+
+
+if __name__ == "__main__":
+    cli_args = parse_args()
+    if not (cli_args.profile or cli_args.profile_output):
+        sys.exit(run(cli_args))
+    profiler = profiling.enable()
+    try:
+        status = run(cli_args)
+    finally:
+        print(profiler.report(), file=sys.stderr)
+        if cli_args.profile_output:
+            profiler.write_trace(cli_args.profile_output)
+    sys.exit(status)
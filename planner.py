@@ -0,0 +1,202 @@
+import time
+
+from build_scheduler import definition_targets, parse_targets
+from collection_builder import (
+    CollectionBuilder,
+    extract_title_and_year,
+    iter_matches,
+    source_key,
+)
+from collection_sync import SyncPlan, apply_sync, plan_sync
+from journal import spec_hash
+from tmdb_search import TMDbMovie
+
+PLAN_VERSION = 1
+
+
+def _describe(record):
+    return {"ratingKey": record.ratingKey, "title": record.title, "year": record.year}
+
+
+def _ambiguity(index, source, match):
+    # Library items a title-matched source could equally have been, or None
+    if isinstance(source, TMDbMovie):
+        if match.tmdb_id == source.id:
+            return None
+        title, year = source.title, source.year
+    else:
+        title, year = extract_title_and_year(str(source))
+    movie_id = source.id if isinstance(source, TMDbMovie) else None
+    candidates = index.candidates(title, year, movie_id)
+    if len(candidates) < 2 and movie_id and source.original_title:
+        candidates = index.candidates(source.original_title, year, movie_id)
+    if len(candidates) < 2:
+        return None
+    return {
+        "source": str(source),
+        "chosen": match.ratingKey,
+        "candidates": [_describe(record) for record in candidates],
+    }
+
+
+class Planner:
+    # Offline dry run of a spec: every source is resolved against the library
+    # snapshot and the TMDb response cache (opened with offline=True), and each
+    # collection is diffed against the members its last build recorded. Makes no
+    # Plex or TMDb requests at all; whatever isn't cached is reported as an error.
+    # The resulting plan lists ratingKeys, so apply_plan() can replay it verbatim.
+
+    def __init__(self, library_cache, tmdb=None, id_index=None):
+        self.library_cache = library_cache
+        self.sources = CollectionBuilder(None, None, tmdb, id_index)
+        self._fetched = {}  # source key -> source list, shared by identical definitions
+
+    def fetch(self, definition):
+        try:
+            key = source_key(definition, self.sources.id_index)
+        except Exception:
+            key = None
+        if key is None:
+            return self.sources.fetch_sources(definition)
+        if key not in self._fetched:
+            self._fetched[key] = self.sources.fetch_sources(definition)
+        return self._fetched[key]
+
+    def plan_target(self, definition, target, sources, prune=True):
+        # One collection in one section, as a JSON-serializable plan entry
+        name = definition["name"]
+        section = self.library_cache.section(target.server, target.library)
+        index = self.library_cache.stored_index(section.server_id, section.key)
+        found, not_found, ambiguous = [], [], []
+        for source, match in iter_matches(index, sources):
+            if match is None:
+                not_found.append(str(source))
+                continue
+            found.append(match)
+            unsure = _ambiguity(index, source, match)
+            if unsure is not None:
+                ambiguous.append(unsure)
+
+        state = self.library_cache.collection(section.server_id, section.key, name)
+        if state is None:
+            # Never built: its members (if any) are unknown, so nothing can be pruned
+            plan = plan_sync([], [item.ratingKey for item in found], prune=False)
+            exists = None
+        else:
+            plan = plan_sync(
+                state.rating_keys,
+                [item.ratingKey for item in found],
+                prune=definition.get("prune", prune),
+            )
+            exists = plan.exists
+
+        titles = {item.ratingKey: item.title for item in found}
+        for key in plan.removes:
+            record = index.get(key)
+            titles[key] = record.title if record else None
+        return {
+            "name": name,
+            "server": target.server,
+            "library": target.library,
+            "server_id": section.server_id,
+            "section_key": section.key,
+            "status": "ok",
+            "exists": exists,
+            "sources": len(found) + len(not_found),
+            "matched": len(found),
+            "unchanged": plan.unchanged,
+            "adds": [{"ratingKey": key, "title": titles[key]} for key in plan.adds],
+            "removes": [{"ratingKey": key, "title": titles[key]} for key in plan.removes],
+            "unmatched": not_found,
+            "ambiguous": ambiguous,
+        }
+
+    def run(self, spec):
+        # Plan every collection of the spec in every section it targets
+        started = time.monotonic()
+        library_name = spec.get("library", "Movies")
+        prune = spec.get("prune", True)
+        targets = parse_targets(spec["targets"], library_name) if "targets" in spec else None
+        plan = {
+            "version": PLAN_VERSION,
+            "spec": spec_hash(spec),
+            "created_at": int(time.time()),
+            "ok": 0,
+            "errors": 0,
+            "collections": [],
+        }
+
+        def add(entry):
+            plan["ok" if entry["status"] == "ok" else "errors"] += 1
+            plan["collections"].append(entry)
+
+        for definition in spec["collections"]:
+            name = definition["name"]
+            try:
+                where = definition_targets(definition, targets, library_name)
+                sources = self.fetch(definition)
+            except Exception as e:
+                # e.g. tmdb_cache.CacheMiss: the source was never fetched by a build
+                add({"name": name, "status": "error", "error": str(e)})
+                continue
+            for target in where:
+                try:
+                    add(self.plan_target(definition, target, sources, prune))
+                except Exception as e:
+                    add(
+                        {
+                            "name": name,
+                            "server": target.server,
+                            "library": target.library,
+                            "status": "error",
+                            "error": str(e),
+                        }
+                    )
+        plan["elapsed"] = round(time.monotonic() - started, 3)
+        return plan
+
+
+def apply_plan(plan, clients, library_cache=None):
+    # Apply a plan from Planner.run() exactly as written: its adds and removes by
+    # ratingKey, in the section it was made for. Entries whose server's machine
+    # identifier no longer matches are refused. Returns a summary like run_batch().
+    if plan.get("version") != PLAN_VERSION:
+        raise ValueError(f"Unsupported plan version {plan.get('version')!r}.")
+    summary = {"ok": 0, "errors": 0, "collections": []}
+    for entry in plan["collections"]:
+        if entry.get("status") != "ok":
+            continue
+        result = {"name": entry["name"], "server": entry["server"], "library": entry["library"]}
+        try:
+            plex = clients.plex_server(entry["server"])
+            if plex.plex.machineIdentifier != entry["server_id"]:
+                raise ValueError("The plan was made for a different Plex server.")
+            library = plex.plex.library.sectionByID(int(entry["section_key"]))
+            sync = SyncPlan(
+                [item["ratingKey"] for item in entry["adds"]],
+                [item["ratingKey"] for item in entry["removes"]],
+                entry["unchanged"],
+                bool(entry["exists"]),
+            )
+            applied = apply_sync(plex, library, entry["name"], sync)
+            added = [int(r.item.ratingKey) for r in applied.added if r.ok]
+            removed = [int(r.item.ratingKey) for r in applied.removed if r.ok]
+            if library_cache is not None:
+                library_cache.update_collection(
+                    entry["server_id"], entry["section_key"], entry["name"], added, removed
+                )
+            result.update(
+                added=len(added),
+                removed=len(removed),
+                failed=[
+                    {"title": r.item.title, "error": r.error}
+                    for r in applied.added + applied.removed
+                    if not r.ok
+                ],
+            )
+            result["status"] = "error" if result["failed"] else "ok"
+        except Exception as e:
+            result.update(status="error", error=str(e))
+        summary["ok" if result["status"] == "ok" else "errors"] += 1
+        summary["collections"].append(result)
+    return summary
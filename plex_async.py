@@ -0,0 +1,275 @@
+import asyncio
+import contextvars
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+from clients import RETRIES, should_retry
+from library_index import PAGE_SIZE, LibraryItem
+from plex_manager import BATCH_SIZE, FETCH_CHUNK, MutationResult, PlexManager
+from rate_limit import controller
+
+# Plex requests in flight at once across every hot-path call
+ASYNC_CONCURRENCY = 8
+REQUEST_TIMEOUT = 30
+
+# Profiling stage of the caller that started the current coroutine; the event loop
+# runs on its own thread, so the thread-local stage stack can't be used there.
+_stage = contextvars.ContextVar("plex_async_stage", default=None)
+
+
+def _items_from_xml(text, sections=None):
+    # (LibraryItems, totalSize) from a MediaContainer of Video elements.
+    # If given, sections is filled with ratingKey -> librarySectionID.
+    root = ElementTree.fromstring(text)
+    items = []
+    for video in root.iter("Video"):
+        year = video.get("year")
+        if sections is not None:
+            sections[int(video.get("ratingKey"))] = int(
+                video.get("librarySectionID") or root.get("librarySectionID")
+            )
+        items.append(
+            LibraryItem(
+                int(video.get("ratingKey")),
+                video.get("title"),
+                video.get("originalTitle"),
+                int(year) if year else None,
+                tuple(guid.get("id") for guid in video.findall("Guid")),
+                int(video.get("updatedAt") or 0),
+                int(video.get("addedAt") or 0),
+            )
+        )
+    total = root.get("totalSize") or root.get("size") or len(items)
+    return items, int(total)
+
+
+class _LoopThread:
+    # An asyncio event loop on a daemon thread, so synchronous callers can run
+    # coroutines on it and keep its connections open between calls.
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+class AsyncPlexManager(PlexManager):
+    # PlexManager whose hot paths (section listing, metadata fetches, collection
+    # edits) talk to the Plex HTTP API directly with aiohttp, up to `concurrency`
+    # requests at a time, instead of one plexapi request after another.
+    # Connecting, section lookup and collection membership still go through plexapi.
+    # The public methods are unchanged; items come back as LibraryItems rather than
+    # plexapi objects. Each *_async coroutine can also be awaited directly on `loop`.
+
+    def __init__(self, token, base_url, session=None, concurrency=ASYNC_CONCURRENCY):
+        try:
+            import aiohttp
+        except ImportError:
+            raise RuntimeError(
+                "aiohttp is required for the async Plex backend (pip install aiohttp)."
+            ) from None
+        super().__init__(token, base_url, session=session)
+        self._aiohttp = aiohttp
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.concurrency = max(1, concurrency)
+        self._runner = _LoopThread()
+        self.loop = self._runner.loop
+        # Threads blocking in HostLimiter.acquire() on the loop's behalf
+        self._waiters = ThreadPoolExecutor(self.concurrency, thread_name_prefix="plex-limit")
+        self._http = None
+        self._limit = None
+        self._section_ids = {}  # ratingKey -> section, for items from fetch_items()
+        self.rate_controller = controller()
+
+    def close(self):
+        if self._http is not None:
+            self._runner.run(self._http.close())
+        self._runner.stop()
+        self._waiters.shutdown(wait=False)
+
+    def _run(self, coro):
+        # Run a coroutine on the backend loop, charging its requests to the caller's stage
+        stage = profiling.current_stage()
+
+        async def with_stage():
+            _stage.set(stage)
+            return await coro
+
+        return self._runner.run(with_stage())
+
+    async def _acquire(self, limiter):
+        # acquire() blocks, so it waits on a worker thread rather than the loop. If the
+        # request is cancelled meanwhile, a slot the thread still gets is given back.
+        waiter = self._waiters.submit(limiter.acquire)
+        try:
+            await asyncio.wrap_future(waiter)
+        except asyncio.CancelledError:
+            waiter.add_done_callback(
+                lambda done: done.cancelled() or done.exception() or limiter.abandon()
+            )
+            raise
+
+    async def _request(self, method, path, params=None):
+        if self._http is None:
+            self._http = self._aiohttp.ClientSession(
+                headers={"X-Plex-Token": self.token, "Accept": "application/xml"},
+                connector=self._aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=self._aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            )
+            self._limit = asyncio.Semaphore(self.concurrency)
+        # The same per-host budget as the plexapi sessions (clients.ControlledAdapter)
+        limiter = self.rate_controller.limiter(self.base_url)
+        attempt = 0
+        async with self._limit:
+            while True:
+                await self._acquire(limiter)
+                started = time.perf_counter()
+                status, no_answer = None, False
+                try:
+                    async with self._http.request(
+                        method, self.base_url + path, params=params
+                    ) as resp:
+                        body = await resp.text()
+                        status, retry_after = resp.status, resp.headers.get("Retry-After")
+                except (self._aiohttp.ClientError, asyncio.TimeoutError):
+                    no_answer = True
+                    raise
+                finally:
+                    # Released on every path (CancelledError included) so the
+                    # host can't get stuck at its concurrency cap
+                    elapsed = time.perf_counter() - started
+                    if status is not None:
+                        limiter.release(elapsed, status)
+                    elif no_answer:
+                        limiter.release(elapsed)
+                    else:
+                        limiter.abandon()
+                profiling.record_request(
+                    "plex",
+                    method,
+                    self.base_url + path,
+                    status,
+                    len(body),
+                    elapsed,
+                    stage=_stage.get(),
+                )
+                if attempt < RETRIES and should_retry(method, status):
+                    profiling.record_retry(stage=_stage.get())
+                    await asyncio.sleep(limiter.retry_delay(attempt, retry_after))
+                    attempt += 1
+                    continue
+                if status >= 400:
+                    raise RuntimeError(f"Plex error {status} for {method} {path}")
+                return body
+
+    async def section_items_async(self, section_key, updated_since=None, page_size=PAGE_SIZE):
+        # Every movie in a section: page 1 reports totalSize, the rest load concurrently.
+        params = {"type": 1, "includeGuids": 1}
+        if updated_since is not None:
+            params["updatedAt>>"] = int(updated_since.timestamp())
+        path = f"/library/sections/{section_key}/all"
+
+        async def page(start):
+            return _items_from_xml(
+                await self._request(
+                    "GET",
+                    path,
+                    {**params, "X-Plex-Container-Start": start, "X-Plex-Container-Size": page_size},
+                )
+            )
+
+        items, total = await page(0)
+        rest = await asyncio.gather(*(page(start) for start in range(page_size, total, page_size)))
+        for more, _ in rest:
+            items.extend(more)
+        return items
+
+    async def section_size_async(self, section_key):
+        # Movie count alone: an empty page still reports totalSize
+        params = {"type": 1, "X-Plex-Container-Start": 0, "X-Plex-Container-Size": 0}
+        body = await self._request("GET", f"/library/sections/{section_key}/all", params)
+        return _items_from_xml(body)[1]
+
+    async def fetch_items_async(self, rating_keys, chunk_size=FETCH_CHUNK):
+        rating_keys = [int(key) for key in rating_keys]
+
+        async def chunk(keys):
+            body = await self._request("GET", "/library/metadata/" + ",".join(map(str, keys)))
+            return _items_from_xml(body, self._section_ids)[0]
+
+        chunks = await asyncio.gather(
+            *(
+                chunk(rating_keys[start : start + chunk_size])
+                for start in range(0, len(rating_keys), chunk_size)
+            )
+        )
+        loaded = {item.ratingKey: item for items in chunks for item in items}
+        return [loaded[key] for key in rating_keys if key in loaded]
+
+    async def edit_collection_async(
+        self, section_key, items, collection_name, remove=False, batch_size=BATCH_SIZE
+    ):
+        # Same multi-edit as PlexManager._edit_collection_tags, with the chunks (and
+        # the one-by-one retries of a rejected chunk) sent concurrently.
+        if remove:
+            edits = {"collection[].tag.tag-": collection_name, "collection.locked": 1}
+        else:
+            edits = {"collection[0].tag.tag": collection_name, "collection.locked": 1}
+        path = f"/library/sections/{section_key}/all"
+
+        async def edit(chunk):
+            params = {"type": 1, "id": ",".join(str(item.ratingKey) for item in chunk), **edits}
+            await self._request("PUT", path, params)
+
+        async def one(item):
+            try:
+                await edit([item])
+                return MutationResult(item, True, None)
+            except Exception as e:
+                return MutationResult(item, False, str(e))
+
+        async def batch(chunk):
+            try:
+                await edit(chunk)
+                return [MutationResult(item, True, None) for item in chunk]
+            except Exception:
+                profiling.record_retry(len(chunk), stage=_stage.get())
+                return list(await asyncio.gather(*(one(item) for item in chunk)))
+
+        batches = await asyncio.gather(
+            *(batch(items[start : start + batch_size]) for start in range(0, len(items), batch_size))
+        )
+        return [result for results in batches for result in results]
+
+    def _section_id(self, media):
+        return self._section_ids[media.ratingKey]
+
+    def section_items(self, section, updated_since=None, page_size=PAGE_SIZE):
+        with profiling.stage("plex.section_items"):
+            return self._run(self.section_items_async(section.key, updated_since, page_size))
+
+    def section_size(self, section):
+        with profiling.stage("plex.section_items"):
+            return self._run(self.section_size_async(section.key))
+
+    def fetch_items(self, rating_keys, chunk_size=FETCH_CHUNK):
+        with profiling.stage("plex.fetch_items"):
+            return self._run(self.fetch_items_async(rating_keys, chunk_size))
+
+    def _edit_collection_tags(self, library, items, collection_name, remove, batch_size):
+        with profiling.stage("plex.collection_edit"):
+            return self._run(
+                self.edit_collection_async(library.key, items, collection_name, remove, batch_size)
+            )
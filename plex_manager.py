@@ -1,10 +1,27 @@
+from collections import namedtuple
+
 from plexapi.server import PlexServer
 import emojis
+import profiling
+from clients import make_session
+from library_cache import section_items, section_size
+from library_index import PAGE_SIZE, LibraryIndex
+
+# Items per multi-edit request; keeps the id=1,2,3,... query string well under URL limits
+BATCH_SIZE = 200
+# Items per /library/metadata/1,2,3 request, for both Plex backends
+FETCH_CHUNK = 200
+
+# Outcome of a collection edit for one item; error is None on success
+MutationResult = namedtuple("MutationResult", "item ok error")
 
 
 class PlexManager:
-    def __init__(self, token, base_url):
-        self.plex = PlexServer(base_url, token)
+    def __init__(self, token, base_url, session=None):
+        # plexapi sends every request through this pooled keep-alive session
+        session = session or make_session("plex")
+        with profiling.stage("plex.connect"):
+            self.plex = PlexServer(base_url, token, session=session)
 
     def get_movie_library(self, library_name):
         try:
@@ -14,16 +31,96 @@ class PlexManager:
             print(e)
             return None
 
-    def find_movies(self, library, titles):
+    def build_index(self, library):
+        # Fetch the whole section once so titles can be matched without a search per title
+        return LibraryIndex.from_section(library)
+
+    def section_items(self, section, updated_since=None, page_size=PAGE_SIZE):
+        # LibraryItems for every movie in a section (or those updated after a datetime);
+        # the snapshot cache lists sections through this
+        return section_items(section, updated_since, page_size)
+
+    def section_size(self, section):
+        # Current number of movies in a section, asked fresh from the server
+        return section_size(section)
+
+    def fetch_items(self, rating_keys, chunk_size=FETCH_CHUNK):
+        # Load full plexapi objects for the given ratingKeys, many per request
+        # (/library/metadata/1,2,3), preserving the input order.
+        rating_keys = [int(key) for key in rating_keys]
+        loaded = {}
+        with profiling.stage("plex.fetch_items"):
+            for start in range(0, len(rating_keys), chunk_size):
+                for item in self.plex.fetchItems(rating_keys[start : start + chunk_size]):
+                    loaded[int(item.ratingKey)] = item
+        return [loaded[key] for key in rating_keys if key in loaded]
+
+    def find_movies(self, library, titles, index=None):
+        if index is None:
+            index = self.build_index(library)
         matched = []
-        for title in titles:
-            results = library.search(title)
-            if results:
-                matched.append((title, results[0]))
-        return matched
+        with profiling.stage("match"):
+            for title in titles:
+                result = index.find(title)
+                if result is not None:
+                    matched.append((title, result))
+        media = self.fetch_items([record.ratingKey for _, record in matched])
+        return list(zip([title for title, _ in matched], media))
+
+    def _edit_collection_tags(self, library, items, collection_name, remove, batch_size):
+        # Tag every item in one multi-edit request per chunk
+        # (PUT /library/sections/<id>/all?id=1,2,3&collection[0].tag.tag=...).
+        # multiEdit() keeps no batch state on the section, so several writer
+        # threads can share one section object.
+        # If a chunk is rejected, retry its items one by one so a single bad item
+        # doesn't fail the rest and every item gets its own result.
+        if remove:
+            edits = {"collection[].tag.tag-": collection_name, "collection.locked": 1}
+        else:
+            edits = {"collection[0].tag.tag": collection_name, "collection.locked": 1}
+        results = []
+        with profiling.stage("plex.collection_edit"):
+            for start in range(0, len(items), batch_size):
+                chunk = items[start : start + batch_size]
+                try:
+                    library.multiEdit(chunk, **edits)
+                    results.extend(MutationResult(item, True, None) for item in chunk)
+                except Exception:
+                    profiling.record_retry(len(chunk))
+                    for item in chunk:
+                        try:
+                            if remove:
+                                item.removeCollection(collection_name)
+                            else:
+                                item.addCollection(collection_name)
+                            results.append(MutationResult(item, True, None))
+                        except Exception as e:
+                            results.append(MutationResult(item, False, str(e)))
+        return results
+
+    def add_items_to_collection(self, library, items, collection_name, batch_size=BATCH_SIZE):
+        # Add many items to a collection (creating it if needed) in as few requests as possible.
+        return self._edit_collection_tags(library, list(items), collection_name, False, batch_size)
+
+    def remove_items_from_collection(
+        self, library, items, collection_name, batch_size=BATCH_SIZE
+    ):
+        return self._edit_collection_tags(library, list(items), collection_name, True, batch_size)
+
+    def _section_id(self, media):
+        return media.librarySectionID
 
     def add_to_collection(self, items, collection_name):
-        for title, media in items:
-            media.addCollection(collection_name)
-            media.reload()
-            print(f"{emojis.CHECK} Added '{title}' to collection: {collection_name}")
+        # items are (title, media) pairs, as returned by find_movies()
+        titles = {id(media): title for title, media in items}
+        by_section = {}
+        for _, media in items:
+            by_section.setdefault(self._section_id(media), []).append(media)
+        for section_id, medias in by_section.items():
+            library = self.plex.library.sectionByID(section_id)
+            for result in self.add_items_to_collection(library, medias, collection_name):
+                title = titles[id(result.item)]
+                if result.ok:
+                    print(f"{emojis.CHECK} Added '{title}' to collection: {collection_name}")
+                else:
+                    print(f"{emojis.CROSS} Could not add '{title}': {result.error}")
@@ -0,0 +1,207 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# The profiler for this process, or None when profiling is off. Call sites use the
+# module-level helpers below, which cost one attribute check when it's disabled.
+_active = None
+
+
+class StageStats:
+    __slots__ = ("calls", "seconds", "requests", "bytes", "retries", "errors")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.requests = 0
+        self.bytes = 0
+        self.retries = 0
+        self.errors = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Profiler:
+    # Per-stage wall time, HTTP request counts, bytes received and retries.
+    # Stages nest per thread; time is inclusive, and each request or retry is
+    # charged to the innermost stage open on the thread that made it.
+    # Every stage and request is also kept as a Chrome trace event.
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stats = {}
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current_stage(self):
+        stack = self._stack()
+        return stack[-1] if stack else "unattributed"
+
+    def _stat(self, name):
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = StageStats()
+        return stat
+
+    def _event(self, name, category, start, end, args=None):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((start - self.started) * 1e6, 1),
+            "dur": round((end - start) * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    @contextmanager
+    def stage(self, name):
+        stack = self._stack()
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            with self._lock:
+                stat = self._stat(name)
+                stat.calls += 1
+                stat.seconds += end - start
+                self._event(name, "stage", start, end)
+
+    def record_request(self, service, method, url, status, size, elapsed, stage=None):
+        stage = stage or self.current_stage()
+        end = time.perf_counter()
+        with self._lock:
+            stat = self._stat(stage)
+            stat.requests += 1
+            stat.bytes += size
+            if status >= 400:
+                stat.errors += 1
+            self._event(
+                f"{method} {service}",
+                "http",
+                end - elapsed,
+                end,
+                {"url": url, "status": status, "bytes": size, "stage": stage},
+            )
+
+    def record_retry(self, count=1, stage=None):
+        stage = stage or self.current_stage()
+        with self._lock:
+            self._stat(stage).retries += count
+
+    def report(self):
+        # Breakdown table, slowest stage first
+        total = time.perf_counter() - self.started
+        rows = sorted(self.stats.items(), key=lambda item: item[1].seconds, reverse=True)
+        lines = [
+            f"{'stage':<28}{'calls':>7}{'time (s)':>11}{'requests':>10}{'KiB':>10}{'retries':>9}{'errors':>8}",
+            "━" * 83,
+        ]
+        for name, stat in rows:
+            lines.append(
+                f"{name:<28}{stat.calls:>7}{stat.seconds:>11.3f}{stat.requests:>10}"
+                f"{stat.bytes / 1024:>10.1f}{stat.retries:>9}{stat.errors:>8}"
+            )
+        lines.append("━" * 83)
+        lines.append(
+            f"{'total':<28}{'':>7}{total:>11.3f}"
+            f"{sum(s.requests for s in self.stats.values()):>10}"
+            f"{sum(s.bytes for s in self.stats.values()) / 1024:>10.1f}"
+            f"{sum(s.retries for s in self.stats.values()):>9}"
+            f"{sum(s.errors for s in self.stats.values()):>8}"
+        )
+        return "\n".join(lines)
+
+    def write_trace(self, path):
+        # Chrome trace format (chrome://tracing, Perfetto) with the stage totals alongside
+        with self._lock:
+            data = {
+                "traceEvents": list(self.events),
+                "displayTimeUnit": "ms",
+                "stages": {name: stat.as_dict() for name, stat in self.stats.items()},
+            }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+
+def enable():
+    global _active
+    _active = Profiler()
+    return _active
+
+
+def disable():
+    global _active
+    profiler, _active = _active, None
+    return profiler
+
+
+@contextmanager
+def stage(name):
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
+
+
+def current_stage():
+    # Innermost stage on this thread, for work handed to another thread or event loop
+    return _active.current_stage() if _active is not None else None
+
+
+def record_request(service, method, url, status, size, elapsed, stage=None):
+    # For clients that don't go through an instrumented requests.Session
+    if _active is not None:
+        _active.record_request(service, method, url, status, size, elapsed, stage)
+
+
+def record_retry(count=1, stage=None):
+    if _active is not None:
+        _active.record_retry(count, stage)
+
+
+def instrument_session(session, service):
+    # Count every response a requests.Session receives against the current stage.
+    # The hook checks for a profiler per response, so sessions can be instrumented
+    # before profiling is switched on.
+    def on_response(resp, *args, **kwargs):
+        profiler = _active
+        if profiler is not None:
+            # urllib3 retries (clients.make_session) happen below this hook
+            retries = getattr(getattr(resp.raw, "retries", None), "history", None)
+            if retries:
+                profiler.record_retry(len(retries))
+            # Sized from Content-Length: reading resp.content here would consume
+            # the body of a stream=True response before its caller sees it.
+            # Responses without one (chunked) count as 0 bytes.
+            length = resp.headers.get("Content-Length", "")
+            profiler.record_request(
+                service,
+                resp.request.method,
+                resp.url.split("?", 1)[0],
+                resp.status_code,
+                int(length) if length.isdigit() else 0,
+                resp.elapsed.total_seconds(),
+            )
+        return resp
+
+    session.hooks["response"].append(on_response)
+    return session
@@ -0,0 +1,218 @@
+import random
+import threading
+import time
+from collections import namedtuple
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+
+class TokenBucket:
+    # Thread-safe token bucket: `rate` tokens are added per second, up to `capacity`.
+    # acquire() blocks until a token is available, so any number of worker threads
+    # sharing one bucket stay under the same request budget.
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+
+
+# A host's ceiling: requests in flight at once and requests per second.
+# HostLimiter starts at the ceiling and adapts below it.
+HostBudget = namedtuple("HostBudget", "concurrency rate")
+DEFAULT_BUDGET = HostBudget(concurrency=8, rate=100.0)
+# TMDb allows ~50 requests/s and 20 connections per IP; stay under both
+HOST_BUDGETS = {"api.themoviedb.org": HostBudget(concurrency=16, rate=40.0)}
+
+# Floors the limits never drop below
+MIN_CONCURRENCY = 1
+MIN_RATE = 1.0
+# Multiplicative decrease on throttling/errors, and on latency building up,
+# applied at most once per DECREASE_INTERVAL seconds
+ERROR_BACKOFF = 0.5
+LATENCY_BACKOFF = 0.8
+DECREASE_INTERVAL = 1.0
+# Share of the ceiling rate won back per successful response
+RATE_RECOVERY = 0.02
+# Latency is "building up" above LATENCY_TOLERANCE x the host's unloaded latency
+# (plus LATENCY_SLACK seconds, so sub-millisecond LAN noise doesn't count)
+LATENCY_WEIGHT = 0.2
+LATENCY_TOLERANCE = 2.0
+LATENCY_SLACK = 0.05
+BASELINE_DRIFT = 0.01
+# Retry backoff: full jitter over BACKOFF_BASE * 2^attempt, capped
+BACKOFF_BASE = 0.5
+MAX_BACKOFF = 30.0
+MAX_RETRY_AFTER = 120.0
+
+
+def parse_retry_after(value):
+    # Seconds from a Retry-After header (delta-seconds or HTTP date), or None
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(when.timestamp() - time.time(), 0.0)
+
+
+class HostLimiter:
+    # Adaptive request budget for one host, shared by every thread talking to it.
+    # acquire() waits for a free concurrency slot, a rate token and the end of any
+    # Retry-After pause; release() feeds back how the request went:
+    #   - 429, 5xx or no answer: halve concurrency and rate (AIMD decrease)
+    #   - latency well above the host's unloaded latency: shrink concurrency
+    #   - otherwise: add ~1 slot per window of successes and recover the rate
+    # so each host settles at the most it serves without throttling or queueing.
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.limit = float(budget.concurrency)
+        self.bucket = TokenBucket(budget.rate)
+        self._in_flight = 0
+        self._resume_at = 0.0  # monotonic time no request starts before (Retry-After)
+        self._latency = None  # moving average of response times
+        self._baseline = None  # lowest average seen: the host's unloaded latency
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self._resume_at - time.monotonic()
+                if wait <= 0 and self._in_flight < int(self.limit):
+                    self._in_flight += 1
+                    break
+                self._cond.wait(wait if wait > 0 else None)
+        try:
+            self.bucket.acquire()
+        except BaseException:
+            self.abandon()
+            raise
+
+    def release(self, latency, status=None):
+        # status None: the request got no answer (connection error, timeout)
+        now = time.monotonic()
+        with self._cond:
+            self._in_flight -= 1
+            if status is None or status == 429 or status >= 500:
+                self._decrease(now, ERROR_BACKOFF, rate=True)
+            else:
+                if self._latency is None:
+                    self._latency = self._baseline = latency
+                else:
+                    self._latency += LATENCY_WEIGHT * (latency - self._latency)
+                    self._baseline = min(
+                        self._latency,
+                        self._baseline + BASELINE_DRIFT * (self._latency - self._baseline),
+                    )
+                # Only concurrent requests can queue up behind each other
+                slow = self._latency > LATENCY_TOLERANCE * self._baseline + LATENCY_SLACK
+                if slow and self._in_flight:
+                    self._decrease(now, LATENCY_BACKOFF)
+                else:
+                    self._increase()
+            self._cond.notify_all()
+
+    def abandon(self):
+        # Give back a slot whose request never reached the host (invalid URL,
+        # cancelled or interrupted), without counting it for or against the host
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _decrease(self, now, factor, rate=False):
+        if now - self._last_decrease < DECREASE_INTERVAL:
+            return
+        self._last_decrease = now
+        self.limit = max(MIN_CONCURRENCY, self.limit * factor)
+        if rate:
+            self.bucket.set_rate(max(MIN_RATE, self.bucket.rate * factor))
+
+    def _increase(self):
+        self.limit = min(self.budget.concurrency, self.limit + 1.0 / self.limit)
+        if self.bucket.rate < self.budget.rate:
+            self.bucket.set_rate(
+                min(self.budget.rate, self.bucket.rate + self.budget.rate * RATE_RECOVERY)
+            )
+
+    def retry_delay(self, attempt, retry_after=None):
+        # Seconds to wait before retry number `attempt` (0-based). A Retry-After
+        # answer pauses every request to the host, not only the one retrying.
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            return random.uniform(0, min(MAX_BACKOFF, BACKOFF_BASE * 2**attempt))
+        delay = min(delay, MAX_RETRY_AFTER)
+        with self._cond:
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+        # Spread the retries out so they don't all land at the same instant
+        return delay + random.uniform(0, BACKOFF_BASE)
+
+    def state(self):
+        with self._cond:
+            return {
+                "concurrency": round(self.limit, 2),
+                "rate": round(self.bucket.rate, 2),
+                "latency": round(self._latency, 4) if self._latency is not None else None,
+            }
+
+
+class RateController:
+    # One HostLimiter per host (host:port), created on first use, so every client
+    # in the process (TMDb, each Plex server, sync or async) shares the budget of
+    # the host it talks to.
+
+    def __init__(self, budgets=None, default=DEFAULT_BUDGET):
+        self.budgets = HOST_BUDGETS if budgets is None else budgets
+        self.default = default
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def limiter(self, url):
+        parts = urlsplit(url)
+        host = parts.netloc.lower()
+        with self._lock:
+            if host not in self._hosts:
+                budget = self.budgets.get(parts.hostname or "", self.default)
+                self._hosts[host] = HostLimiter(budget)
+            return self._hosts[host]
+
+    def state(self):
+        # {host: current limits}, e.g. for a profile report
+        with self._lock:
+            hosts = dict(self._hosts)
+        return {host: limiter.state() for host, limiter in sorted(hosts.items())}
+
+
+_controller = RateController()
+
+
+def controller():
+    # The process-wide RateController used by clients.make_session and the async backend
+    return _controller
@@ -1,9 +1,15 @@
+import os
+from functools import lru_cache
 
+LOGO_FILE = os.path.join(os.path.dirname(__file__), "plex_ascii.txt")
 
 
-import os
+@lru_cache(maxsize=None)
+def _plex_logo():
+    # Read once; welcome() redraws the banner on every menu pass
+    with open(LOGO_FILE, "r", encoding="utf-8") as f:
+        return f.read()
+
 
 def print_plex_logo_ascii():
-    file_path = os.path.join(os.path.dirname(__file__), "plex_ascii.txt")
-    with open(file_path, "r", encoding="utf-8") as f:
-        print(f.read())
\ No newline at end of file
+    print(_plex_logo())
@@ -0,0 +1,14 @@
+import batch_build
+from clients import Clients
+
+
+def test_failed_connect_still_closes_clients(tmp_path, monkeypatch):
+    closed = []
+    close = Clients.close
+    monkeypatch.setattr(Clients, "close", lambda self: closed.append(close(self)))
+    spec = {"collections": [{"name": "Villeneuve", "company": 1}]}
+    summary = batch_build.run_batch(
+        spec, {}, str(tmp_path / "snapshot.sqlite"), str(tmp_path / "tmdb.sqlite")
+    )
+    assert summary["error"] == "Missing or invalid Plex Token or URL."
+    assert len(closed) == 1
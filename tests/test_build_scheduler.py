@@ -0,0 +1,65 @@
+import threading
+
+from build_scheduler import BuildScheduler, Target
+
+
+class FakeBuilder:
+    id_index = None
+
+    def __init__(self, resolve_gate=None):
+        self.resolve_gate = resolve_gate
+        self.applied = []
+
+    def fetch_sources(self, definition):
+        return list(definition["titles"])
+
+    def completed(self, definition, library_name):
+        return None
+
+    def resolve(self, definition, sources, library_name):
+        if self.resolve_gate is not None:
+            assert self.resolve_gate.wait(5), "the slow server held up the other server"
+        return library_name, sources, []
+
+    def apply(self, definition, library, found, not_found, prune=True):
+        self.applied.append(definition["name"])
+        return {"name": definition["name"], "matched": len(found), "failed": []}
+
+
+def test_slow_server_does_not_hold_up_other_servers():
+    gate = threading.Event()
+    slow, fast = FakeBuilder(gate), FakeBuilder()
+    builders = {"slow": slow, None: fast}
+    definitions = [
+        {"name": f"Slow {i}", "titles": [f"s{i}"], "targets": [{"server": "slow"}]}
+        for i in range(4)
+    ] + [{"name": f"Fast {i}", "titles": [f"f{i}"]} for i in range(4)]
+
+    original_apply = fast.apply
+
+    def apply(*args, **kwargs):
+        result = original_apply(*args, **kwargs)
+        if len(fast.applied) == 4:
+            gate.set()  # the slow server only answers once the fast one is done
+        return result
+
+    fast.apply = apply
+    scheduler = BuildScheduler(fast, fetch_workers=2, write_workers=2, builder_for=builders.get)
+    results = scheduler.run(definitions)
+    assert [r["status"] for r in results] == ["ok"] * 8
+    assert len(slow.applied) == 4
+
+
+def test_sources_are_fetched_once_for_every_target():
+    calls = []
+    builder = FakeBuilder()
+    fetch = builder.fetch_sources
+    builder.fetch_sources = lambda definition: calls.append(definition["name"]) or fetch(definition)
+    definitions = [
+        {"name": "One", "titles": ["a"], "targets": ["Movies", "Kids"]},
+        {"name": "Two", "titles": ["b"]},
+    ]
+    results = BuildScheduler(builder).run(definitions, targets=[Target(None, "Movies")])
+    assert sorted(calls) == ["One", "Two"]
+    assert [t["library"] for t in results[0]["targets"]] == ["Movies", "Kids"]
+    assert results[1]["matched"] == 1
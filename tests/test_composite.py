@@ -0,0 +1,145 @@
+import json
+import threading
+
+import pytest
+
+from collection_builder import CollectionBuilder, composite_leaves, evaluate_composite, source_key
+from tmdb_search import TMDbMovie
+
+
+HORROR = {2, 5, 7}
+
+
+def movie(movie_id, year, title=None):
+    genres = (27,) if movie_id in HORROR else (18,)
+    return TMDbMovie(movie_id, title or f"Movie {movie_id}", None, year, genres)
+
+
+# company/keyword/genre id -> movies
+DISCOVER = {
+    ("company", 41077): [movie(1, 2014), movie(2, 2017), movie(3, 2019), movie(4, 2021)],
+    ("company", 90733): [movie(3, 2019), movie(5, 2020), movie(6, 2012)],
+    ("genre", 27): [movie(2, 2017), movie(5, 2020), movie(7, 2022)],
+    ("keyword", 9715): [movie(4, 2021), movie(5, 2020)],
+}
+
+
+class FakeTMDb:
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def iter_discover_movies(self, company_id=None, keyword_id=None, genre_id=None):
+        query = [("company", company_id), ("keyword", keyword_id), ("genre", genre_id)]
+        kind, value = next((kind, value) for kind, value in query if value is not None)
+        with self._lock:
+            self.calls.append((kind, value))
+        return iter(DISCOVER[(kind, value)])
+
+
+def fetched(leaf):
+    kind = next(key for key in ("company", "keyword", "genre") if key in leaf)
+    return DISCOVER[(kind, leaf[kind])]
+
+
+def ids(node):
+    return [key[1] for key in evaluate_composite(node, fetched)]
+
+
+def test_union_intersection_and_difference():
+    a24, neon, horror = {"company": 41077}, {"company": 90733}, {"genre": 27}
+    assert ids({"any": [a24, neon]}) == [1, 2, 3, 4, 5, 6]
+    assert ids({"all": [a24, neon]}) == [3]
+    assert ids({"any": [a24, neon], "exclude": horror}) == [1, 3, 4, 6]
+    # "A24 or Neon, minus horror, after 2015"
+    assert ids({"any": [a24, neon], "exclude": [horror], "after": 2015}) == [3, 4]
+    assert ids({"company": 41077, "before": 2019}) == [1, 2]
+
+
+def test_nested_composites():
+    node = {
+        "all": [
+            {"any": [{"company": 41077}, {"company": 90733}]},
+            {"any": [{"genre": 27}, {"keyword": 9715}]},
+        ]
+    }
+    assert ids(node) == [2, 4, 5]
+
+
+def test_titles_compare_by_normalized_title_and_year():
+    def titles(leaf):
+        return leaf["titles"]
+
+    node = {"any": [{"titles": ["Heat (1995)", "Alien"]}], "exclude": {"titles": ["heat (1995)"]}}
+    assert list(evaluate_composite(node, titles).values()) == ["Alien"]
+
+
+def test_invalid_composites():
+    with pytest.raises(ValueError):
+        composite_leaves({"any": [{"company": 1}], "all": [{"company": 2}]})
+    with pytest.raises(ValueError):
+        composite_leaves({"any": []})
+
+
+def test_leaves_are_fetched_once_per_builder():
+    tmdb = FakeTMDb()
+    builder = CollectionBuilder(None, None, tmdb)
+    first = {"name": "One", "any": [{"company": 41077}, {"company": 90733}], "exclude": {"keyword": 9715}}
+    second = {"name": "Two", "all": [{"company": 41077}, {"keyword": 9715}]}
+    assert [m.id for m in builder.fetch_sources(first)] == [1, 2, 3, 6]
+    assert [m.id for m in builder.fetch_sources(second)] == [4]
+    assert sorted(tmdb.calls) == [("company", 41077), ("company", 90733), ("keyword", 9715)]
+
+
+def test_genre_filters_are_not_fetched():
+    tmdb = FakeTMDb()
+    builder = CollectionBuilder(None, None, tmdb)
+    excluded = {"name": "One", "any": [{"company": 41077}, {"company": 90733}], "exclude": {"genre": 27}}
+    kept = {"name": "Two", "all": [{"company": 41077}, {"genre": [27, 35]}]}
+    assert [m.id for m in builder.fetch_sources(excluded)] == [1, 3, 4, 6]
+    assert [m.id for m in builder.fetch_sources(kept)] == [2]
+    assert sorted(tmdb.calls) == [("company", 41077), ("company", 90733)]
+    # On its own a genre is still a source
+    assert [m.id for m in builder.fetch_sources({"name": "Three", "all": [{"genre": 27}]})] == [2, 5, 7]
+
+
+def test_exclude_genre_costs_only_the_included_pages(http_server):
+    from clients import make_session
+    from rate_limit import RateController
+    from tmdb_search import TMDbSearch
+
+    requests_seen = []
+
+    def handler(method, path):
+        from urllib.parse import parse_qs, urlparse
+
+        query = {k: v[0] for k, v in parse_qs(urlparse(path).query).items()}
+        requests_seen.append(query)
+        if "with_genres" in query:  # the whole genre: far more pages than anything else
+            body = {"page": 1, "total_pages": 500, "results": []}
+        else:
+            page = int(query.get("page", 1))
+            company = int(query["with_companies"])
+            results = [
+                {"id": company * 10 + n, "title": f"T{n}", "release_date": "2020-01-01",
+                 "genre_ids": [27] if n % 2 else [18]}
+                for n in range(page * 4, page * 4 + 4)
+            ]
+            body = {"page": page, "total_pages": 2, "results": results}
+        return 200, {"Content-Type": "application/json"}, json.dumps(body).encode()
+
+    url = http_server(handler)
+    session = make_session("tmdb", rate_controller=RateController())
+    tmdb = TMDbSearch("key", base_url=url, session=session)
+    builder = CollectionBuilder(None, None, tmdb)
+    definition = {"name": "Picks", "any": [{"company": 1}, {"company": 2}], "exclude": {"genre": 27}}
+    movies = builder.fetch_sources(definition)
+    assert len(requests_seen) == 4  # two pages per company, nothing for the genre
+    assert not any("with_genres" in query for query in requests_seen)
+    assert len(movies) == 8 and all(27 not in m.genre_ids for m in movies)
+
+
+def test_composite_source_key_ignores_the_name():
+    one = {"name": "One", "any": [{"company": 1}, {"company": 2}]}
+    two = {"name": "Two", "any": [{"company": 1}, {"company": 2}]}
+    assert source_key(one) == source_key(two)
@@ -0,0 +1,163 @@
+import json
+
+import pytest
+
+from build_scheduler import Target
+from daemon import CollectionRouter, WebhookDaemon, parse_webhook
+from library_index import LibraryItem
+from plex_manager import MutationResult
+from tmdb_search import MovieFacts
+
+MOVIES = Target(None, "Movies")
+SPEC = {
+    "collections": [
+        {"name": "Marvel", "company": [420, 7505]},
+        {"name": "A24 Horror", "company": 41077, "genre": 27},
+        {"name": "Dark Knight", "collection": 263},
+        {"name": "Favourites", "titles": ["Heat (1995)", "Alien"]},
+        {"name": "Kids only", "collection": 263, "library": "Kids"},
+        {"name": "Mixed", "any": [{"company": 1}, {"keyword": 2}]},
+    ]
+}
+
+
+def facts(collection=None, companies=(), keywords=(), genres=()):
+    return MovieFacts(1, collection, frozenset(companies), frozenset(keywords), frozenset(genres))
+
+
+@pytest.fixture
+def router():
+    router, errors = CollectionRouter.from_spec(SPEC, tmdb=object())
+    assert list(errors) == ["Mixed"]
+    return router
+
+
+def test_routes_by_tmdb_ids(router):
+    assert router.match(MOVIES, "Iron Man", 2008, facts(companies=[7505])) == ["Marvel"]
+    assert router.match(MOVIES, "Batman Begins", 2005, facts(collection=263)) == ["Dark Knight"]
+    assert router.match(MOVIES, "Nothing", 2020, facts(companies=[99])) == []
+
+
+def test_every_requirement_must_hold(router):
+    assert router.match(MOVIES, "Hereditary", 2018, facts(companies=[41077])) == []
+    assert router.match(MOVIES, "Hereditary", 2018, facts(companies=[41077], genres=[27])) == [
+        "A24 Horror"
+    ]
+
+
+def test_routes_by_title_and_year(router):
+    assert router.match(MOVIES, "Heat", 1995) == ["Favourites"]
+    assert router.match(MOVIES, "Heat", 1986) == []
+    assert router.match(MOVIES, "alien", 1979) == ["Favourites"]
+
+
+def test_only_routes_to_the_collection_targets(router):
+    kids = Target(None, "Kids")
+    assert router.match(kids, "Batman Begins", 2005, facts(collection=263)) == ["Kids only"]
+
+
+def test_parse_json_webhook():
+    assert parse_webhook("application/json", b'{"event": "library.new"}') == {
+        "event": "library.new"
+    }
+    assert parse_webhook("application/json", b"") == {}
+
+
+def test_parse_multipart_webhook():
+    payload = {"event": "library.new", "Metadata": {"ratingKey": "5", "type": "movie"}}
+    boundary = "----plexboundary"
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="payload"\r\n'
+        "Content-Type: application/json\r\n\r\n"
+        f"{json.dumps(payload)}\r\n"
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="thumb"; filename="thumb.jpg"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+        "\xff\xd8\xff\r\n"
+        f"--{boundary}--\r\n"
+    ).encode("latin-1")
+    assert parse_webhook(f"multipart/form-data; boundary={boundary}", body) == payload
+
+
+def test_multipart_webhook_without_payload():
+    boundary = "b"
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="other"\r\n\r\nx\r\n--{boundary}--\r\n'
+    ).encode()
+    with pytest.raises(ValueError):
+        parse_webhook(f"multipart/form-data; boundary={boundary}", body)
+
+
+class FakePlex:
+    def __init__(self, items):
+        self.plex = self
+        self.library = self
+        self.machineIdentifier = "machine-1"
+        self.items = items  # ratingKey -> LibraryItem
+        self.fetched = []
+        self.added = []
+
+    def section(self, title):
+        return title
+
+    def fetch_items(self, keys):
+        self.fetched.extend(int(key) for key in keys)
+        return [self.items[int(key)] for key in keys if int(key) in self.items]
+
+    def add_items_to_collection(self, library, items, name):
+        self.added.append((library, name, [item.ratingKey for item in items]))
+        return [MutationResult(item, True, None) for item in items]
+
+
+class FakeClients:
+    tmdb = None
+
+    def __init__(self, plex):
+        self.plex = plex
+
+    def servers(self):
+        return [None]
+
+    def plex_server(self, name=None):
+        return self.plex
+
+
+def new_movie(rating_key, **metadata):
+    metadata = {"ratingKey": str(rating_key), "type": "movie", "librarySectionTitle": "Movies",
+                **metadata}
+    return {"event": "library.new", "Server": {"uuid": "machine-1"}, "Metadata": metadata}
+
+
+@pytest.fixture
+def spec_path(tmp_path):
+    path = tmp_path / "spec.json"
+    path.write_text(json.dumps({"collections": [{"name": "Favourites", "titles": ["Heat (1995)"]}]}))
+    return str(path)
+
+
+def test_payload_metadata_routes_without_fetching(spec_path):
+    heat = LibraryItem(7, "Heat", None, 1995, ("tmdb://949",), 0, 0)
+    plex = FakePlex({7: heat, 8: heat._replace(ratingKey=8, title="Alien", year=1979)})
+    daemon = WebhookDaemon(spec_path, FakeClients(plex))
+    guids = [{"id": "tmdb://348"}]
+    assert daemon.handle_event(new_movie(8, title="Alien", year=1979, Guid=guids)) == []
+    assert plex.fetched == []  # no rule matched: Plex is never asked
+    guids = [{"id": "tmdb://949"}]
+    assert daemon.handle_event(new_movie(7, title="Heat", year=1995, Guid=guids)) == ["Favourites"]
+    assert plex.fetched == [7] and plex.added == [("Movies", "Favourites", [7])]
+
+
+def test_items_without_guids_are_fetched(spec_path):
+    plex = FakePlex({7: LibraryItem(7, "Heat", None, 1995, ("tmdb://949",), 0, 0)})
+    daemon = WebhookDaemon(spec_path, FakeClients(plex))
+    assert daemon.handle_event(new_movie(7, title="Heat")) == ["Favourites"]
+    assert plex.fetched == [7]
+
+
+def test_deleted_items_are_counted_as_missing(spec_path):
+    daemon = WebhookDaemon(spec_path, FakeClients(FakePlex({})))
+    assert daemon.handle_event(new_movie(7)) == []
+    guids = [{"id": "tmdb://949"}]
+    assert daemon.handle_event(new_movie(7, title="Heat", year=1995, Guid=guids)) == []
+    assert daemon.stats["missing"] == 2 and daemon.stats["errors"] == 0
@@ -0,0 +1,101 @@
+import gzip
+import json
+from datetime import date
+
+import pytest
+
+import id_index
+from clients import make_session
+from id_index import TMDbIdIndex
+from rate_limit import RateController
+
+COMPANIES = [
+    (41077, "A24"),
+    (90733, "Neon"),
+    (420, "Marvel Studios"),
+    (7505, "Marvel Entertainment"),
+    (1, "Lucasfilm Ltd."),
+    (2, "Lucasfilm"),
+    (3, "Lucasfilm"),
+]
+
+
+def export(rows):
+    lines = "\n".join(json.dumps({"id": entry_id, "name": name}) for entry_id, name in rows)
+    return gzip.compress(lines.encode())
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = TMDbIdIndex(str(tmp_path / "ids.sqlite"))
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def export_server(http_server, monkeypatch):
+    # Serves `files` (export file name -> gzip bytes); anything else is a 404
+    files = {}
+
+    def handler(method, path):
+        body = files.get(path.rsplit("/", 1)[-1])
+        return (200, {}, body) if body is not None else (404, {}, b"")
+
+    url = http_server(handler)
+    monkeypatch.setattr(id_index, "EXPORT_URL", url + "/{name}_ids_{date:%m_%d_%Y}.json.gz")
+    return files
+
+
+def test_update_with_profiling_imports_the_export(index, export_server, profiler):
+    export_server["production_company_ids_05_01_2024.json.gz"] = export(COMPANIES)
+    session = make_session("tmdb", rate_controller=RateController())
+    result = index.update(session, kinds=["company"], today=date(2024, 5, 1))
+    assert result["company"]["added"] == len(COMPANIES)
+    assert index.counts() == {"company": len(COMPANIES)}
+
+
+def test_truncated_export_is_refused(index):
+    index.import_export("company", COMPANIES, "2024-05-01")
+    with pytest.raises(ValueError, match="truncated"):
+        index.import_export("company", [], "2024-05-02")
+    with pytest.raises(ValueError, match="truncated"):
+        index.import_export("company", COMPANIES[:2], "2024-05-02")
+    assert index.counts() == {"company": len(COMPANIES)}
+    assert index.export_date("company") == "2024-05-01"
+
+
+def test_export_removes_missing_ids(index):
+    index.import_export("company", COMPANIES, "2024-05-01")
+    stats = index.import_export("company", COMPANIES[1:], "2024-05-02")
+    assert stats == {"added": 0, "changed": 0, "removed": 1}
+
+
+def test_resolve_accepts_exact_and_unique_prefix_only(index):
+    index.import_export("company", COMPANIES, "2024-05-01")
+    assert index.resolve("company", "a24") == 41077
+    assert index.resolve("company", "Lucasfilm Ltd") == 1
+    assert index.resolve("company", "Marvel Ent") == 7505
+    assert index.resolve("company", "Zzzzzz") is None
+    with pytest.raises(ValueError, match="ambiguous"):
+        index.resolve("company", "Lucasfilm")
+    with pytest.raises(ValueError, match="Marvel Studios"):
+        index.resolve("company", "Marvel")
+    with pytest.raises(ValueError, match="did you mean"):
+        index.resolve("company", "Marvell Studios")
+    # The menu keeps its best guess
+    assert index.find_id("company", "Marvell Studios") == 420
+
+
+@pytest.mark.parametrize("fts", [True, False])
+def test_fuzzy_search_matches_the_stored_form(index, fts):
+    # Without FTS5 the in-memory matcher has to compare the same normalized names,
+    # or " Collection" counts against every collection
+    index.fts = fts
+    rows = [
+        (10, "Star Wars Collection"),
+        (86311, "The Avengers Collection"),
+        (263, "The Dark Knight Collection"),
+    ]
+    index.import_export("collection", rows, "2024-05-01")
+    assert index.search("collection", "Star Warz") == [(10, "Star Wars Collection")]
+    assert index.search("collection", "Avengres Collection")[0] == (86311, "The Avengers Collection")
@@ -0,0 +1,77 @@
+from collections import namedtuple
+
+import pytest
+
+from collection_sync import SyncPlan
+from journal import BuildJournal
+
+SPEC = {"collections": [{"name": "A24", "studio": "A24"}]}
+Item = namedtuple("Item", "ratingKey")
+Result = namedtuple("Result", "item ok")
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "journal.sqlite")
+
+
+def open_run(path, **kwargs):
+    journal = BuildJournal(path)
+    journal.start(SPEC, **kwargs)
+    return journal
+
+
+def test_failed_run_resumes_where_it_stopped(path):
+    journal = open_run(path)
+    journal.begin("s:1", "Done", SyncPlan([1], [], 0, False))
+    journal.complete("s:1", "Done", {"name": "Done", "added": 1})
+    journal.begin("s:1", "Half", SyncPlan([1, 2, 3], [9], 4, True))
+    journal.applied("s:1", "Half", "add", [Result(Item(1), True), Result(Item(2), False)])
+    run_id = journal.run_id
+    journal.close()
+
+    journal = open_run(path)
+    assert (journal.run_id, journal.resumed) == (run_id, True)
+    assert journal.completed("s:1", "Done") == {"name": "Done", "added": 1}
+    plan = journal.begin("s:1", "Half", SyncPlan([1, 2, 3, 4], [], 0, False))
+    assert plan == SyncPlan([2, 3], [9], 4, True)
+    journal.close()
+
+
+def test_finished_run_is_not_resumed(path):
+    journal = open_run(path)
+    journal.begin("s:1", "Done", SyncPlan([1], [], 0, False))
+    journal.finish()
+    journal.close()
+
+    journal = open_run(path)
+    assert not journal.resumed
+    assert journal.completed("s:1", "Done") is None
+    journal.close()
+
+
+def test_old_unfinished_run_is_closed_instead_of_resumed(path):
+    journal = open_run(path)
+    journal.begin("s:1", "Done", SyncPlan([1], [], 0, False))
+    journal.complete("s:1", "Done", {"name": "Done"})
+    old = journal.run_id
+    journal.close()
+
+    journal = open_run(path, resume_window=0)
+    assert journal.run_id != old and not journal.resumed
+    assert journal.completed("s:1", "Done") is None
+    journal.close()
+
+    # The closed run stays closed
+    journal = open_run(path)
+    assert journal.run_id != old and journal.resumed
+    journal.close()
+
+
+def test_fresh_starts_over(path):
+    journal = open_run(path)
+    old = journal.run_id
+    journal.close()
+    journal = open_run(path, fresh=True)
+    assert journal.run_id != old and not journal.resumed
+    journal.close()
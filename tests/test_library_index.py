@@ -0,0 +1,157 @@
+from library_index import LibraryIndex, LibraryItem
+
+
+def item(key, title, year=None, tmdb=None, original=None):
+    guids = (f"tmdb://{tmdb}",) if tmdb else ()
+    return LibraryItem(key, title, original, year, guids, 0, 0)
+
+
+def test_title_fallback_skips_items_with_another_tmdb_id():
+    index = LibraryIndex.from_items([item(1, "Dune", 1984, tmdb=841)])
+    assert index.match("Dune", 2021, tmdb_id=438631) is None
+    assert index.match("Dune", 1984, tmdb_id=841).ratingKey == 1
+
+
+def test_title_fallback_accepts_items_without_a_tmdb_id():
+    index = LibraryIndex.from_items([item(1, "Dune", 2021)])
+    assert index.match("Dune", 2021, tmdb_id=438631).ratingKey == 1
+
+
+def test_single_title_hit_must_agree_on_the_year():
+    index = LibraryIndex.from_items([item(1, "Dune", 1984), item(2, "Heat", None)])
+    assert index.find("Dune", 2021) is None
+    assert index.find("Dune", 1985).ratingKey == 1  # within a year
+    assert index.find("Dune").ratingKey == 1
+    assert index.find("Heat", 1995).ratingKey == 2  # unknown year matches any
+
+
+def test_shared_title_picks_the_year():
+    index = LibraryIndex.from_items(
+        [item(1, "Dune", 1984, tmdb=841), item(2, "Dune", 2021, tmdb=438631)]
+    )
+    assert index.find("Dune", 2021).ratingKey == 2
+    assert [r.ratingKey for r in index.candidates("Dune")] == [1, 2]
+    assert [r.ratingKey for r in index.candidates("Dune", 2021)] == [2]
+    assert [r.ratingKey for r in index.candidates("Dune", None, 841)] == [1]
+
+
+def test_original_title_fallback():
+    index = LibraryIndex.from_items([item(1, "Spirited Away", 2001, original="Sen to Chihiro")])
+    assert index.match("Sen to Chihiro no Kamikakushi", 2001, original_title="Spirited Away").ratingKey == 1
+
+
+def test_fuzzy_matches_only_when_asked():
+    index = LibraryIndex.from_items([item(1, "Spider-Man: Into the Spider-Verse", 2018)])
+    assert index.match("Spiderman Into the Spiderverse", 2018) is None
+    assert index.match("Spiderman Into the Spiderverse", 2018, fuzzy=True).ratingKey == 1
+
+
+def test_fuzzy_skips_other_tmdb_ids_and_sequels():
+    index = LibraryIndex.from_items(
+        [
+            item(1, "Harry Potter and the Deathly Hallows: Part 2", 2011, tmdb=12445),
+            item(2, "Rocky III", 1982),
+            item(3, "Harry Potter and the Deathly Hallows - Part One", 2010, tmdb=99),
+        ]
+    )
+    assert index.match("Harry Potter and the Deathly Hallows: Part 1", 2010, tmdb_id=12444, fuzzy=True) is None
+    assert index.match("Rocky II", 1979, fuzzy=True) is None
+
+
+def test_columns_round_trip_through_records():
+    items = (
+        item(10 + n, title, year, tmdb, original)
+        for n, (title, year, tmdb, original) in enumerate(
+            [
+                ("Heat", 1995, 949, None),
+                ("Heat", 1986, None, None),
+                ("Spirited Away", 2001, 129, "Sen to Chihiro no Kamikakushi"),
+                ("Untitled", None, None, None),
+            ]
+        )
+    )
+    index = LibraryIndex.from_items(items)  # any iterable, e.g. a cursor
+    assert len(index) == 4
+    assert 12 in index and 99 not in index
+    assert index.get(10) == (10, "Heat", 1995, 949)
+    assert index.get(11) == (11, "Heat", 1986, None)
+    assert index.get(13) == (13, "Untitled", None, None)
+    assert index.get(99) is None
+    assert index.find_by_guid("tmdb://129").ratingKey == 12
+    assert index.find_by_guid("imdb://tt0113277") is None
+    assert index.find("Sen to Chihiro no Kamikakushi").ratingKey == 12
+    assert index.by_title["heat"] == [0, 1]
+
+
+def test_from_plex_reads_the_listing_xml():
+    from xml.etree import ElementTree
+
+    class Partial:
+        # A plexapi object that would reload itself on a missing attribute
+        _data = ElementTree.fromstring(
+            '<Video ratingKey="7" title="Alien" year="1979" updatedAt="5">'
+            '<Guid id="imdb://tt0078748"/><Guid id="tmdb://348"/></Video>'
+        )
+
+        def __getattr__(self, name):
+            raise AssertionError(f"reloaded for {name}")
+
+    record = LibraryItem.from_plex(Partial())
+    assert record == LibraryItem(7, "Alien", None, 1979, ("imdb://tt0078748", "tmdb://348"), 5, 0)
+
+
+def test_snapshot_round_trip(tmp_path):
+    from library_cache import LibrarySnapshotCache
+
+    class Section:
+        key, title = 1, "Movies"
+
+    movies = [item(n, f"Movie {n}", 2000 + n, tmdb=100 + n) for n in range(1, 6)]
+    loads = []
+
+    def loader(section, updated_since=None, page_size=None):
+        loads.append(updated_since)
+        return iter(movies if updated_since is None else [])
+
+    cache = LibrarySnapshotCache(str(tmp_path / "snapshot.sqlite"))
+    try:
+        index = cache.load_index("server", Section(), page_size=2, loader=loader)
+        assert [index.get(n).tmdb_id for n in range(1, 6)] == [101, 102, 103, 104, 105]
+        stored = cache.stored_index("server", 1)
+        assert stored.match("Movie 3", 2003, tmdb_id=103).ratingKey == 3
+        cache.load_index("server", Section(), page_size=2, loader=loader, counter=lambda s: 5)
+        assert loads[0] is None and loads[1] is not None  # then incremental only
+    finally:
+        cache.close()
+
+
+def test_snapshot_drops_deleted_items(tmp_path):
+    # Movie 2 is deleted and Movie 6 added between builds: the count is unchanged,
+    # but the stale ratingKey has to leave the snapshot
+    from library_cache import LibrarySnapshotCache
+
+    class Section:
+        key, title = 1, "Movies"
+
+    movies = {n: item(n, f"Movie {n}", 2000 + n, tmdb=100 + n) for n in range(1, 6)}
+
+    def loader(section, updated_since=None, page_size=None):
+        if updated_since is None:
+            return iter(list(movies.values()))
+        since = updated_since.timestamp()
+        return iter([movie for movie in movies.values() if movie.updatedAt > since])
+
+    def counter(section):
+        return len(movies)
+
+    cache = LibrarySnapshotCache(str(tmp_path / "snapshot.sqlite"))
+    try:
+        cache.load_index("server", Section(), page_size=2, loader=loader, counter=counter)
+        del movies[2]
+        movies[6] = item(6, "Movie 6", 2006, tmdb=106)._replace(updatedAt=10**9)
+        index = cache.load_index("server", Section(), page_size=2, loader=loader, counter=counter)
+        assert index.get(2) is None and index.get(6).tmdb_id == 106
+        assert index.find("Movie 2", 2002) is None
+        assert cache.load_index("server", Section(), loader=loader, counter=counter) is index
+    finally:
+        cache.close()
@@ -0,0 +1,146 @@
+import json
+from collections import namedtuple
+
+import pytest
+
+from collection_sync import SyncPlan, plan_sync
+from library_cache import LibrarySnapshotCache
+from library_index import LibraryItem
+from plex_manager import MutationResult
+from planner import PLAN_VERSION, Planner, apply_plan
+from tmdb_search import TMDbMovie
+
+MACHINE_ID = "machine-1"
+LIBRARY = [
+    LibraryItem(1, "Dune", None, 1984, ("tmdb://841",), 0, 0),
+    LibraryItem(2, "Arrival", None, 2016, ("tmdb://329865",), 0, 0),
+    LibraryItem(3, "Sicario", None, 2015, (), 0, 0),
+    LibraryItem(4, "Enemy", None, 2013, (), 0, 0),
+    LibraryItem(5, "Enemy", None, 2013, (), 0, 0),
+    LibraryItem(6, "Prisoners", None, 2013, ("tmdb://146233",), 0, 0),
+]
+VILLENEUVE = [
+    TMDbMovie(438631, "Dune", None, 2021),  # not in the library: must not match Dune (1984)
+    TMDbMovie(329865, "Arrival", None, 2016),
+    TMDbMovie(273481, "Sicario", None, 2015),
+    TMDbMovie(181886, "Enemy", None, 2013),
+]
+
+
+def test_plan_sync():
+    assert plan_sync(None, [1, 2, 2]) == SyncPlan([1, 2], [], 0, False)
+    assert plan_sync([1, 3], [1, 2]) == SyncPlan([2], [3], 1, True)
+    assert plan_sync([1, 3], [1, 2], prune=False) == SyncPlan([2], [], 1, True)
+
+
+class FakeTMDb:
+    def iter_discover_movies(self, company_id=None, keyword_id=None, genre_id=None):
+        return iter(VILLENEUVE)
+
+
+class Section:
+    key, title, totalSize = 1, "Movies", len(LIBRARY)
+
+
+@pytest.fixture
+def library_cache(tmp_path):
+    cache = LibrarySnapshotCache(str(tmp_path / "snapshot.sqlite"))
+    cache.load_index(MACHINE_ID, Section(), loader=lambda section, **kwargs: iter(LIBRARY))
+    cache.remember_server(None, MACHINE_ID)
+    yield cache
+    cache.close()
+
+
+SPEC = {
+    "collections": [
+        {"name": "Villeneuve", "company": 1},
+        {"name": "New", "titles": ["Prisoners (2013)", "Incendies"]},
+        {"name": "Elsewhere", "titles": ["Heat"], "library": "Kids"},
+    ]
+}
+
+
+def test_plan(library_cache):
+    library_cache.save_collection(MACHINE_ID, 1, "Villeneuve", [2, 6])
+    plan = Planner(library_cache, FakeTMDb()).run(SPEC)
+    assert plan["version"] == PLAN_VERSION
+    assert (plan["ok"], plan["errors"]) == (2, 1)
+    villeneuve, new, elsewhere = plan["collections"]
+
+    assert [add["ratingKey"] for add in villeneuve["adds"]] == [3, 4]
+    assert villeneuve["removes"] == [{"ratingKey": 6, "title": "Prisoners"}]
+    assert (villeneuve["exists"], villeneuve["unchanged"]) == (True, 1)
+    assert villeneuve["unmatched"] == ["Dune (2021)"]
+    assert [a["chosen"] for a in villeneuve["ambiguous"]] == [4]
+    assert [c["ratingKey"] for c in villeneuve["ambiguous"][0]["candidates"]] == [4, 5]
+
+    # Never built: nothing is known about its members, so nothing is removed
+    assert new["exists"] is None and new["removes"] == []
+    assert [add["ratingKey"] for add in new["adds"]] == [6]
+    assert new["unmatched"] == ["Incendies"]
+
+    assert elsewhere["status"] == "error" and "Kids" in elsewhere["error"]
+
+
+Item = namedtuple("Item", "ratingKey title")
+
+
+class FakePlex:
+    def __init__(self, machine_id=MACHINE_ID):
+        self.plex = self
+        self.library = self
+        self.machineIdentifier = machine_id
+        self.edits = []
+
+    def sectionByID(self, key):
+        return key
+
+    def fetch_items(self, keys):
+        return [Item(key, f"Item {key}") for key in keys]
+
+    def add_items_to_collection(self, library, items, name):
+        self.edits.append(("add", library, name, [item.ratingKey for item in items]))
+        return [MutationResult(item, True, None) for item in items]
+
+    def remove_items_from_collection(self, library, items, name):
+        self.edits.append(("remove", library, name, [item.ratingKey for item in items]))
+        return [MutationResult(item, True, None) for item in items]
+
+
+class FakeClients:
+    def __init__(self, plex):
+        self.plex = plex
+
+    def plex_server(self, name=None):
+        return self.plex
+
+
+def test_apply_saved_plan(library_cache, tmp_path):
+    library_cache.save_collection(MACHINE_ID, 1, "Villeneuve", [2, 6])
+    path = tmp_path / "plan.json"
+    path.write_text(json.dumps(Planner(library_cache, FakeTMDb()).run(SPEC)))
+
+    plex = FakePlex()
+    summary = apply_plan(json.loads(path.read_text()), FakeClients(plex), library_cache)
+    assert (summary["ok"], summary["errors"]) == (2, 0)
+    assert plex.edits == [
+        ("add", 1, "Villeneuve", [3, 4]),
+        ("remove", 1, "Villeneuve", [6]),
+        ("add", 1, "New", [6]),
+    ]
+    # Recorded members follow, so planning again finds nothing to do
+    assert library_cache.collection(MACHINE_ID, 1, "Villeneuve").rating_keys == [2, 3, 4]
+    again = Planner(library_cache, FakeTMDb()).run(SPEC)["collections"][0]
+    assert again["adds"] == [] and again["removes"] == []
+
+
+def test_plan_for_another_server_is_refused(library_cache):
+    plan = Planner(library_cache, FakeTMDb()).run(SPEC)
+    summary = apply_plan(plan, FakeClients(FakePlex("machine-2")), library_cache)
+    assert summary["ok"] == 0 and summary["errors"] == 2
+    assert "different Plex server" in summary["collections"][0]["error"]
+
+
+def test_unknown_plan_version(library_cache):
+    with pytest.raises(ValueError):
+        apply_plan({"version": 0, "collections": []}, FakeClients(FakePlex()), library_cache)
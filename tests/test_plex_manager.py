@@ -0,0 +1,11 @@
+from library_index import LibraryIndex
+from plex_manager import PlexManager
+
+
+def test_find_movies_keeps_an_empty_index():
+    plex = PlexManager.__new__(PlexManager)
+    built = []
+    plex.build_index = lambda library: built.append(library) or LibraryIndex()
+    plex.fetch_items = lambda keys: []
+    assert plex.find_movies("section", ["Heat"], index=LibraryIndex()) == []
+    assert built == []
@@ -0,0 +1,12 @@
+from clients import make_session
+from rate_limit import RateController
+
+
+def test_streamed_body_is_left_for_the_caller(http_server, profiler):
+    url = http_server(lambda method, path: (200, {}, b"x" * 5000))
+    session = make_session("test", rate_controller=RateController())
+    resp = session.get(url + "/file", stream=True)
+    assert resp.raw.read() == b"x" * 5000
+    assert profiler.stats["unattributed"].requests == 1
+    assert profiler.stats["unattributed"].bytes == 5000
+
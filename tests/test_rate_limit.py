@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from clients import make_session
+from rate_limit import HostBudget, HostLimiter, RateController
+
+
+def session_and_limiter(url):
+    controller = RateController(default=HostBudget(2, 1000))
+    return make_session("test", rate_controller=controller), controller.limiter(url)
+
+
+@pytest.mark.parametrize("error", [requests.exceptions.InvalidURL, KeyboardInterrupt])
+def test_failed_send_gives_its_slot_back(monkeypatch, error):
+    session, limiter = session_and_limiter("http://plex.invalid:32400")
+
+    def fail(*args, **kwargs):
+        raise error()
+
+    monkeypatch.setattr(HTTPAdapter, "send", fail)
+    for _ in range(3):
+        with pytest.raises(error):
+            session.get("http://plex.invalid:32400/library")
+    assert limiter._in_flight == 0
+    assert limiter.limit == 2  # not counted against the host
+
+
+def test_connection_error_counts_against_the_host(monkeypatch):
+    session, limiter = session_and_limiter("http://plex.invalid:32400")
+
+    def fail(*args, **kwargs):
+        raise requests.ConnectionError()
+
+    monkeypatch.setattr(HTTPAdapter, "send", fail)
+    with pytest.raises(requests.ConnectionError):
+        session.get("http://plex.invalid:32400/library")
+    assert limiter._in_flight == 0
+    assert limiter.limit < 2
+
+
+def test_interrupted_rate_wait_gives_its_slot_back(monkeypatch):
+    limiter = HostLimiter(HostBudget(1, 1000))
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(limiter.bucket, "acquire", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        limiter.acquire()
+    assert limiter._in_flight == 0
+
+
+def test_cancelled_async_request_gives_its_slot_back():
+    pytest.importorskip("aiohttp")
+    from benchmarks.fake_servers import FakePlexServer
+    from plex_async import AsyncPlexManager
+
+    with FakePlexServer(10) as server:
+        plex = AsyncPlexManager("token", server.url)
+        try:
+            server.latency = 0.5
+            limiter = plex.rate_controller.limiter(plex.base_url)
+
+            async def cancelled():
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(plex._request("GET", "/library/sections"), 0.05)
+
+            asyncio.run_coroutine_threadsafe(cancelled(), plex.loop).result()
+            assert limiter._in_flight == 0
+        finally:
+            server.latency = 0
+            plex.close()
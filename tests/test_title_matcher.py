@@ -0,0 +1,47 @@
+import pytest
+
+from title_matcher import TitleMatcher, distinct_titles, normalize_title
+
+
+def matcher(*titles):
+    m = TitleMatcher()
+    for key, (title, year) in enumerate(titles, 1):
+        m.add(key, title, year)
+    return m
+
+
+@pytest.mark.parametrize(
+    "query, library",
+    [
+        ("Rocky II", "Rocky III"),
+        ("Toy Story 2", "Toy Story 3"),
+        ("Alien", "Aliens"),
+        (
+            "Harry Potter and the Deathly Hallows: Part 1",
+            "Harry Potter and the Deathly Hallows: Part 2",
+        ),
+        ("The Matrix Reloaded", "The Matrix Revolutions"),
+    ],
+)
+def test_other_films_of_a_series_never_match(query, library):
+    assert matcher((library, None)).best(query) is None
+
+
+def test_near_misses_still_match():
+    m = matcher(("Spider-Man: Into the Spider-Verse", 2018), ("Harry Potter and the Sorcerers Stone", 2001))
+    assert m.best("Spiderman Into the Spiderverse", 2018) == 1
+    assert m.best("Harry Poter and the Sorcerer's Stone", 2001) == 2
+
+
+def test_distinct_titles():
+    assert not distinct_titles(normalize_title("Rocky II"), normalize_title("Rocky 2"))
+    assert distinct_titles(normalize_title("Rocky"), normalize_title("Rocky 2"))
+    assert not distinct_titles(normalize_title("Cars"), normalize_title("Cars"))
+
+
+def test_year_agreement_orders_equal_titles():
+    m = matcher(("Heat", 1995), ("Heat", 1986), ("Heat", None), ("Heat", 1996))
+    assert [key for _, key in m.search("Heat", 1995)] == [1, 4, 3, 2]
+    assert [key for _, key in m.search("Heat", 1995, limit=2)] == [1, 4]
+    assert m.best("Heat", 1986) == 2
+    assert [key for _, key in m.search("Heat")] == [4, 3, 2, 1]
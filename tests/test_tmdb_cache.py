@@ -0,0 +1,139 @@
+import json
+
+import pytest
+import requests
+
+import tmdb_cache
+from tmdb_cache import DAY, CacheMiss, ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(tmdb_cache, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def tmdb(http_server):
+    # Fake TMDb: /movie/<id> answers 304 while the ETag is unchanged, else a body.
+    # `sent` records the headers of every request that reached it.
+    state = {"version": 1, "not_modified": False, "sent": []}
+
+    def handler(method, path):
+        version = state["version"]
+        if state["not_modified"]:
+            return 304, {"ETag": f'"v{version}"'}, b""
+        body = json.dumps({"path": path, "version": version}).encode()
+        headers = {"ETag": f'"v{version}"', "Last-Modified": "Wed, 01 May 2024 00:00:00 GMT"}
+        return 200, headers, body
+
+    url = http_server(handler)
+    session = requests.Session()
+
+    def send_for(path):
+        def send(headers):
+            state["sent"].append(headers)
+            return session.get(url + path, headers=headers, timeout=5)
+
+        return send
+
+    state["send_for"] = send_for
+    yield state
+    session.close()
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "tmdb.sqlite"))
+    yield cache
+    cache.close()
+
+
+def test_fresh_entries_are_served_without_a_request(cache, tmdb, clock):
+    send = tmdb["send_for"]("/movie/1")
+    assert cache.get_json("/movie/1", {"api_key": "secret"}, send)["version"] == 1
+    clock.now += cache.ttl_for("/movie/1") - 1
+    assert cache.get_json("/movie/1", {"api_key": "other"}, send)["version"] == 1
+    assert tmdb["sent"] == [{}]
+
+
+def test_expired_entries_are_revalidated(cache, tmdb, clock):
+    send = tmdb["send_for"]("/movie/1")
+    cache.get_json("/movie/1", {}, send)
+    clock.now += 3 * DAY
+    tmdb["version"] = 2
+    assert cache.get_json("/movie/1", {}, send)["version"] == 2
+    assert tmdb["sent"][1] == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Wed, 01 May 2024 00:00:00 GMT",
+    }
+    # The new ETag is the one sent next time
+    clock.now += 3 * DAY
+    cache.get_json("/movie/1", {}, send)
+    assert tmdb["sent"][2]["If-None-Match"] == '"v2"'
+
+
+def test_not_modified_keeps_the_body_and_restarts_the_ttl(cache, tmdb, clock):
+    send = tmdb["send_for"]("/movie/1")
+    cache.get_json("/movie/1", {}, send)
+    clock.now += 3 * DAY
+    tmdb["not_modified"] = True
+    assert cache.get_json("/movie/1", {}, send) == {"path": "/movie/1", "version": 1}
+    assert len(tmdb["sent"]) == 2
+    clock.now += 3 * DAY - 1  # fresh again for a whole TTL after the 304
+    assert cache.get_json("/movie/1", {}, send)["version"] == 1
+    assert len(tmdb["sent"]) == 2
+
+
+def test_stale_entries_are_served_when_the_network_is_down(cache, tmdb, clock):
+    cache.get_json("/movie/1", {}, tmdb["send_for"]("/movie/1"))
+    clock.now += 3 * DAY
+
+    def down(headers):
+        raise requests.ConnectionError("unreachable")
+
+    assert cache.get_json("/movie/1", {}, down)["version"] == 1
+    with pytest.raises(requests.ConnectionError):
+        cache.get_json("/movie/2", {}, down)
+
+
+def test_offline_serves_expired_entries_and_raises_on_misses(tmp_path, tmdb, clock):
+    path = str(tmp_path / "tmdb.sqlite")
+    online = ResponseCache(path)
+    online.get_json("/movie/1", {}, tmdb["send_for"]("/movie/1"))
+    online.close()
+
+    offline = ResponseCache(path, offline=True)
+    try:
+        clock.now += 30 * DAY
+        assert offline.get_json("/movie/1", {}, tmdb["send_for"]("/movie/1"))["version"] == 1
+        with pytest.raises(CacheMiss):
+            offline.get_json("/movie/2", {}, tmdb["send_for"]("/movie/2"))
+        assert len(tmdb["sent"]) == 1
+    finally:
+        offline.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, tmdb, clock):
+    # Room for two bodies: reading /movie/1 again makes /movie/2 the one to go
+    size = len(json.dumps({"path": "/movie/1", "version": 1}))
+    cache = ResponseCache(str(tmp_path / "tmdb.sqlite"), max_bytes=2 * size)
+    try:
+        for path in ("/movie/1", "/movie/2", "/movie/1", "/movie/3"):
+            clock.now += 1
+            cache.get_json(path, {}, tmdb["send_for"](path))
+        assert len(tmdb["sent"]) == 3
+        assert cache._lookup(cache.make_key("/movie/2", {})) is None
+        assert cache._lookup(cache.make_key("/movie/1", {})) is not None
+        assert cache._lookup(cache.make_key("/movie/3", {})) is not None
+    finally:
+        cache.close()
@@ -0,0 +1,42 @@
+import json
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from clients import make_session
+from rate_limit import RateController
+from tmdb_search import TMDbSearch
+
+
+@pytest.fixture
+def search_server(http_server):
+    # /search/movie with 50 pages of 20 results; records the pages asked for
+    pages = []
+
+    def handler(method, path):
+        query = {k: v[0] for k, v in parse_qs(urlparse(path).query).items()}
+        page = int(query.get("page", 1))
+        pages.append(page)
+        results = [
+            {"id": page * 100 + n, "title": f"Result {page}.{n}", "release_date": "2001-01-01"}
+            for n in range(20)
+        ]
+        body = {"page": page, "total_pages": 50, "results": results}
+        return 200, {"Content-Type": "application/json"}, json.dumps(body).encode()
+
+    url = http_server(handler)
+    session = make_session("tmdb", rate_controller=RateController())
+    return TMDbSearch("key", base_url=url, session=session), pages
+
+
+def test_search_within_the_first_page_sends_one_request(search_server):
+    tmdb, pages = search_server
+    assert len(tmdb.search_movies("alien", limit=10)) == 10
+    assert pages == [1]
+
+
+def test_search_prefetch_stops_at_the_limit(search_server):
+    tmdb, pages = search_server
+    movies = tmdb.search_movies("alien", limit=45)
+    assert len(movies) == 45 and movies[-1].id == 304
+    assert sorted(pages) == [1, 2, 3]
@@ -0,0 +1,244 @@
+import heapq
+import math
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+
+ARTICLES = ("the", "a", "an")
+ROMAN_NUMERALS = {
+    "ii": "2", "iii": "3", "iv": "4", "v": "5", "vi": "6", "vii": "7",
+    "viii": "8", "ix": "9", "x": "10", "xi": "11", "xii": "12",
+}
+NUMBER_WORDS = {
+    "one": "1", "two": "2", "three": "3", "four": "4", "five": "5",
+    "six": "6", "seven": "7", "eight": "8", "nine": "9", "ten": "10",
+    "eleven": "11", "twelve": "12", "thirteen": "13",
+}
+_TOKEN_MAP = {**ROMAN_NUMERALS, **NUMBER_WORDS}
+
+# Words that tell a sequel, part or chapter from its siblings. Numbers (roman
+# numerals and number words included) count as well; see distinct_titles().
+SEQUEL_MARKERS = frozenset(
+    "part chapter volume vol episode returns reloaded revolutions rises begins "
+    "origins resurrection revenge strikes".split()
+)
+
+# Minimum similarity for a fuzzy match to count, and the bonus/penalty from years
+MIN_SCORE = 0.75
+YEAR_BONUS = 0.1
+NEAR_YEAR_BONUS = 0.05
+YEAR_PENALTY = 0.15
+# Candidates must share this many of a query's rarest trigrams (see _candidates())
+PREFIX_OVERLAP = 2
+
+
+def normalize_title(title):
+    # Canonical form used for both exact and fuzzy matching:
+    # unicode folded, lower-case, "&" -> "and", apostrophes dropped, other punctuation
+    # collapsed, roman numerals and number words as digits, leading article removed.
+    # Example: "Ocean's Eleven" -> "oceans 11", "Amélie" -> "amelie", "Rocky II" -> "rocky 2"
+    if not title:
+        return ""
+    folded = unicodedata.normalize("NFKD", title)
+    folded = "".join(c for c in folded if not unicodedata.combining(c))
+    folded = folded.lower().replace("&", " and ")
+    folded = re.sub(r"['’`]", "", folded)
+    folded = re.sub(r"[^\w\s]|_", " ", folded)
+    tokens = [_TOKEN_MAP.get(token, token) for token in folded.split()]
+    if len(tokens) > 1 and tokens[0] in ARTICLES:
+        tokens = tokens[1:]
+    return " ".join(tokens)
+
+
+def _markers(tokens):
+    return sorted(token for token in tokens if token.isdigit() or token in SEQUEL_MARKERS)
+
+
+def _singular(token):
+    return token[:-1] if len(token) > 3 and token.endswith("s") else token
+
+
+def distinct_titles(a, b):
+    # True when two normalized titles name different films despite their
+    # similarity: their numbers or sequel markers differ (Rocky 2 / Rocky 3,
+    # Deathly Hallows Part 1 / Part 2), or they differ only by a plural
+    # (Alien / Aliens).
+    tokens_a, tokens_b = a.split(), b.split()
+    if _markers(tokens_a) != _markers(tokens_b):
+        return True
+    return tokens_a != tokens_b and [_singular(t) for t in tokens_a] == [
+        _singular(t) for t in tokens_b
+    ]
+
+
+def trigrams(normalized):
+    padded = f"  {normalized} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleMatcher:
+    # Ranked fuzzy lookup over a set of titles using a trigram inverted index.
+    # Titles are normalized once at build time. A query only walks the posting
+    # lists of its rarest trigrams (prefix filtering: any title that can reach
+    # the minimum score must share at least one of them), then counts the
+    # trigrams each candidate shares with it.
+    # Trigrams are numbered as they are first seen; each entry keeps its trigram
+    # ids as a slice of one flat array, so counting the shared ones is a single
+    # set intersection and the index stays small for very large libraries.
+
+    def __init__(self):
+        self.keys = []  # entry id -> caller's key (e.g. ratingKey)
+        self.years = array("H")  # entry id -> year, 0 if unknown
+        self.undated = 0  # number of entries without a year
+        self.titles = []  # entry id -> normalized title
+        self.gram_ids = {}  # trigram -> trigram id
+        self.grams = array("I")  # trigram ids of every entry, one after another
+        self.offsets = array("I", [0])  # entry id -> its slice of grams
+        self.sizes = array("H")  # entry id -> number of trigrams
+        self.postings = defaultdict(lambda: array("I"))  # trigram -> entry ids
+        self._year_sorted = set()  # trigrams whose posting list is ordered by year
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, title, year=None):
+        normalized = normalize_title(title)
+        if not normalized:
+            return
+        grams = trigrams(normalized)
+        entry = len(self.keys)
+        self.keys.append(key)
+        self.years.append(year or 0)
+        self.undated += not year
+        self.titles.append(normalized)
+        gram_ids = self.gram_ids
+        for gram in grams:
+            self.grams.append(gram_ids.setdefault(gram, len(gram_ids)))
+            self.postings[gram].append(entry)
+        self._year_sorted.difference_update(grams)
+        self.offsets.append(len(self.grams))
+        self.sizes.append(min(len(grams), 0xFFFF))
+
+    def search(self, title, year=None, limit=5, min_score=MIN_SCORE):
+        # Return up to `limit` (score, key) pairs, best first.
+        # Score is the Dice coefficient of trigram sets, adjusted by year agreement.
+        # Titles that are another film of a series (distinct_titles()) never match.
+        normalized = normalize_title(title)
+        if not normalized:
+            return []
+        grams = trigrams(normalized)
+        query_size = len(grams)
+        postings = self.postings
+        by_rarity = sorted(grams, key=lambda gram: len(postings.get(gram, ())))
+        gram_ids = self.gram_ids
+        query_ids = {gram_ids[gram] for gram in grams if gram in gram_ids}
+
+        # The year adjustment depends only on the entry's year, so entries are
+        # scanned in groups by the most it can add: the years around the query's,
+        # then unknown years, then every other year. Each group's Dice bar is the
+        # score to reach minus that adjustment, and once `limit` matches are in
+        # hand the score to reach is the worst of them, so later groups (and
+        # candidates whose size alone keeps them under it) are cut short.
+        if year:
+            adjustments = {
+                year: YEAR_BONUS,
+                year - 1: NEAR_YEAR_BONUS,
+                year + 1: NEAR_YEAR_BONUS,
+                0: 0.0,
+            }
+            other = -YEAR_PENALTY
+            groups = ((year - 1, year + 1, YEAR_BONUS), (0, 0, 0.0), (None, None, other))
+            if not self.undated:
+                groups = groups[::2]
+        else:
+            adjustments, other = {}, 0.0
+            groups = ((None, None, 0.0),)
+
+        entry_titles, entry_years = self.titles, self.years
+        entry_grams, offsets = self.grams, self.offsets
+        found = []  # min-heap of the best (score, entry) pairs so far
+        for low, high, adjustment in groups:
+            target = found[0][0] if len(found) >= limit else min_score
+            floor = max(target - adjustment, 0.01)
+            if floor > 1:
+                continue
+            candidates = self._candidates(by_rarity, floor, low, high)
+            if low is None and year:
+                # Years around the query's and unknown years were their own groups
+                candidates = [c for c in candidates if entry_years[c[0]] not in adjustments]
+            # A title of `size` trigrams sharing at most `most` can't beat this score
+            bounded = [
+                (
+                    2.0 * min(query_size, size, most) / (query_size + size)
+                    + adjustments.get(entry_years[entry], other),
+                    entry,
+                )
+                for entry, most, size in candidates
+            ]
+            bounded.sort(reverse=True)
+            for bound, entry in bounded:
+                if bound < target or (len(found) >= limit and bound < found[0][0]):
+                    break
+                start, end = offsets[entry], offsets[entry + 1]
+                shared = len(query_ids.intersection(entry_grams[start:end]))
+                score = 2.0 * shared / (query_size + end - start)
+                score += adjustments.get(entry_years[entry], other)
+                if score < min_score or (len(found) >= limit and (score, entry) < found[0]):
+                    continue
+                if distinct_titles(normalized, entry_titles[entry]):
+                    continue
+                if len(found) < limit:
+                    heapq.heappush(found, (score, entry))
+                else:
+                    heapq.heapreplace(found, (score, entry))
+        found.sort(reverse=True)
+        return [(round(score, 3), self.keys[entry]) for score, entry in found]
+
+    def _candidates(self, by_rarity, floor, low=None, high=None):
+        # Entries (with a year in low..high, if given) that could reach a Dice
+        # coefficient of `floor`. Dice >= t needs shared >= t*q/(2-t), and a title
+        # sharing that many has at least `overlap` of any q - needed + overlap query
+        # trigrams: counting over the rarest ones walks only short posting lists.
+        query_size = len(by_rarity)
+        # (less a hair, so float error can't push an exact boundary up a trigram)
+        needed = max(1, math.ceil(floor * query_size / (2 - floor) - 1e-9))
+        overlap = min(PREFIX_OVERLAP, needed)
+        counts = Counter()
+        for gram in by_rarity[: query_size - needed + overlap]:
+            if low is None:
+                posting = self.postings.get(gram)
+            else:
+                posting = self._by_year(gram)
+                key = self.years.__getitem__
+                posting = posting[
+                    bisect_left(posting, low, key=key) : bisect_right(posting, high, key=key)
+                ]
+            if posting:
+                counts.update(posting)
+        # (entry, most trigrams it can share, its trigram count); the trigrams left
+        # out can add at most needed - overlap to what it shares with the prefix
+        slack = needed - overlap
+        sizes = self.sizes
+        return [
+            (entry, count + slack, sizes[entry])
+            for entry, count in counts.items()
+            if count >= overlap
+        ]
+
+    def _by_year(self, gram):
+        # The gram's posting list ordered by year, so a range of years is one slice.
+        # Sorted on first use after the gram was last added to.
+        posting = self.postings.get(gram)
+        if posting is None:
+            return ()
+        if gram not in self._year_sorted:
+            posting = array("I", sorted(posting, key=self.years.__getitem__))
+            self.postings[gram] = posting
+            self._year_sorted.add(gram)
+        return posting
+
+    def best(self, title, year=None, min_score=MIN_SCORE):
+        results = self.search(title, year, limit=1, min_score=min_score)
+        return results[0][1] if results else None
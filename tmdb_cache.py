@@ -0,0 +1,164 @@
+import json
+import sqlite3
+import threading
+import time
+
+import requests
+
+DAY = 24 * 60 * 60
+
+# How long a response is served without asking TMDb again, by endpoint prefix.
+# Collection membership changes rarely; discover/search results drift faster.
+DEFAULT_TTLS = {
+    "/collection/": 7 * DAY,
+    "/discover/movie": DAY,
+    "/search/": DAY,
+    "/movie/": 3 * DAY,
+}
+DEFAULT_TTL = DAY
+# Evict least recently used responses once the stored bodies exceed this size
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    body TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+"""
+
+
+class CacheMiss(LookupError):
+    # Raised in offline mode when a response has never been cached
+    pass
+
+
+class ResponseCache:
+    # Persistent TMDb response cache keyed by endpoint path and query params.
+    # Fresh entries are served without a request; expired ones are revalidated with
+    # If-None-Match / If-Modified-Since, and served stale if the network is down.
+
+    def __init__(
+        self,
+        path,
+        ttls=None,
+        default_ttl=DEFAULT_TTL,
+        max_bytes=DEFAULT_MAX_BYTES,
+        offline=False,
+    ):
+        self.path = path
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    @staticmethod
+    def make_key(path, params):
+        # Credentials never belong in the key; callers add api_key when sending
+        items = sorted((k, str(v)) for k, v in (params or {}).items() if k != "api_key")
+        return path + "?" + "&".join(f"{k}={v}" for k, v in items)
+
+    def ttl_for(self, path):
+        for prefix, ttl in self.ttls.items():
+            if path.startswith(prefix):
+                return ttl
+        return self.default_ttl
+
+    def _lookup(self, key):
+        with self._lock:
+            return self._db.execute(
+                "SELECT body, etag, last_modified, fetched_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+
+    def _touch(self, key, refreshed=False):
+        now = time.time()
+        with self._lock:
+            if refreshed:
+                self._db.execute(
+                    "UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE key = ?",
+                    (now, now, key),
+                )
+            else:
+                self._db.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+            self._db.commit()
+
+    def _store(self, key, body, etag, last_modified):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, body, etag, last_modified, now, now, len(body)),
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        cursor = self._db.execute("SELECT key, size FROM responses ORDER BY accessed_at")
+        doomed = []
+        for key, size in cursor:
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def get_json(self, path, params, send):
+        # Return the decoded JSON body for path+params.
+        # `send(headers)` performs the real request and returns a requests.Response
+        # with status 200 or 304; it is only called when the cache can't answer.
+        key = self.make_key(path, params)
+        entry = self._lookup(key)
+
+        if entry is not None:
+            body, etag, last_modified, fetched_at = entry
+            if self.offline or time.time() - fetched_at < self.ttl_for(path):
+                self._touch(key)
+                return json.loads(body)
+        elif self.offline:
+            raise CacheMiss(f"No cached TMDb response for {key}")
+
+        headers = {}
+        if entry is not None:
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        try:
+            resp = send(headers)
+        except (requests.ConnectionError, requests.Timeout):
+            if entry is None:
+                raise
+            # Network is down: stale data beats no data
+            self._touch(key)
+            return json.loads(entry[0])
+
+        if resp.status_code == 304 and entry is not None:
+            self._touch(key, refreshed=True)
+            return json.loads(entry[0])
+
+        self._store(
+            key,
+            resp.text,
+            resp.headers.get("ETag"),
+            resp.headers.get("Last-Modified"),
+        )
+        return resp.json()
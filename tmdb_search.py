@@ -1,28 +1,201 @@
-from tmdbv3api import TMDb, Search, Collection
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+from clients import make_session
+
+TMDB_API_URL = "https://api.themoviedb.org/3"
+# TMDb serves at most 500 discover pages per query
+MAX_DISCOVER_PAGES = 500
+# Parallel page fetches per discover query; TMDb's request budget is enforced by
+# the session (clients.make_session -> rate_limit.HOST_BUDGETS)
+DISCOVER_CONCURRENCY = 8
+
+
+class TMDbMovie(
+    namedtuple("TMDbMovie", "id title original_title year genre_ids", defaults=((),))
+):
+    # A movie as returned by TMDb. Keeping the id lets the Plex side match
+    # through its tmdb:// GUIDs instead of searching by title; genre_ids (every
+    # list endpoint reports them) let composite sources filter by genre locally.
+    __slots__ = ()
+
+    @classmethod
+    def from_result(cls, data):
+        release_date = data.get("release_date") or ""
+        return cls(
+            data.get("id"),
+            data.get("title"),
+            data.get("original_title"),
+            int(release_date[:4]) if release_date[:4].isdigit() else None,
+            tuple(data.get("genre_ids") or ()),
+        )
+
+    def __str__(self):
+        return f"{self.title} ({self.year})" if self.year else self.title
+
+
+# What a movie belongs to on TMDb (ids), for routing it to collections
+MovieFacts = namedtuple("MovieFacts", "id collection companies keywords genres")
+
+
+def _raise_for_tmdb_error(resp):
+    # Surface auth and other HTTP errors explicitly
+    if resp.status_code == 401:
+        raise ValueError("TMDb authentication failed (invalid API key).")
+    # Include a short snippet of the response for debugging
+    snippet = ""
+    try:
+        snippet = resp.json().get("status_message", "")
+    except Exception:
+        snippet = resp.text[:200]
+    raise RuntimeError(f"TMDb error {resp.status_code}: {snippet}")
+
 
 class TMDbSearch:
-    def __init__(self, api_key):
-        self.tmdb = TMDb()
-        self.tmdb.api_key = api_key
-        self.tmdb.language = "en"
-        self.tmdb.debug = True
-        self.search = Search()
+    def __init__(
+        self,
+        api_key,
+        cache=None,
+        concurrency=DISCOVER_CONCURRENCY,
+        base_url=TMDB_API_URL,
+        session=None,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.language = "en-US"
+        # Optional tmdb_cache.ResponseCache shared by every endpoint below
+        self.cache = cache
+        self.concurrency = concurrency
+        # One keep-alive session for every TMDb request; pass clients.Clients' shared
+        # session to reuse its connections across TMDbSearch instances.
+        self.session = session or make_session("tmdb", pool_size=max(concurrency, 1))
 
-    def search_movies(self, keyword, limit=10):
-        results = self.search.movies(keyword)
-        movie_titles = []
+    def _get(self, path, params=None):
+        # GET a TMDb v3 endpoint and return its JSON body, through the cache if one is set.
+        params = {"language": self.language, **(params or {})}
+
+        def send(headers):
+            # 429s and 5xx are retried (honouring Retry-After) before this sees them
+            resp = self.session.get(
+                self.base_url + path,
+                params={**params, "api_key": self.api_key},
+                headers=headers,
+                timeout=10,
+            )
+            if resp.status_code not in (200, 304):
+                _raise_for_tmdb_error(resp)
+            return resp
+
+        with profiling.stage("tmdb." + path.strip("/").split("/")[0]):
+            if self.cache is None:
+                return send({}).json()
+            return self.cache.get_json(path, params, send)
+
+    def _iter_pages(self, path, params, max_pages=MAX_DISCOVER_PAGES, limit=None):
+        # Yield every page of a paged endpoint in order. Page 1 is yielded on its own;
+        # once the consumer asks for page 2, later pages are fetched ahead by the thread
+        # pool, but never more than `concurrency` beyond what the consumer has taken
+        # (nor more than the pages still needed to reach `limit` results), so a slow
+        # consumer holds back the fetches and memory stays flat however many pages there are.
+        def fetch_page(page):
+            return self._get(path, {**params, "page": page})
+
+        first = fetch_page(1)
+        total_pages = min(first.get("total_pages", 1), max_pages)
+        yield first
+        if total_pages <= 1:
+            return
+        per_page = len(first.get("results", [])) or 1
+        seen = per_page
+        pool = ThreadPoolExecutor(max_workers=min(self.concurrency, total_pages - 1))
+        pending = deque()
+        next_page = 2
+        try:
+            while pending or next_page <= total_pages:
+                ahead = self.concurrency
+                if limit is not None:
+                    ahead = min(ahead, max(1, -(-(limit - seen) // per_page)))
+                while next_page <= total_pages and len(pending) < ahead:
+                    pending.append(pool.submit(fetch_page, next_page))
+                    next_page += 1
+                data = pending.popleft().result()
+                seen += len(data.get("results", []))
+                yield data
+        finally:
+            # Consumer stopped early (or a page failed): drop what hasn't started
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
 
+    def iter_search_movies(self, keyword, limit=10):
+        # Search results across pages, stopping once `limit` movies were yielded
         count = 0
-        for movie in results:
-            if hasattr(movie, "title"):
-                movie_titles.append(movie.title)
-                count += 1
-            if count >= limit:
-                break
+        pages = self._iter_pages("/search/movie", {"query": keyword}, limit=limit)
+        try:
+            for data in pages:
+                for movie in data.get("results", []):
+                    if not movie.get("title"):
+                        continue
+                    yield TMDbMovie.from_result(movie)
+                    count += 1
+                    if limit is not None and count >= limit:
+                        return
+        finally:
+            pages.close()
 
-        return movie_titles
+    def search_movies(self, keyword, limit=10):
+        return list(self.iter_search_movies(keyword, limit))
+
+    def iter_collection_movies(self, collection_id):
+        # A collection is a single response; streamed for symmetry with discover
+        result = self._get(f"/collection/{collection_id}")
+        for movie in result.get("parts", []):
+            if movie.get("title"):
+                yield TMDbMovie.from_result(movie)
 
     def get_movies_from_collection(self, collection_id):
-        collection = Collection()
-        result = collection.details(collection_id)
-        return [movie["title"] for movie in result.get("parts", [])]
\ No newline at end of file
+        return list(self.iter_collection_movies(collection_id))
+
+    def iter_discover_movies(self, company_id=None, keyword_id=None, genre_id=None):
+        """
+        Streams movies from TMDb Discover using a company, keyword or genre, in page order.
+        Each may be a list of ids, matching any of them in a single query.
+        The first movies are yielded as soon as page 1 arrives; see _iter_pages().
+        Raises a clear exception on HTTP errors (e.g., invalid/expired API key).
+        """
+        params = {"sort_by": "popularity.desc"}
+        for param, value in (
+            ("with_companies", company_id),
+            ("with_keywords", keyword_id),
+            ("with_genres", genre_id),
+        ):
+            if isinstance(value, (list, tuple)):
+                value = "|".join(str(item) for item in value)
+            if value:
+                params[param] = value
+        pages = self._iter_pages("/discover/movie", params)
+        try:
+            for data in pages:
+                for movie in data.get("results", []):
+                    if movie.get("title"):
+                        yield TMDbMovie.from_result(movie)
+        finally:
+            pages.close()
+
+    def discover_movies(self, company_id=None, keyword_id=None, genre_id=None):
+        # Every discover result as a list; see iter_discover_movies()
+        return list(self.iter_discover_movies(company_id, keyword_id, genre_id))
+
+    def movie_facts(self, movie_id):
+        # Collection, production companies, keywords and genres of one movie, in one request
+        data = self._get(f"/movie/{movie_id}", {"append_to_response": "keywords"})
+        collection = data.get("belongs_to_collection") or {}
+        keywords = (data.get("keywords") or {}).get("keywords") or []
+        return MovieFacts(
+            data.get("id", movie_id),
+            collection.get("id"),
+            frozenset(company["id"] for company in data.get("production_companies") or []),
+            frozenset(keyword["id"] for keyword in keywords),
+            frozenset(genre["id"] for genre in data.get("genres") or []),
+        )